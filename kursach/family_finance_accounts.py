@@ -0,0 +1,223 @@
+"""Несколько счетов и семей: у каждого счета своя база данных со своим балансом.
+
+Реестр счетов - база accounts.db в каталоге счетов, рядом с ней файлы счетов
+account_<id>.db. Запись в разные счета идет в разные файлы и не ждет общей
+блокировки записи.
+
+Сводные отчеты выполняют агрегирующие запросы по всем выбранным счетам
+параллельно в пуле потоков и складывают частичные итоги: модуль sqlite3 отпускает
+GIL на время выполнения запроса, поэтому потоки работают одновременно, а
+результаты не нужно передавать между процессами. Каждое задание открывает свое
+соединение только для чтения, поэтому сводка не мешает записи в счета.
+"""
+import collections
+import os
+import sqlite3
+
+from family_finance_core import FamilyFinanceManager
+from family_finance_metrics import connection_factory, profiled_thread
+
+
+class AccountBook:
+    """Каталог счетов: реестр, базы счетов и сводные отчеты по ним.
+
+    Счета выбираются параметрами accounts (список названий) и household (семья);
+    без них отчет строится по всем счетам.
+    """
+    REGISTRY_FILE = "accounts.db"
+
+    def __init__(self, directory, profile=FamilyFinanceManager.DEFAULT_PROFILE,
+                 max_workers=None):
+        if profile not in FamilyFinanceManager.STORAGE_PROFILES:
+            raise ValueError(f"Неизвестный профиль хранения: {profile}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.profile = profile
+        self.max_workers = max_workers
+        self._executor = None
+        # Открытые на запись базы счетов {название: FamilyFinanceManager}
+        self._managers = {}
+        self.conn = sqlite3.connect(
+            os.path.join(directory, self.REGISTRY_FILE),
+            timeout=FamilyFinanceManager.BUSY_TIMEOUT, isolation_level=None,
+            factory=connection_factory())
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                household TEXT NOT NULL DEFAULT '',
+                path TEXT NOT NULL
+            )
+        """)
+
+    def add_account(self, name, household=""):
+        """Новый счет с пустой базой данных; возвращает FamilyFinanceManager счета."""
+        name = name.strip()
+        if not name:
+            raise ValueError("Пустое название счета")
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            try:
+                cursor = self.conn.execute(
+                    "INSERT INTO accounts (name, household, path) VALUES (?, ?, '')",
+                    (name, household))
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Счет «{name}» уже существует") from e
+            path = f"account_{cursor.lastrowid}.db"
+            self.conn.execute("UPDATE accounts SET path = ? WHERE id = ?",
+                              (path, cursor.lastrowid))
+            manager = FamilyFinanceManager(self._path(path), self.profile)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        self._managers[name] = manager
+        return manager
+
+    def _path(self, path):
+        """Путь к базе счета; в реестре хранится относительно каталога счетов."""
+        return os.path.join(self.directory, path)
+
+    def get_accounts(self, accounts=None, household=None):
+        """Счета по порядку создания: [(название, семья, путь к базе)]."""
+        query = "SELECT name, household, path FROM accounts WHERE 1=1"
+        params = []
+        if accounts is not None:
+            query += f" AND name IN ({', '.join('?' * len(accounts))})"
+            params.extend(accounts)
+        if household is not None:
+            query += " AND household = ?"
+            params.append(household)
+        rows = self.conn.execute(query + " ORDER BY id", params).fetchall()
+        missing = set(accounts or ()) - {name for name, _, _ in rows}
+        if missing:
+            raise ValueError(f"Неизвестный счет: {', '.join(sorted(missing))}")
+        return [(name, household, self._path(path)) for name, household, path in rows]
+
+    def account(self, name, read_only=False):
+        """База счета name для работы в текущем потоке.
+
+        Соединения на запись кэшируются; соединение только для чтения открывается
+        заново, его закрывает вызывающий код.
+        """
+        if not read_only and name in self._managers:
+            return self._managers[name]
+        (_, _, path), = self.get_accounts([name])
+        manager = FamilyFinanceManager(path, self.profile, read_only)
+        if not read_only:
+            self._managers[name] = manager
+        return manager
+
+    def _fan_out(self, report, accounts=None, household=None):
+        """report(manager) по каждому выбранному счету в пуле потоков: [(счет, результат)].
+
+        Запросы report выполняются вне транзакции: архивы лет подключаются и
+        отключаются по мере надобности, а SQLite не отключает базы внутри
+        транзакции. Архивы не меняются, поэтому каждый запрос согласован сам по
+        себе; запись в счет во время сводки может попасть только в часть ее итогов.
+        """
+        selected = self.get_accounts(accounts, household)
+        if self._executor is None:
+            # concurrent.futures загружается только для сводок, не замедляя запуск CLI
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(self.max_workers,
+                                                thread_name_prefix="finance-account")
+        paths = [path for _, _, path in selected]
+        results = self._executor.map(self._report_shard, paths, [report] * len(paths))
+        return list(zip([name for name, _, _ in selected], results))
+
+    def _report_shard(self, path, report):
+        with profiled_thread():
+            manager = FamilyFinanceManager(path, self.profile, read_only=True)
+            try:
+                return report(manager)
+            finally:
+                manager.close()
+
+    def get_balances(self, accounts=None, household=None):
+        """Балансы счетов: [(счет, баланс в копейках)]."""
+        return self._fan_out(FamilyFinanceManager.get_balance, accounts, household)
+
+    def get_income_expense_totals(self, accounts=None, household=None, **filters):
+        """Доходы и расходы выбранных счетов: (доход, расход)."""
+        totals = self._fan_out(lambda manager: manager.get_income_expense_totals(**filters),
+                               accounts, household)
+        return self._merge_totals(totals)
+
+    def get_expenses_by_category(self, accounts=None, household=None, **filters):
+        """Расходы выбранных счетов по названиям категорий, по убыванию суммы."""
+        parts = self._fan_out(lambda manager: manager.get_expenses_by_category(**filters),
+                              accounts, household)
+        return self._merge_categories(parts)
+
+    def get_totals_by_period(self, period="month", accounts=None, household=None, **filters):
+        """Доходы и расходы выбранных счетов по периодам: [(период, доход, расход)]."""
+        if period not in FamilyFinanceManager.PERIOD_FORMATS:
+            raise ValueError(f"Неизвестный период: {period}")
+        parts = self._fan_out(lambda manager: manager.get_totals_by_period(period, **filters),
+                              accounts, household)
+        return self._merge_periods(parts)
+
+    def summary(self, period="month", accounts=None, household=None, **filters):
+        """Сводка по выбранным счетам за один проход пула.
+
+        Возвращает словарь: balances [(счет, баланс)], balance, income, expense,
+        categories [(категория, расход)] и periods [(период, доход, расход)].
+        """
+        if period not in FamilyFinanceManager.PERIOD_FORMATS:
+            raise ValueError(f"Неизвестный период: {period}")
+
+        def report(manager):
+            return (manager.get_balance(), manager.get_income_expense_totals(**filters),
+                    manager.get_expenses_by_category(**filters),
+                    manager.get_totals_by_period(period, **filters))
+
+        parts = self._fan_out(report, accounts, household)
+        balances = [(name, balance) for name, (balance, _, _, _) in parts]
+        income, expense = self._merge_totals(
+            (name, totals) for name, (_, totals, _, _) in parts)
+        return {
+            "balances": balances,
+            "balance": sum(balance for _, balance in balances),
+            "income": income,
+            "expense": expense,
+            "categories": self._merge_categories(
+                (name, categories) for name, (_, _, categories, _) in parts),
+            "periods": self._merge_periods((name, periods) for name, (_, _, _, periods) in parts),
+        }
+
+    @staticmethod
+    def _merge_totals(parts):
+        income = expense = 0
+        for _, (part_income, part_expense) in parts:
+            income += part_income
+            expense += part_expense
+        return income, expense
+
+    @staticmethod
+    def _merge_categories(parts):
+        # Идентификаторы категорий у каждого счета свои, поэтому складываются по названию
+        expenses = collections.Counter()
+        for _, categories in parts:
+            for category, amount in categories:
+                expenses[category] += amount
+        return sorted(expenses.items(), key=lambda item: item[1], reverse=True)
+
+    @staticmethod
+    def _merge_periods(parts):
+        totals = collections.defaultdict(lambda: [0, 0])
+        for _, periods in parts:
+            for period, income, expense in periods:
+                totals[period][0] += income
+                totals[period][1] += expense
+        return [(period, income, expense) for period, (income, expense) in sorted(totals.items())]
+
+    def close(self):
+        """Остановка пула и закрытие баз счетов и реестра."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for manager in self._managers.values():
+            manager.close()
+        self._managers.clear()
+        self.conn.close()
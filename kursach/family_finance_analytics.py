@@ -0,0 +1,273 @@
+"""Колоночный снимок журнала транзакций в массивах NumPy для аналитики.
+
+Снимок хранит транзакции в непрерывных массивах: суммы в копейках (int64),
+даты (datetime64[s]) и коды категорий (int32) со словарем названий. Это в
+несколько раз компактнее списка кортежей, а группировки, скользящие суммы и
+процентили считаются векторно. Новые транзакции догружаются по id.
+
+Нужен пакет numpy.
+"""
+from operator import itemgetter
+
+import numpy as np
+
+# Единицы datetime64 для группировки по периодам
+PERIOD_UNITS = {"day": "D", "month": "M", "year": "Y"}
+
+
+class LedgerSnapshot:
+    """Снимок транзакций менеджера FamilyFinanceManager.
+
+    Массивы ids, amounts, timestamps и category_codes упорядочены по id;
+    categories[code] - название категории (None для доходов).
+    """
+    BATCH_SIZE = 65536
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.categories = []
+        self._codes = {}
+        self.clear()
+
+    def clear(self):
+        self.ids = np.empty(0, np.int64)
+        self.amounts = np.empty(0, np.int64)
+        self.timestamps = np.empty(0, "datetime64[s]")
+        self.category_codes = np.empty(0, np.int32)
+        self.watermark = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return (self.ids.nbytes + self.amounts.nbytes + self.timestamps.nbytes
+                + self.category_codes.nbytes)
+
+    def refresh(self):
+        """Загрузка транзакций с id больше последнего загруженного.
+
+        Если часть уже загруженных строк удалена, снимок загружается заново.
+        Возвращает количество добавленных строк.
+        """
+        cursor = self.manager.conn.cursor()
+        try:
+            # Число уже загруженных строк в базе: общее число из сводки monthly_totals
+            # и реестра архивов минус новые строки, чтобы не считать всю таблицу
+            cursor.execute(
+                "SELECT (SELECT COALESCE(SUM(count), 0) FROM monthly_totals)"
+                " + (SELECT COALESCE(SUM(row_count), 0) FROM archives)"
+                " - (SELECT COUNT(*) FROM transactions WHERE id > ?)", (self.watermark,))
+            if cursor.fetchone()[0] != len(self):
+                self.clear()
+        finally:
+            cursor.close()
+        chunks = []
+        for part in self.manager.partitions(
+                "SELECT transactions.id, name, amount, timestamp" + self.manager.PARTITION_FROM
+                + " WHERE transactions.id > ? ORDER BY transactions.id", (self.watermark,)):
+            while True:
+                rows = part.fetchmany(self.BATCH_SIZE)
+                if not rows:
+                    break
+                chunks.append(self._columns(rows))
+        if not chunks:
+            return 0
+        ids, amounts, timestamps, codes = (np.concatenate(column) for column in zip(*chunks))
+        # Части (основная база и архивы) упорядочены по id каждая в отдельности
+        order = np.argsort(ids, kind="stable")
+        self.ids = np.concatenate((self.ids, ids[order]))
+        self.amounts = np.concatenate((self.amounts, amounts[order]))
+        self.timestamps = np.concatenate((self.timestamps, timestamps[order]))
+        self.category_codes = np.concatenate((self.category_codes, codes[order]))
+        self.watermark = int(self.ids[-1])
+        return len(ids)
+
+    def _columns(self, rows):
+        """Пачка строк (id, категория, сумма, дата) в массивы столбцов."""
+        count = len(rows)
+        ids = np.fromiter(map(itemgetter(0), rows), np.int64, count=count)
+        amounts = np.fromiter(map(itemgetter(2), rows), np.int64, count=count)
+        timestamps = np.array(list(map(itemgetter(3), rows)), dtype="datetime64[s]")
+        codes = np.fromiter(map(self.category_code, map(itemgetter(1), rows)), np.int32,
+                            count=count)
+        return ids, amounts, timestamps, codes
+
+    def category_code(self, name):
+        """Код категории, новая категория получает следующий код."""
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.categories)
+            self.categories.append(name)
+        return code
+
+    def mask(self, date_from=None, date_to=None, category=None, kind=None):
+        """Булев массив строк, подходящих под фильтры (как у FamilyFinanceManager).
+
+        date_to включается целиком; kind - "income" или "expense".
+        """
+        selected = np.ones(len(self), dtype=bool)
+        if date_from:
+            selected &= self.timestamps >= np.datetime64(date_from, "s")
+        if date_to:
+            selected &= self.timestamps < np.datetime64(date_to, "D") + np.timedelta64(1, "D")
+        if category is not None:
+            code = self._codes.get(category)
+            if code is None:
+                return np.zeros(len(self), dtype=bool)
+            selected &= self.category_codes == code
+        if kind == "income":
+            selected &= self.amounts > 0
+        elif kind == "expense":
+            selected &= self.amounts < 0
+        return selected
+
+    def _period_index(self, period, selected):
+        """Номера периодов выбранных строк от первого периода и сам первый период."""
+        if period not in PERIOD_UNITS:
+            raise ValueError(f"Неизвестный период: {period}")
+        periods = self.timestamps[selected].astype(f"datetime64[{PERIOD_UNITS[period]}]")
+        first = periods.min()
+        return (periods - first).astype(np.int64), first
+
+    @staticmethod
+    def _sums(index, weights, size=0):
+        # Суммы через float64 точны, пока итог меньше 2**53 копеек
+        return np.rint(np.bincount(index, weights=weights, minlength=size)).astype(np.int64)
+
+    def group_by(self, by="category", kind="expense", **filters):
+        """Сумма по категориям или периодам (day, month, year): {ключ: копейки}.
+
+        Для расходов суммы положительные.
+        """
+        selected = self.mask(kind=kind, **filters)
+        if not selected.any():
+            return {}
+        amounts = self.amounts[selected]
+        if kind == "expense":
+            amounts = -amounts
+        if by == "category":
+            sums = self._sums(self.category_codes[selected], amounts, len(self.categories))
+            counts = np.bincount(self.category_codes[selected], minlength=len(self.categories))
+            return {self.categories[code]: int(sums[code]) for code in np.flatnonzero(counts)}
+        index, first = self._period_index(by, selected)
+        sums = self._sums(index, amounts)
+        counts = np.bincount(index)
+        return {str(first + offset): int(sums[offset]) for offset in np.flatnonzero(counts)}
+
+    def totals_by_period(self, period="month", **filters):
+        """Доходы и расходы по периодам: [(период, доход, расход)], как get_totals_by_period."""
+        selected = self.mask(**filters)
+        if not selected.any():
+            return []
+        index, first = self._period_index(period, selected)
+        amounts = self.amounts[selected]
+        income = self._sums(index, np.maximum(amounts, 0))
+        expense = self._sums(index, np.maximum(-amounts, 0))
+        counts = np.bincount(index)
+        return [(str(first + offset), int(income[offset]), int(expense[offset]))
+                for offset in np.flatnonzero(counts)]
+
+    def period_series(self, period="month", kind=None, start=None, end=None, **filters):
+        """Сплошной ряд сумм по периодам: (периоды datetime64, суммы в копейках со знаком).
+
+        Периоды без операций входят в ряд с нулевой суммой. start и end (datetime64
+        единицы периода) задают границы ряда, иначе берутся первый и последний период
+        выбранных строк.
+        """
+        if period not in PERIOD_UNITS:
+            raise ValueError(f"Неизвестный период: {period}")
+        unit = f"datetime64[{PERIOD_UNITS[period]}]"
+        selected = self.mask(kind=kind, **filters)
+        periods = self.timestamps[selected].astype(unit)
+        if start is None or end is None:
+            if not len(periods):
+                return np.empty(0, unit), np.empty(0, np.int64)
+            start = periods.min() if start is None else start
+            end = periods.max() if end is None else end
+        length = max(int((end - start).astype(np.int64)) + 1, 0)
+        index = (periods - start).astype(np.int64)
+        inside = (index >= 0) & (index < length)
+        sums = self._sums(index[inside], self.amounts[selected][inside], length)
+        return start + np.arange(length), sums
+
+    @staticmethod
+    def _rolling(series, window, average=False):
+        """Скользящая сумма сплошного ряда series за window периодов или, при average,
+        скользящее среднее, у которого первые window - 1 значений - NaN."""
+        totals = np.cumsum(series)
+        totals[window:] = totals[window:] - totals[:-window]
+        if not average:
+            return totals
+        averages = totals / window
+        averages[:window - 1] = np.nan
+        return averages
+
+    def rolling_sum(self, window, period="day", kind=None, **filters):
+        """Скользящая сумма за window периодов: (периоды datetime64, суммы в копейках)."""
+        periods, series = self.period_series(period, kind, **filters)
+        return periods, self._rolling(series, window)
+
+    def moving_average(self, window, period="month", kind=None, **filters):
+        """Скользящее среднее за window периодов; первые window - 1 значений - NaN."""
+        periods, series = self.period_series(period, kind, **filters)
+        return periods, self._rolling(series, window, average=True)
+
+    def percentiles(self, q, kind="expense", **filters):
+        """Процентили модуля суммы операций в копейках (ближайшее значение выборки)."""
+        selected = self.mask(kind=kind, **filters)
+        if not selected.any():
+            return np.zeros(np.shape(q), dtype=np.int64)
+        return np.percentile(np.abs(self.amounts[selected]), q, method="nearest")
+
+    def running_balance(self):
+        """Баланс после каждой транзакции в порядке id."""
+        return np.cumsum(self.amounts)
+
+    def balance_by_time(self):
+        """Баланс во времени: (даты по возрастанию, баланс после каждой транзакции)."""
+        order = np.argsort(self.timestamps, kind="stable")
+        return self.timestamps[order], np.cumsum(self.amounts[order])
+
+    def monthly_trends(self, category=None, windows=(3, 12)):
+        """Данные для графика динамики по месяцам.
+
+        Возвращает словарь: months, income, expense (в копейках) и moving_averages -
+        {окно: скользящее среднее расходов категории category или всех расходов}.
+        """
+        months, income = self.period_series("month", kind="income")
+        if not len(months):
+            months = np.empty(0, "datetime64[M]")
+            return {"months": months, "income": income, "expense": income, "moving_averages": {}}
+        start, end = months[0], months[-1]
+        expense = -self.period_series("month", kind="expense", start=start, end=end)[1]
+        categorized = -self.period_series(
+            "month", kind="expense", start=start, end=end, category=category)[1]
+        moving_averages = {window: self._rolling(categorized, window, average=True)
+                           for window in windows}
+        return {"months": months, "income": income, "expense": expense,
+                "moving_averages": moving_averages}
+
+
+def downsample_minmax(x, y, buckets):
+    """Прореживание ряда для графика: минимум и максимум y в каждой из buckets корзин.
+
+    Сохраняет пики и провалы, которые потерялись бы при простом шаге; возвращает
+    не более 2 * buckets точек в исходном порядке. Для buckets меньше 1 (график
+    еще не получил ширину) используется одна корзина.
+    """
+    buckets = max(buckets, 1)
+    count = len(y)
+    if count <= 2 * buckets:
+        return x, y
+    size = -(-count // buckets)
+    padded = buckets * size
+    lows = np.full(padded, np.inf)
+    highs = np.full(padded, -np.inf)
+    lows[:count] = y
+    highs[:count] = y
+    base = np.arange(buckets) * size
+    indices = np.concatenate((base + lows.reshape(buckets, size).argmin(axis=1),
+                              base + highs.reshape(buckets, size).argmax(axis=1)))
+    indices = np.unique(indices[indices < count])
+    return x[indices], y[indices]
@@ -0,0 +1,1010 @@
+"""Проверки и замеры производительности менеджера семейных финансов.
+
+Запуск: python family_finance_bench.py [--db путь] <команда>
+
+Набор замеров с сохранением в JSON и сравнением с прошлым запуском:
+    python family_finance_bench.py suite --output base.json
+    python family_finance_bench.py suite --compare base.json --output new.json
+    python family_finance_bench.py compare base.json new.json
+
+Сводка по счетам в отдельных базах при росте их числа:
+    python family_finance_bench.py accounts --shards 1,2,4,8,16
+"""
+import argparse
+import datetime
+import functools
+import gc
+import json
+import multiprocessing
+import itertools
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from family_finance_accounts import AccountBook
+from family_finance_core import FamilyFinanceManager, format_amount
+from family_finance_io import export_transactions
+
+# Значения фильтров get_transactions, из которых составляются все комбинации
+FILTER_VALUES = {
+    "date_filter": [None, "2024-03-15"],
+    "category_filter": [None, "Продукты"],
+    "date_from": [None, "2024-01-01"],
+    "date_to": [None, "2024-06-30"],
+    "min_amount": [None, 10000],
+    "max_amount": [None, 500000],
+    "kind": [None, "income", "expense"],
+}
+
+
+def filter_combinations():
+    """Все непустые комбинации фильтров get_transactions."""
+    for values in itertools.product(*FILTER_VALUES.values()):
+        filters = {name: value for name, value in zip(FILTER_VALUES, values) if value is not None}
+        if filters:
+            yield filters
+
+
+def check_query_plans(manager):
+    """Проверка, что каждая комбинация фильтров выполняется по индексу.
+
+    Возвращает список (фильтры, план) для запросов с полным сканированием таблицы.
+    """
+    failures = []
+    for filters in filter_combinations():
+        plan = manager.explain_transactions_query(**filters)
+        if any(step.startswith("SCAN transactions") and "INDEX" not in step for step in plan):
+            failures.append((filters, plan))
+    return failures
+
+
+def run_plans(args):
+    manager = FamilyFinanceManager(args.db)
+    failures = check_query_plans(manager)
+    for filters, plan in failures:
+        print(f"Полное сканирование: {filters}\n    {'; '.join(plan)}")
+    total = sum(1 for _ in filter_combinations())
+    print(f"Проверено комбинаций фильтров: {total}, без индекса: {len(failures)}")
+    return 1 if failures else 0
+
+
+def sample_transactions(count, seed=42, start=None, step_minutes=3):
+    """Детерминированный набор (категория, сумма в копейках) с неотрицательным балансом.
+
+    Если задана дата start, к каждой транзакции добавляется дата с шагом step_minutes.
+    """
+    rng = random.Random(seed)
+    categories = ["Продукты", "Транспорт", "ЖКХ", "Развлечения", "Одежда"]
+    moment = datetime.datetime.fromisoformat(start) if start else None
+    step = datetime.timedelta(minutes=step_minutes)
+    for index in range(count):
+        if index % 4 == 0:
+            row = (None, rng.randint(100000, 500000))
+        else:
+            row = (rng.choice(categories), -rng.randint(100, 50000))
+        if moment is None:
+            yield row
+        else:
+            yield row + (moment.strftime("%Y-%m-%d %H:%M:%S"),)
+            moment += step
+
+
+def generate_ledger(count, categories=5, date_from="2022-01-01", date_to="2024-12-31", seed=42):
+    """Детерминированный журнал: (категория, сумма в копейках, дата, примечание).
+
+    count транзакций равномерно распределены по датам от date_from до date_to
+    включительно; каждая четвертая - доход, остальные - расходы по categories
+    категориям. Баланс не уходит в минус, одинаковый seed дает одинаковые данные.
+    """
+    rng = random.Random(seed)
+    names = FamilyFinanceManager.DEFAULT_CATEGORIES[:categories]
+    names += [f"Категория {number}" for number in range(len(names) + 1, categories + 1)]
+    start = datetime.datetime.fromisoformat(date_from)
+    span = (datetime.datetime.fromisoformat(date_to) + datetime.timedelta(days=1) - start)
+    step = span.total_seconds() / max(count, 1)
+    for index in range(count):
+        moment = start + datetime.timedelta(seconds=int(index * step))
+        timestamp = moment.strftime("%Y-%m-%d %H:%M:%S")
+        if index % 4 == 0:
+            yield None, rng.randint(100000, 500000), timestamp, "Зарплата"
+        else:
+            category = rng.choice(names)
+            yield category, -rng.randint(100, 50000), timestamp, f"{category} чек {index}"
+
+
+def fresh_manager(path, profile=FamilyFinanceManager.DEFAULT_PROFILE):
+    """Менеджер на пустой базе данных."""
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+    return FamilyFinanceManager(path, profile)
+
+
+def scratch_command(function):
+    """Команда замера на свежих базах во временном каталоге.
+
+    function(args, directory) создает базы в directory, закрывает их и возвращает
+    None при успехе или текст проблемы. Печатается OK или этот текст, каталог
+    удаляется вместе с базами; результат - код выхода.
+    """
+    @functools.wraps(function)
+    def run(args):
+        with tempfile.TemporaryDirectory(prefix="finance_bench_") as directory:
+            problem = function(args, directory)
+        print("OK" if problem is None else problem)
+        return 0 if problem is None else 1
+    return run
+
+
+@scratch_command
+def run_bulk(args, directory):
+    rows = list(sample_transactions(args.rows))
+    path = os.path.join(directory, "bulk.db")
+
+    manager = fresh_manager(path)
+    start = time.perf_counter()
+    for category, amount in rows:
+        if amount > 0:
+            manager.add_income(amount)
+        else:
+            manager.add_expense(category, -amount)
+    per_row = time.perf_counter() - start
+    manager.close()
+
+    manager = fresh_manager(path)
+    start = time.perf_counter()
+    manager.add_transactions_bulk(rows)
+    bulk = time.perf_counter() - start
+    manager.close()
+
+    print(f"Строк: {args.rows}")
+    print(f"add_income/add_expense: {args.rows / per_row:12.0f} строк/с ({per_row:.3f} с)")
+    print(f"add_transactions_bulk:  {args.rows / bulk:12.0f} строк/с ({bulk:.3f} с)")
+    print(f"Ускорение: x{per_row / bulk:.1f}")
+
+
+def measure_profile(path, profile, rows, commits, lookups, batch_size=10000):
+    """Пропускная способность записи и чтения для профиля хранения: {замер: операций/с}."""
+    manager = fresh_manager(path, profile)
+    results = {}
+
+    start = time.perf_counter()
+    for offset in range(0, len(rows), batch_size):
+        manager.add_transactions_bulk(rows[offset:offset + batch_size])
+    results["bulk_rows"] = len(rows) / (time.perf_counter() - start)
+
+    # Отдельная фиксация на каждую транзакцию, как при вводе из интерфейса
+    start = time.perf_counter()
+    for _ in range(commits):
+        manager.add_income(100)
+    results["commits"] = commits / (time.perf_counter() - start)
+    manager.run_maintenance()
+
+    start = time.perf_counter()
+    scanned = sum(len(batch) for batch in manager.iter_transactions())
+    results["scan_rows"] = scanned / (time.perf_counter() - start)
+
+    rng = random.Random(0)
+    last_id = manager.last_insert_id
+    start = time.perf_counter()
+    for _ in range(lookups):
+        manager.get_transaction(rng.randint(1, last_id))
+    results["lookups"] = lookups / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    manager.get_totals_by_period("day")
+    results["aggregate_rows"] = scanned / (time.perf_counter() - start)
+    manager.close()
+    return results
+
+
+@scratch_command
+def run_profiles(args, directory):
+    """Сравнение профилей хранения на одном наборе данных."""
+    rows = list(sample_transactions(args.rows))
+    path = os.path.join(directory, "profile.db")
+    labels = {
+        "bulk_rows": "пакетная вставка, строк/с",
+        "commits": "вставка с фиксацией, операций/с",
+        "scan_rows": "чтение всех строк, строк/с",
+        "lookups": "чтение по id, запросов/с",
+        "aggregate_rows": "агрегация по дням, строк/с",
+    }
+    results = {profile: measure_profile(path, profile, rows, args.commits, args.lookups)
+               for profile in FamilyFinanceManager.STORAGE_PROFILES}
+    print(f"Строк: {args.rows}")
+    print(f"{'':34}" + "".join(f"{profile:>12}" for profile in results))
+    for key, label in labels.items():
+        print(f"{label:34}" + "".join(f"{values[key]:12.0f}" for values in results.values()))
+
+
+def stress_writer(path, seed, operations, results):
+    """Процесс записи: случайные доходы, расходы и пачки; отчет (сумма, строк, ошибки)."""
+    manager = FamilyFinanceManager(path)
+    rng = random.Random(seed)
+    categories = ["Продукты", "Транспорт", "ЖКХ"]
+    total, count, errors = 0, 0, []
+    for _ in range(operations):
+        choice = rng.random()
+        try:
+            if choice < 0.4:
+                amount = rng.randint(10000, 100000)
+                manager.add_income(amount)
+                total, count = total + amount, count + 1
+            elif choice < 0.9:
+                amount = rng.randint(5000, 80000)
+                if manager.add_expense(rng.choice(categories), amount):
+                    total, count = total - amount, count + 1
+            else:
+                batch = [(None, 30000)] + [(rng.choice(categories), -rng.randint(5000, 40000))
+                                           for _ in range(rng.randint(1, 5))]
+                try:
+                    count += manager.add_transactions_bulk(batch)
+                    total += sum(amount for _, amount in batch)
+                except ValueError:
+                    pass  # Недостаточно средств: пачка откатывается целиком
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+    manager.close()
+    results.put(("writer", total, count, errors))
+
+
+def stress_reader(path, stop, results):
+    """Процесс чтения: проверка инвариантов по согласованным снимкам до сигнала stop."""
+    manager = FamilyFinanceManager(path, read_only=True)
+    checks, violations = 0, []
+    while not stop.is_set():
+        with manager.read_snapshot():
+            balance, ledger_total = manager.verify_balance()
+            drift = manager.verify_monthly_totals()
+        if balance != ledger_total:
+            violations.append(f"баланс {balance} != сумме транзакций {ledger_total}")
+        if balance < 0:
+            violations.append(f"отрицательный баланс {balance}")
+        if drift:
+            violations.append(f"расхождения сводки: {drift[:3]}")
+        checks += 1
+    manager.close()
+    results.put(("reader", checks, violations))
+
+
+@scratch_command
+def run_stress(args, directory):
+    """N процессов записи и M процессов чтения на одной базе, затем проверка инвариантов."""
+    path = os.path.join(directory, "stress.db")
+    fresh_manager(path).close()
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    writers = [multiprocessing.Process(target=stress_writer,
+                                       args=(path, seed, args.operations, results))
+               for seed in range(args.writers)]
+    readers = [multiprocessing.Process(target=stress_reader, args=(path, stop, results))
+               for _ in range(args.readers)]
+    start = time.perf_counter()
+    for process in readers + writers:
+        process.start()
+    reports = [results.get() for _ in writers]
+    stop.set()
+    reports += [results.get() for _ in readers]
+    for process in readers + writers:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    problems = []
+    expected_total = sum(report[1] for report in reports if report[0] == "writer")
+    expected_count = sum(report[2] for report in reports if report[0] == "writer")
+    for report in reports:
+        problems.extend(report[3] if report[0] == "writer" else report[2])
+    checks = sum(report[1] for report in reports if report[0] == "reader")
+
+    manager = FamilyFinanceManager(path)
+    balance, ledger_total = manager.verify_balance()
+    manager.cursor.execute("SELECT COUNT(*) FROM transactions")
+    count = manager.cursor.fetchone()[0]
+    # Транзакции фиксируются по очереди, поэтому баланс не может уйти в минус ни в какой момент
+    manager.cursor.execute(
+        "SELECT MIN(running) FROM (SELECT SUM(amount) OVER (ORDER BY id) AS running"
+        " FROM transactions)")
+    lowest = manager.cursor.fetchone()[0] or 0
+    if manager.verify_monthly_totals():
+        problems.append("сводка monthly_totals расходится с транзакциями")
+    manager.close()
+    if balance != expected_total or ledger_total != expected_total:
+        problems.append(f"баланс {balance}, сумма {ledger_total}, ожидалось {expected_total}")
+    if count != expected_count:
+        problems.append(f"транзакций {count}, ожидалось {expected_count}")
+    if lowest < 0:
+        problems.append(f"промежуточный баланс уходил в минус: {lowest}")
+
+    print(f"Процессов записи: {args.writers}, чтения: {args.readers}, за {elapsed:.1f} с")
+    print(f"Транзакций: {count}, баланс: {format_amount(balance)}, проверок чтения: {checks}")
+    for problem in problems[:20]:
+        print(f"Нарушение: {problem}")
+    return f"Нарушений: {len(problems)}" if problems else None
+
+
+@scratch_command
+def run_money(args, directory):
+    """Точность сумм в копейках против float и скорость суммирования в Python и NumPy."""
+    path = os.path.join(directory, "money.db")
+    manager = fresh_manager(path)
+    # Много мелких доходов по 0.10 руб.: на float сумма накапливает ошибку округления
+    manager.add_transactions_bulk((None, 10) for _ in range(args.rows))
+    expected = args.rows * 10
+    float_total = 0.0
+    for _ in range(args.rows):
+        float_total += 0.1
+    balance, ledger_total = manager.verify_balance()
+    print(f"Строк по 0.10 руб.: {args.rows}")
+    print(f"Сумма в копейках: {format_amount(ledger_total)}, баланс: {format_amount(balance)}")
+    print(f"Сумма на float: {float_total!r} (ожидалось {format_amount(expected)})")
+
+    manager.add_transactions_bulk(sample_transactions(args.rows))
+    start = time.perf_counter()
+    python_total = sum(row[1] for row in manager.get_transactions())
+    python_time = time.perf_counter() - start
+    try:
+        start = time.perf_counter()
+        numpy_total = int(manager.get_amounts_array().sum())
+        numpy_time = time.perf_counter() - start
+    except ValueError as e:
+        print(e)
+        numpy_total, numpy_time = python_total, None
+    manager.close()
+    print(f"Сумма по списку кортежей: {python_time * 1000:.0f} мс")
+    if numpy_time is not None:
+        print(f"Сумма по массиву int64:   {numpy_time * 1000:.0f} мс")
+    ok = balance == ledger_total == expected and numpy_total == python_total
+    return None if ok else "Суммы не совпадают"
+
+
+def timed(function, *args, **kwargs):
+    """Результат вызова и время выполнения в миллисекундах."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+@scratch_command
+def run_budget(args, directory):
+    """Проверка лимита по счетчикам в памяти против пересчета расходов месяца запросом."""
+    path = os.path.join(directory, "budget.db")
+    manager = fresh_manager(path)
+    month_start = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-01")
+    # Вся история в текущем месяце: пересчету придется читать все расходы категории
+    manager.add_transactions_bulk(
+        sample_transactions(args.rows, start=month_start, step_minutes=0.01))
+    manager.set_budget("Продукты", 10 ** 12)
+
+    _, status_ms = timed(lambda: [manager.budget_status("Продукты", 100)
+                                  for _ in range(args.checks)])
+    _, rescan_ms = timed(lambda: [manager.cursor.execute(
+        "SELECT -SUM(amount) FROM transactions WHERE category_id = ? AND timestamp >= ?",
+        (manager.category_id("Продукты"), month_start)).fetchone() for _ in range(args.checks)])
+    _, add_ms = timed(lambda: [manager.add_expense("Продукты", 100) for _ in range(args.checks)])
+    spent, limit, _ = manager.budget_status("Продукты")
+    manager.cursor.execute(
+        "SELECT -SUM(amount) FROM transactions WHERE category_id = ? AND timestamp >= ?",
+        (manager.category_id("Продукты"), month_start))
+    actual = manager.cursor.fetchone()[0]
+    manager.close()
+    print(f"Строк за месяц: {args.rows}, проверок: {args.checks}")
+    print(f"budget_status:          {status_ms * 1000 / args.checks:8.1f} мкс на проверку")
+    print(f"Пересчет запросом SUM:  {rescan_ms * 1000 / args.checks:8.1f} мкс на проверку")
+    print(f"add_expense с проверкой:{add_ms * 1000 / args.checks:8.1f} мкс на расход")
+    return None if spent == actual else f"Счетчик {spent} не совпадает с суммой {actual}"
+
+
+@scratch_command
+def run_search(args, directory):
+    """Время полнотекстового поиска по примечаниям на большом журнале."""
+    payees = ["Пятёрочка", "Магнит", "Перекрёсток", "Яндекс Такси", "Метро", "Мосэнергосбыт",
+              "Кинотеатр Октябрь", "Спортмастер", "Аптека Ригла", "Кофейня", "Ozon"]
+    rng = random.Random(7)
+    path = os.path.join(directory, "search.db")
+    manager = fresh_manager(path, "fast")
+    rows = ((category, amount, timestamp,
+             "Зарплата" if amount > 0 else f"{rng.choice(payees)} чек {rng.randint(1, 99999)}")
+            for category, amount, timestamp in sample_transactions(args.rows, start="2020-01-01"))
+    _, load_ms = timed(manager.add_transactions_bulk, rows)
+    print(f"Строк: {args.rows}, загрузка с индексом: {load_ms / 1000:.1f} с")
+    worst = 0
+    for text in ["п", "пя", "пятё", "пятёрочка", "такси", "продукты", "магнит чек 12", "12345",
+                 "нет такого"]:
+        manager.search_transactions(text)
+        times = sorted(timed(manager.search_transactions, text)[1] for _ in range(args.repeat))
+        found = len(manager.search_transactions(text))
+        worst = max(worst, times[len(times) // 2])
+        print(f"{text!r:18} найдено {found:3}, медиана {times[len(times) // 2]:6.1f} мс,"
+              f" максимум {times[-1]:6.1f} мс")
+    manager.close()
+    return None if worst <= args.max_ms else f"Медиана больше {args.max_ms} мс"
+
+
+@scratch_command
+def run_archive(args, directory):
+    """Запросы до и после переноса закрытых лет в архивы: размер базы, время, совпадение."""
+    path = os.path.join(directory, "archive.db")
+    manager = fresh_manager(path, "fast")
+    # История заканчивается сегодня: последний год остается в основной базе
+    start = datetime.datetime.now() - datetime.timedelta(minutes=3 * args.rows)
+    manager.add_transactions_bulk(
+        sample_transactions(args.rows, start=start.strftime("%Y-%m-%d %H:%M:%S")))
+    manager.cursor.execute("SELECT MAX(timestamp) FROM transactions")
+    last = datetime.date.fromisoformat(manager.cursor.fetchone()[0][:10])
+    recent = (last - datetime.timedelta(days=30)).isoformat()
+    queries = {
+        "Последние 30 дней": lambda: manager.get_transactions(date_from=recent),
+        "Итоги за 30 дней": lambda: manager.get_income_expense_totals(date_from=recent),
+        "Страница с начала года": lambda: manager.get_transactions_page(
+            (f"{last.year}-01-01", 0), 500),
+        "Итоги по неделям": lambda: manager.get_totals_by_period("week"),
+        "Итоги по месяцам": lambda: manager.get_totals_by_period("month"),
+        "Первая страница": lambda: manager.get_transactions_page(None, 500),
+    }
+
+    def measure():
+        manager.vacuum()
+        results = {}
+        times = {}
+        for name, query in queries.items():
+            query()
+            results[name] = query()
+            times[name] = min(timed(query)[1] for _ in range(args.repeat))
+        return os.path.getsize(path), results, times
+
+    size_before, results_before, before = measure()
+    manager.cursor.execute("SELECT DISTINCT CAST(strftime('%Y', timestamp) AS INTEGER)"
+                           " FROM transactions ORDER BY 1")
+    years = [year for year, in manager.cursor.fetchall()
+             if year < datetime.datetime.now(datetime.timezone.utc).year]
+    _, archive_ms = timed(lambda: [manager.archive_year(year) for year in years])
+    size_after, results_after, after = measure()
+    balance, ledger_total = manager.verify_balance()
+    manager.close()
+
+    print(f"Строк: {args.rows}, в архив перенесены годы {years} за {archive_ms / 1000:.1f} с")
+    print(f"Основная база: {size_before / 2 ** 20:.1f} МБ -> {size_after / 2 ** 20:.1f} МБ")
+    for name in queries:
+        print(f"{name:24} {before[name]:8.1f} мс -> {after[name]:8.1f} мс")
+    mismatched = [name for name in queries if results_before[name] != results_after[name]]
+    for name in mismatched:
+        print(f"Результат изменился после архивирования: {name}")
+    ok = not mismatched and balance == ledger_total
+    return None if ok else "Данные не совпадают"
+
+
+@scratch_command
+def run_accounts(args, directory):
+    """Время сводки по счетам в зависимости от их числа: пул потоков и по очереди.
+
+    Каждый счет - args.rows транзакций; для сравнения те же строки в одной базе.
+    Сводка с date_from не по началу месяца читает транзакции, а не сводку месяцев.
+    """
+    counts = [int(count) for count in args.shards.split(",")]
+    if counts != sorted(counts):
+        return f"Числа счетов должны идти по возрастанию: {args.shards}"
+    filters = {"date_from": "2023-03-15"}
+    parallel = AccountBook(directory, "fast", args.workers)
+    sequential = AccountBook(directory, "fast", max_workers=1)
+    single = fresh_manager(os.path.join(directory, "single.db"), "fast")
+    print(f"Строк на счет: {args.rows}, процессоров: {os.cpu_count()}")
+    print(f"{'Счетов':>6} {'Строк':>9} {'Пул, мс':>9} {'По очереди, мс':>15} {'Одна база, мс':>14}")
+    ok = True
+    for count in counts:
+        for index in range(len(parallel.get_accounts()), count):
+            rows = list(generate_ledger(args.rows, seed=index))
+            parallel.add_account(f"Счет {index + 1}").add_transactions_bulk(rows)
+            single.add_transactions_bulk(rows)
+        accounts = [name for name, _, _ in parallel.get_accounts()]
+        summary = parallel.summary(accounts=accounts, **filters)
+        pool_ms = measure(lambda: parallel.summary(accounts=accounts, **filters),
+                          args.repeat)["median_ms"]
+        sequential_ms = measure(lambda: sequential.summary(accounts=accounts, **filters),
+                                args.repeat)["median_ms"]
+
+        def single_summary():
+            return (single.get_income_expense_totals(**filters),
+                    single.get_expenses_by_category(**filters),
+                    single.get_totals_by_period(**filters))
+
+        single_ms = measure(single_summary, args.repeat)["median_ms"]
+        totals, categories, periods = single_summary()
+        matches = ((summary["income"], summary["expense"]) == totals
+                   and sorted(summary["categories"]) == sorted(categories)
+                   and summary["periods"] == periods and summary["balance"] == single.balance)
+        ok = ok and matches
+        print(f"{count:6} {count * args.rows:9} {pool_ms:9.1f} {sequential_ms:15.1f}"
+              f" {single_ms:14.1f}{'' if matches else '  итоги не совпадают'}")
+
+    # Счет с архивами: их больше, чем подключается одновременно (MAX_ATTACHED_ARCHIVES)
+    years = FamilyFinanceManager.MAX_ATTACHED_ARCHIVES + 4
+    first_year = datetime.date.today().year - years
+    manager = parallel.add_account("С архивами")
+    manager.add_transactions_bulk(generate_ledger(
+        args.rows, date_from=f"{first_year}-01-01", date_to=datetime.date.today().isoformat()))
+    for year in range(first_year, first_year + years):
+        manager.archive_year(year)
+    # Без фильтров сводка читает все архивы
+    summary = parallel.summary(accounts=["С архивами"])
+    archived_ok = ((summary["income"], summary["expense"]) == manager.get_income_expense_totals()
+                   and summary["categories"] == manager.get_expenses_by_category()
+                   and summary["periods"] == manager.get_totals_by_period()
+                   and summary["balance"] == manager.balance)
+    print(f"Счет с {years} архивами лет: итоги {'совпадают' if archived_ok else 'не совпадают'}")
+    parallel.close()
+    sequential.close()
+    single.close()
+    if not archived_ok:
+        return "Сводка по счету с архивами не совпадает с его базой"
+    return None if ok else "Сводка по счетам не совпадает с одной базой"
+
+
+def measure(function, repeat):
+    """Прогрев и repeat замеров: {"median_ms", "min_ms", "max_ms"}."""
+    function()
+    times = [timed(function)[1] for _ in range(repeat)]
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "max_ms": max(times)}
+
+
+def suite_cases(manager, args):
+    """Замеры ядра: [(название, функция без аргументов, делитель на операцию)]."""
+    export_path = os.path.join(os.path.dirname(manager.db_file), "export.csv")
+    cases = [
+        ("add_income", lambda: [manager.add_income(100000) for _ in range(args.writes)],
+         args.writes),
+        ("add_expense", lambda: [manager.add_expense("Продукты", 100)
+                                 for _ in range(args.writes)], args.writes),
+    ]
+    for name, values in FILTER_VALUES.items():
+        for value in values:
+            if value is not None:
+                cases.append((f"get_transactions[{name}={value}]",
+                              lambda filters={name: value}: manager.get_transactions(**filters), 1))
+    cases.extend([
+        # Сумма расходов по категориям для графика (plot_expense_analysis): по сводке
+        # и по транзакциям, когда период не выражается целыми месяцами
+        ("get_expenses_by_category", manager.get_expenses_by_category, 1),
+        ("get_expenses_by_category[date_from=2023-01-15]",
+         lambda: manager.get_expenses_by_category(date_from="2023-01-15"), 1),
+        ("export_transactions[csv]", lambda: export_transactions(manager, export_path), 1),
+    ])
+    return cases
+
+
+def measure_table_update(path, repeat):
+    """Время update_transactions_table в окне без экрана (QPA offscreen) до отрисовки
+    первой страницы таблицы."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from family_finance_main import FinanceApp
+
+    app = QApplication.instance() or QApplication([])
+    window = FinanceApp(path)
+    window.show()
+    model = window.transactions_model
+
+    def update():
+        # Модель сбрасывается, первую страницу запрашивает таблица при отрисовке
+        window.update_transactions_table()
+        while not model.rowCount():
+            app.processEvents()
+        window.transactions_table.viewport().repaint()
+
+    result = measure(update, repeat)
+    window.close()
+    app.processEvents()
+    return result
+
+
+@scratch_command
+def run_suite(args, directory):
+    """Набор замеров на сгенерированном журнале; результаты в JSON, сравнение с базовым."""
+    path = os.path.join(directory, "suite.db")
+    manager = fresh_manager(path)
+    _, generate_ms = timed(manager.add_transactions_bulk, generate_ledger(
+        args.rows, args.categories, args.date_from, args.date_to, args.seed))
+    results = {}
+    for name, function, operations in suite_cases(manager, args):
+        result = measure(function, args.repeat)
+        results[name] = {key: value / operations for key, value in result.items()}
+        print(f"{name:52} {results[name]['median_ms']:10.3f} мс")
+    manager.close()
+    if not args.no_gui:
+        try:
+            results["update_transactions_table"] = measure_table_update(path, args.repeat)
+        except ImportError as e:
+            print(f"Замер окна пропущен: {e}")
+        else:
+            print(f"{'update_transactions_table':52} "
+                  f"{results['update_transactions_table']['median_ms']:10.3f} мс")
+    report = {
+        "meta": {
+            "rows": args.rows, "categories": args.categories, "date_from": args.date_from,
+            "date_to": args.date_to, "seed": args.seed, "repeat": args.repeat,
+            "writes": args.writes, "generate_s": round(generate_ms / 1000, 3),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(), "created": datetime.datetime.now().isoformat(
+                timespec="seconds"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare_reports(baseline, report, args.threshold, args.min_delta_ms):
+            return "Есть регрессии относительно базового запуска"
+    return None
+
+
+def compare_reports(baseline, current, threshold, min_delta_ms):
+    """Сравнение медиан двух отчетов suite; регрессия - замедление больше чем на
+    threshold (доля) и больше чем на min_delta_ms. Возвращает 1 при регрессиях."""
+    for key in ("rows", "categories", "date_from", "date_to", "seed", "writes"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"Параметры отличаются: {key} = {baseline['meta'].get(key)} "
+                  f"и {current['meta'].get(key)}")
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:52} {'':>10} -> {result['median_ms']:10.3f} мс  новый замер")
+            continue
+        before, after = base["median_ms"], result["median_ms"]
+        change = (after - before) / before if before else 0.0
+        regressed = change > threshold and after - before > min_delta_ms
+        if regressed:
+            regressions.append(name)
+        print(f"{name:52} {before:10.3f} -> {after:10.3f} мс {change:+8.1%}"
+              + ("  РЕГРЕССИЯ" if regressed else ""))
+    print(f"Регрессий (порог {threshold:.0%}): {len(regressions)}")
+    return 1 if regressions else 0
+
+
+def run_compare(args):
+    reports = []
+    for path in (args.baseline, args.current):
+        with open(path, encoding="utf-8") as file:
+            reports.append(json.load(file))
+    return compare_reports(*reports, args.threshold, args.min_delta_ms)
+
+
+def add_threshold_arguments(parser):
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимое замедление медианы, доля (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="меньшие замедления в мс считаются шумом")
+
+
+@scratch_command
+def run_analytics(args, directory):
+    """Снимок в массивах NumPy против списка кортежей: память, время отчетов, совпадение с SQL."""
+    from family_finance_analytics import LedgerSnapshot
+
+    path = os.path.join(directory, "analytics.db")
+    manager = fresh_manager(path)
+    # История заканчивается сегодня: последний год остается в основной базе
+    start = datetime.datetime.now() - datetime.timedelta(minutes=3 * args.rows)
+    manager.add_transactions_bulk(
+        sample_transactions(args.rows, start=start.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def traced_memory(load):
+        """Память, занятая результатом load(), по tracemalloc."""
+        tracemalloc.start()
+        result = load()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        return memory
+
+    tuples_memory = traced_memory(manager.get_transactions)
+    rows, load_tuples = timed(manager.get_transactions)
+
+    def tuples_report():
+        by_category, by_month = {}, {}
+        for category, amount, timestamp, _ in rows:
+            if amount < 0:
+                by_category[category] = by_category.get(category, 0) - amount
+                by_month[timestamp[:7]] = by_month.get(timestamp[:7], 0) - amount
+        return by_category, by_month
+
+    _, tuples_time = timed(tuples_report)
+    del rows
+
+    def load_snapshot():
+        snapshot = LedgerSnapshot(manager)
+        snapshot.refresh()
+        return snapshot
+
+    snapshot_memory = traced_memory(load_snapshot)
+    snapshot, load_time = timed(load_snapshot)
+
+    reports = {
+        "по категориям": lambda: snapshot.group_by("category"),
+        "по месяцам": lambda: snapshot.group_by("month"),
+        "доходы и расходы по месяцам": lambda: snapshot.totals_by_period("month"),
+        "скользящая сумма за 30 дней": lambda: snapshot.rolling_sum(30),
+        "процентили 50/90/99": lambda: snapshot.percentiles([50, 90, 99]),
+    }
+    print(f"Строк: {len(snapshot)}")
+    print(f"Список кортежей: загрузка {load_tuples:.0f} мс, память {tuples_memory // 1024} КБ, "
+          f"отчет по категориям и месяцам {tuples_time:.0f} мс")
+    print(f"Снимок NumPy:    загрузка {load_time:.0f} мс, память {snapshot_memory // 1024} КБ "
+          f"(массивы {snapshot.nbytes // 1024} КБ)")
+    for name, report in reports.items():
+        _, elapsed = timed(report)
+        print(f"  {name}: {elapsed:.1f} мс")
+
+    manager.add_transactions_bulk(sample_transactions(1000, seed=7, start="2024-06-01"))
+    added, refresh_time = timed(snapshot.refresh)
+    print(f"Догрузка {added} новых строк: {refresh_time:.1f} мс")
+
+    ok = (snapshot.group_by("category") == dict(manager.get_expenses_by_category())
+          and snapshot.totals_by_period("month") == manager.get_totals_by_period("month"))
+    manager.close()
+    return None if ok else "Итоги снимка не совпадают с SQL"
+
+
+@scratch_command
+def run_trends(args, directory):
+    """Время расчета и отрисовки графика динамики с прореживанием ряда баланса и без него."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from family_finance_analytics import LedgerSnapshot, downsample_minmax
+    from family_finance_charts import TrendChart
+
+    app = QApplication.instance() or QApplication([])
+    path = os.path.join(directory, "trends.db")
+    manager = fresh_manager(path)
+    # Шаг подобран так, чтобы история охватывала несколько лет
+    manager.add_transactions_bulk(
+        sample_transactions(args.rows, start="2015-01-01", step_minutes=5 * 10 ** 6 // args.rows))
+    snapshot = LedgerSnapshot(manager)
+    _, load_time = timed(snapshot.refresh)
+    trends, trends_time = timed(snapshot.monthly_trends, "Продукты")
+    (dates, balance), balance_time = timed(snapshot.balance_by_time)
+
+    chart = TrendChart()
+    chart.canvas.resize(1000, 700)
+    buckets = chart.pixel_width() // 2
+    (sampled_dates, sampled), downsample_time = timed(downsample_minmax, dates, balance, buckets)
+
+    def draw(series_dates, series):
+        chart.update(trends, series_dates, series, "Продукты")
+        chart.canvas.draw()
+
+    draw(sampled_dates, sampled)  # Прогрев кэшей шрифтов и трансформаций
+    _, sampled_draw = timed(draw, sampled_dates, sampled)
+    _, full_draw = timed(draw, dates, balance)
+    manager.close()
+    app.processEvents()
+    print(f"Строк: {len(snapshot)}, месяцев: {len(trends['months'])}")
+    print(f"Загрузка снимка: {load_time:.0f} мс")
+    print(f"Месячные итоги и скользящие средние: {trends_time:.1f} мс")
+    print(f"Баланс во времени: {balance_time:.1f} мс, прореживание до {len(sampled)} точек: "
+          f"{downsample_time:.1f} мс")
+    print(f"Отрисовка: {sampled_draw:.0f} мс с прореживанием, {full_draw:.0f} мс по всем точкам")
+    ok = len(sampled) <= 2 * buckets and sampled.max() == balance.max() and sampled.min() == balance.min()
+    return None if ok else "Прореживание потеряло экстремумы"
+
+
+def current_rss_kb():
+    """Текущий объем резидентной памяти процесса в КБ (Linux) или пиковый, если он недоступен."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@scratch_command
+def run_chart(args, directory):
+    """Фигура графика не должна пересоздаваться, а память - расти при добавлении транзакций."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from matplotlib.figure import Figure
+    from PyQt5.QtWidgets import QApplication
+    from family_finance_main import FinanceApp
+
+    def figure_count():
+        return sum(1 for obj in gc.get_objects() if isinstance(obj, Figure))
+
+    def wait(future):
+        while not future.done():
+            app.processEvents()
+        app.processEvents()
+
+    app = QApplication.instance() or QApplication([])
+    window = FinanceApp(os.path.join(directory, "chart.db"))
+    window.tabs.setCurrentWidget(window.charts_tab)
+    rows = list(sample_transactions(args.inserts))
+    # Прогрев: первые вставки создают категории и кэши matplotlib
+    for category, amount in rows[:50]:
+        wait(window.db.submit(lambda manager, c=category, a=amount: manager.add_transactions_bulk([(c, a)])))
+        window.plot_expense_analysis()
+    gc.collect()
+    figures_before, rss_before = figure_count(), current_rss_kb()
+    for category, amount in rows[50:]:
+        wait(window.db.submit(lambda manager, c=category, a=amount: manager.add_transactions_bulk([(c, a)])))
+        window.plot_expense_analysis()
+        wait(window.db.submit(lambda manager: None))
+    gc.collect()
+    figures_after, rss_after = figure_count(), current_rss_kb()
+    window.close()
+    print(f"Вставок: {len(rows) - 50}")
+    print(f"Фигур matplotlib: {figures_before} -> {figures_after}")
+    print(f"RSS, КБ: {rss_before} -> {rss_after} ({rss_after - rss_before:+d})")
+    ok = figures_after == figures_before and rss_after - rss_before < args.max_rss_growth_kb
+    return None if ok else "Обнаружен рост числа фигур или памяти"
+
+
+def run_importtime(args):
+    """Время импорта CLI по python -X importtime; PyQt5 и matplotlib загружаться не должны."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import family_finance_cli"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        return 1
+    # Строки вида "import time: self [us] | cumulative | imported package"
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    total_ms = modules["family_finance_cli"] / 1000
+    gui = sorted(name for name in modules if name.split(".")[0] in ("PyQt5", "matplotlib"))
+    print(f"Импорт family_finance_cli: {total_ms:.1f} мс (лимит {args.max_ms} мс)")
+    for name in gui:
+        print(f"Лишний импорт: {name}")
+    ok = total_ms < args.max_ms and not gui
+    print("OK" if ok else "Импорт CLI слишком медленный или тянет GUI")
+    return 0 if ok else 1
+
+
+# Запуск окна в отдельном процессе, чтобы в замер попали импорты модулей
+STARTUP_PROBE = """
+import json, sys
+from PyQt5.QtWidgets import QApplication
+import family_finance_main
+
+app = QApplication([])
+window = family_finance_main.FinanceApp(sys.argv[1])
+
+def finished(times):
+    times["matplotlib_loaded"] = "matplotlib" in sys.modules
+    print(json.dumps(times))
+    app.quit()
+
+window.startup_timer.finished.connect(finished)
+window.show()
+app.exec_()
+"""
+
+
+def run_startup(args):
+    """Время до первой отрисовки и до готовности окна; matplotlib при запуске не загружается."""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    runs = []
+    for _ in range(args.runs):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, os.path.abspath(args.db)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            print(result.stderr)
+            return 1
+        runs.append(json.loads(result.stdout.splitlines()[-1]))
+    for stage in ("first_paint", "interactive"):
+        times = sorted(run[stage] * 1000 for run in runs)
+        print(f"{stage}: медиана {times[len(times) // 2]:.0f} мс, "
+              f"мин {times[0]:.0f} мс, макс {times[-1]:.0f} мс")
+    loaded = any(run["matplotlib_loaded"] for run in runs)
+    if loaded:
+        print("matplotlib загружен до открытия вкладки Графики")
+    interactive = sorted(run["interactive"] * 1000 for run in runs)[len(runs) // 2]
+    ok = not loaded and interactive < args.max_ms
+    print("OK" if ok else f"Запуск медленнее {args.max_ms} мс или загружает графики")
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "finance_bench.db"),
+                        help="файл базы данных для проверок")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("plans", help="проверка использования индексов фильтрами")
+    bulk_parser = commands.add_parser("bulk", help="построчная и пакетная вставка, строк/с")
+    bulk_parser.add_argument("--rows", type=int, default=10000)
+    chart_parser = commands.add_parser("chart", help="число фигур и память после серии вставок")
+    chart_parser.add_argument("--inserts", type=int, default=1050)
+    chart_parser.add_argument("--max-rss-growth-kb", type=int, default=10240)
+    profiles_parser = commands.add_parser("profiles", help="запись и чтение для профилей хранения")
+    profiles_parser.add_argument("--rows", type=int, default=1000000)
+    profiles_parser.add_argument("--commits", type=int, default=2000)
+    profiles_parser.add_argument("--lookups", type=int, default=20000)
+    analytics_parser = commands.add_parser("analytics", help="колоночный снимок NumPy")
+    analytics_parser.add_argument("--rows", type=int, default=1000000)
+    trends_parser = commands.add_parser("trends", help="график динамики на многолетней истории")
+    trends_parser.add_argument("--rows", type=int, default=1000000)
+    budget_parser = commands.add_parser("budget", help="проверка лимитов бюджета")
+    budget_parser.add_argument("--rows", type=int, default=200000)
+    budget_parser.add_argument("--checks", type=int, default=1000)
+    search_parser = commands.add_parser("search", help="полнотекстовый поиск по примечаниям")
+    search_parser.add_argument("--rows", type=int, default=1000000)
+    search_parser.add_argument("--repeat", type=int, default=20)
+    search_parser.add_argument("--max-ms", type=float, default=100)
+    archive_parser = commands.add_parser("archive", help="запросы до и после архивирования лет")
+    archive_parser.add_argument("--rows", type=int, default=1000000)
+    archive_parser.add_argument("--repeat", type=int, default=5)
+    accounts_parser = commands.add_parser("accounts", help="сводка по счетам в отдельных базах")
+    accounts_parser.add_argument("--rows", type=int, default=50000, help="транзакций на счет")
+    accounts_parser.add_argument("--shards", default="1,2,4,8,16",
+                                 help="числа счетов через запятую, по возрастанию")
+    accounts_parser.add_argument("--workers", type=int, help="потоков пула")
+    accounts_parser.add_argument("--repeat", type=int, default=5)
+    suite_parser = commands.add_parser(
+        "suite", help="набор замеров на сгенерированном журнале, результаты в JSON")
+    suite_parser.add_argument("--rows", type=int, default=100000)
+    suite_parser.add_argument("--categories", type=int, default=5)
+    suite_parser.add_argument("--date-from", default="2022-01-01")
+    suite_parser.add_argument("--date-to", default="2024-12-31")
+    suite_parser.add_argument("--seed", type=int, default=42)
+    suite_parser.add_argument("--repeat", type=int, default=5)
+    suite_parser.add_argument("--writes", type=int, default=200,
+                              help="вызовов add_income/add_expense в одном замере")
+    suite_parser.add_argument("--no-gui", action="store_true", help="без замера окна")
+    suite_parser.add_argument("--output", help="файл JSON для результатов")
+    suite_parser.add_argument("--compare", help="файл JSON прошлого запуска для сравнения")
+    add_threshold_arguments(suite_parser)
+    compare_parser = commands.add_parser("compare", help="сравнение двух файлов JSON suite")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    add_threshold_arguments(compare_parser)
+    money_parser = commands.add_parser("money", help="точность и скорость денежных сумм")
+    money_parser.add_argument("--rows", type=int, default=1000000)
+    stress_parser = commands.add_parser("stress", help="параллельная запись и чтение из процессов")
+    stress_parser.add_argument("--writers", type=int, default=4)
+    stress_parser.add_argument("--readers", type=int, default=2)
+    stress_parser.add_argument("--operations", type=int, default=500)
+    importtime_parser = commands.add_parser("importtime", help="время импорта CLI без GUI")
+    importtime_parser.add_argument("--max-ms", type=float, default=100)
+    startup_parser = commands.add_parser("startup", help="время запуска окна")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.add_argument("--max-ms", type=float, default=1000)
+    args = parser.parse_args(argv)
+    handlers = {
+        "plans": run_plans,
+        "bulk": run_bulk,
+        "chart": run_chart,
+        "profiles": run_profiles,
+        "stress": run_stress,
+        "money": run_money,
+        "budget": run_budget,
+        "search": run_search,
+        "archive": run_archive,
+        "accounts": run_accounts,
+        "suite": run_suite,
+        "compare": run_compare,
+        "analytics": run_analytics,
+        "trends": run_trends,
+        "importtime": run_importtime,
+        "startup": run_startup,
+    }
+    return handlers[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Графики менеджера семейных финансов на matplotlib.
+
+Каждый график держит одну фигуру и один холст все время работы приложения:
+при обновлении данных меняются существующие элементы, а цвета темы задаются
+для конкретной фигуры, без изменения глобальных настроек matplotlib.
+"""
+import math
+
+import matplotlib
+import numpy
+from matplotlib.collections import PolyCollection
+from matplotlib.dates import date2num
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+
+from family_finance_core import MINOR_UNITS
+from family_finance_metrics import metrics
+
+# Цвета фона и текста графиков для тем интерфейса
+CHART_THEMES = {
+    "light": {"face": "white", "text": "black"},
+    "dark": {"face": "#2d2d2d", "text": "white"},
+}
+
+
+class TimedCanvas(FigureCanvas):
+    """Холст, время каждой отрисовки которого записывается в метрики как metric_name."""
+
+    def __init__(self, figure, metric_name):
+        super().__init__(figure)
+        self.metric_name = metric_name
+
+    def draw(self):
+        with metrics.timer(self.metric_name):
+            super().draw()
+
+
+class ExpensePieChart:
+    """Круговая диаграмма расходов по категориям."""
+    TITLE = "Распределение расходов по категориям"
+    START_ANGLE = 90
+    LABEL_DISTANCE = 1.1
+    PERCENT_DISTANCE = 0.6
+
+    def __init__(self, theme="light"):
+        self.figure = Figure(figsize=(8, 6))
+        self.canvas = TimedCanvas(self.figure, "График: расходы по категориям")
+        self.axes = self.figure.add_subplot(111)
+        self.theme = theme
+        self.categories = []
+        self.wedges = []
+        self.labels = []
+        self.percents = []
+        self.apply_theme(theme)
+
+    def update(self, expenses):
+        """Обновление диаграммы по суммам расходов {категория: сумма}.
+
+        Если набор категорий не изменился, секторы сдвигаются на месте,
+        иначе диаграмма перестраивается на тех же осях.
+        """
+        if self.wedges and set(expenses) == set(self.categories):
+            self._move_wedges([expenses[category] for category in self.categories])
+        else:
+            self._rebuild(expenses)
+        self.canvas.draw_idle()
+
+    def _rebuild(self, expenses):
+        self.axes.clear()
+        self.categories = list(expenses)
+        colors = matplotlib.colormaps["Pastel1"](range(len(self.categories)))
+        self.wedges, self.labels, self.percents = self.axes.pie(
+            list(expenses.values()), labels=self.categories, autopct='%1.1f%%',
+            startangle=self.START_ANGLE, labeldistance=self.LABEL_DISTANCE,
+            pctdistance=self.PERCENT_DISTANCE, colors=colors,
+            wedgeprops={'linewidth': 1, 'edgecolor': 'white'})
+        self.apply_theme(self.theme)
+
+    def _move_wedges(self, amounts):
+        """Пересчет углов секторов и положений подписей так же, как это делает Axes.pie."""
+        total = sum(amounts)
+        angle = self.START_ANGLE
+        for wedge, label, percent, amount in zip(self.wedges, self.labels, self.percents, amounts):
+            span = 360 * amount / total
+            wedge.set_theta1(angle)
+            wedge.set_theta2(angle + span)
+            middle = math.radians(angle + span / 2)
+            x, y = math.cos(middle), math.sin(middle)
+            label.set_position((self.LABEL_DISTANCE * x, self.LABEL_DISTANCE * y))
+            label.set_horizontalalignment("left" if x > 0 else "right")
+            percent.set_position((self.PERCENT_DISTANCE * x, self.PERCENT_DISTANCE * y))
+            percent.set_text(f"{100 * amount / total:1.1f}%")
+            angle += span
+
+    def apply_theme(self, theme):
+        """Цвета темы для этой фигуры."""
+        self.theme = theme
+        colors = CHART_THEMES[theme]
+        self.figure.set_facecolor(colors["face"])
+        self.axes.set_facecolor(colors["face"])
+        self.axes.set_title(self.TITLE, color=colors["text"])
+        for text in self.labels + self.percents:
+            text.set_color(colors["text"])
+        self.canvas.draw_idle()
+
+
+class TrendChart:
+    """Динамика по месяцам: доходы и расходы, скользящие средние расходов и баланс.
+
+    Ряд баланса приходит уже прореженным до ширины графика в пикселях.
+    """
+    TITLE = "Доходы и расходы по месяцам"
+    BALANCE_TITLE = "Баланс"
+    INCOME_COLOR = "#4caf50"
+    EXPENSE_COLOR = "#f44336"
+    BALANCE_COLOR = "#2196f3"
+    AVERAGE_COLORS = {3: "#ff9800", 12: "#9c27b0"}
+    # Ширина столбцов и положение доходов, расходов и средних от начала месяца, в днях
+    BAR_WIDTH = 8
+    INCOME_OFFSET = 11
+    EXPENSE_OFFSET = 19
+    AVERAGE_OFFSET = 15
+
+    def __init__(self, theme="light"):
+        self.figure = Figure(figsize=(8, 6), constrained_layout=True)
+        self.canvas = TimedCanvas(self.figure, "График: динамика")
+        self.bars_axes, self.balance_axes = self.figure.subplots(2, 1)
+        self.theme = theme
+        self.apply_theme(theme)
+
+    def pixel_width(self):
+        """Ширина области графика в пикселях, до нее прореживается ряд баланса."""
+        return max(int(self.balance_axes.bbox.width), 1)
+
+    def update(self, trends, balance_dates, balance, category=None):
+        """Перерисовка по данным LedgerSnapshot.monthly_trends и ряду баланса в копейках."""
+        self.bars_axes.clear()
+        self.balance_axes.clear()
+        months = trends["months"].astype("datetime64[D]")
+        self.bars_axes.xaxis_date()
+        self._add_bars(months, self.INCOME_OFFSET, trends["income"], self.INCOME_COLOR, "Доходы")
+        self._add_bars(months, self.EXPENSE_OFFSET, trends["expense"], self.EXPENSE_COLOR,
+                       "Расходы")
+        suffix = f": {category}" if category else ""
+        for window, averages in trends["moving_averages"].items():
+            self.bars_axes.plot(months + numpy.timedelta64(self.AVERAGE_OFFSET, "D"), averages / MINOR_UNITS,
+                                color=self.AVERAGE_COLORS.get(window),
+                                label=f"Среднее за {window} мес.{suffix}")
+        if len(months):
+            self.bars_axes.legend(loc="upper left", fontsize="small")
+        self.balance_axes.plot(balance_dates, balance / MINOR_UNITS, color=self.BALANCE_COLOR,
+                               linewidth=1)
+        self.apply_theme(self.theme)
+
+    def _add_bars(self, months, offset, amounts, color, label):
+        """Столбцы одной коллекцией: отдельный Rectangle на каждый месяц рисуется заметно дольше."""
+        centers = date2num(months) + offset
+        left = centers - self.BAR_WIDTH / 2
+        right = centers + self.BAR_WIDTH / 2
+        heights = amounts / MINOR_UNITS
+        zeros = numpy.zeros_like(heights)
+        vertices = numpy.stack([numpy.column_stack(point) for point in
+                                ((left, zeros), (left, heights), (right, heights), (right, zeros))],
+                               axis=1)
+        self.bars_axes.add_collection(
+            PolyCollection(vertices, facecolors=color, edgecolors="none", label=label))
+        self.bars_axes.autoscale_view()
+
+    def apply_theme(self, theme):
+        """Цвета темы для этой фигуры."""
+        self.theme = theme
+        colors = CHART_THEMES[theme]
+        self.figure.set_facecolor(colors["face"])
+        for axes, title in ((self.bars_axes, self.TITLE), (self.balance_axes, self.BALANCE_TITLE)):
+            axes.set_facecolor(colors["face"])
+            axes.set_title(title, color=colors["text"])
+            axes.tick_params(colors=colors["text"])
+            legend = axes.get_legend()
+            if legend is not None:
+                legend.get_frame().set_facecolor(colors["face"])
+                for text in legend.get_texts():
+                    text.set_color(colors["text"])
+        self.canvas.draw_idle()
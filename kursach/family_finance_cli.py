@@ -0,0 +1,339 @@
+"""Командная строка менеджера семейных финансов.
+
+Модуль не импортирует PyQt5 и matplotlib и подходит для скриптов и cron.
+
+Запуск: python family_finance_cli.py [--db путь] <команда> ...
+    add income 5000
+    add expense Продукты 350
+    list --date-from 2024-01-01 --category Продукты
+    search пятёр
+    summary --period month
+    budget Продукты 15000 --block
+    archive 2023
+    import выписка.csv
+    export данные.csv.gz
+
+Счета в отдельных базах: --accounts каталог [--account счет] <команда> ...
+    --accounts семья accounts --add Карта --household Ивановы
+    --accounts семья --account Карта add expense Продукты 350
+    --accounts семья summary --household Ивановы
+"""
+import argparse
+import csv
+import itertools
+import os
+import sqlite3
+import sys
+
+from family_finance_accounts import AccountBook
+from family_finance_core import (BudgetExceeded, FamilyFinanceManager, SchemaOutdated,
+                                 format_amount, to_minor_units)
+from family_finance_io import (DEFAULT_CSV_COLUMNS, EXPORT_FORMATS, EXPORT_HEADER,
+                               OFX_EXPENSE_CATEGORY, export_row, export_transactions,
+                               import_statement)
+from family_finance_metrics import start_session_profile
+
+READ_COMMANDS = ("list", "search", "summary", "export")
+
+
+def add_filter_arguments(parser):
+    """Общие для list, summary и export фильтры транзакций."""
+    parser.add_argument("--date-from", help="начальная дата YYYY-MM-DD")
+    parser.add_argument("--date-to", help="конечная дата YYYY-MM-DD включительно")
+    parser.add_argument("--category", dest="category_filter")
+
+
+def filters_from_args(args):
+    return {
+        "date_from": args.date_from,
+        "date_to": args.date_to,
+        "category_filter": args.category_filter,
+    }
+
+
+def report(percent):
+    print(f"\r{percent}%", end="", file=sys.stderr)
+
+
+def open_manager(db_file, profile, read_only):
+    """Менеджер базы; базу со старой схемой для команды чтения сначала обновляет
+    короткое соединение на запись, затем она открывается только для чтения."""
+    try:
+        return FamilyFinanceManager(db_file, profile, read_only)
+    except SchemaOutdated:
+        FamilyFinanceManager(db_file, profile).close()
+        return FamilyFinanceManager(db_file, profile, read_only)
+
+
+def run_add(manager, args):
+    if args.kind == "income":
+        added = manager.add_income(args.amount, args.note)
+    else:
+        if not args.category:
+            print("Для расхода нужна категория", file=sys.stderr)
+            return 1
+        try:
+            added = manager.add_expense(args.category, args.amount, args.note)
+        except BudgetExceeded as e:
+            print(f"Расход не добавлен: {e}", file=sys.stderr)
+            return 1
+    if not added:
+        print("Транзакция не добавлена: сумма должна быть положительной, "
+              "а расход не больше баланса", file=sys.stderr)
+        return 1
+    print(f"Баланс: {format_amount(manager.balance)} руб.")
+    if args.kind == "expense":
+        spent, limit, _ = manager.budget_status(args.category)
+        if limit is not None and spent > limit:
+            print(f"Превышен лимит категории «{args.category}»: {format_amount(spent)} "
+                  f"из {format_amount(limit)} руб. за месяц", file=sys.stderr)
+    return 0
+
+
+def run_list(manager, args):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(EXPORT_HEADER)
+    filters = filters_from_args(args)
+    if args.kind:
+        filters["kind"] = args.kind
+    for rows in manager.iter_transactions(**filters):
+        writer.writerows(itertools.starmap(export_row, rows))
+    return 0
+
+
+def run_search(manager, args):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(EXPORT_HEADER)
+    writer.writerows(export_row(*row[1:])
+                     for row in manager.search_transactions(args.text, args.limit))
+    return 0
+
+
+def run_summary(manager, args):
+    filters = filters_from_args(args)
+    income, expense = manager.get_income_expense_totals(**filters)
+    print(f"Баланс: {format_amount(manager.balance)} руб.")
+    print(f"Доходы: {format_amount(income)} руб.")
+    print(f"Расходы: {format_amount(expense)} руб.")
+    expenses = manager.get_expenses_by_category(**filters)
+    if expenses:
+        print("\nРасходы по категориям:")
+        for category, amount in expenses:
+            print(f"  {category or 'Без категории'}: {format_amount(amount)}")
+    print_periods(manager.get_totals_by_period(args.period, **filters))
+    return 0
+
+
+def print_periods(totals):
+    if totals:
+        print("\nПо периодам (доход / расход):")
+        for period, period_income, period_expense in totals:
+            print(f"  {period}: {format_amount(period_income)} / {format_amount(period_expense)}")
+
+
+def run_consolidated_summary(book, args):
+    """Сводка по всем счетам каталога или по счетам семьи --household."""
+    try:
+        summary = book.summary(args.period, household=args.household, **filters_from_args(args))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for name, balance in summary["balances"]:
+        print(f"{name}: {format_amount(balance)} руб.")
+    print(f"Баланс: {format_amount(summary['balance'])} руб.")
+    print(f"Доходы: {format_amount(summary['income'])} руб.")
+    print(f"Расходы: {format_amount(summary['expense'])} руб.")
+    if summary["categories"]:
+        print("\nРасходы по категориям:")
+        for category, amount in summary["categories"]:
+            print(f"  {category or 'Без категории'}: {format_amount(amount)}")
+    print_periods(summary["periods"])
+    return 0
+
+
+def run_accounts(book, args):
+    if args.add:
+        try:
+            book.add_account(args.add, args.household or "")
+        except ValueError as e:
+            print(f"Счет не добавлен: {e}", file=sys.stderr)
+            return 1
+    accounts = book.get_accounts(household=args.household)
+    balances = dict(book.get_balances(household=args.household))
+    for name, household, _ in accounts:
+        print(f"{name}{f' ({household})' if household else ''}: "
+              f"{format_amount(balances[name])} руб.")
+    return 0
+
+
+def run_budget(manager, args):
+    if args.category is None:
+        for category, limit, block, spent in manager.get_budgets():
+            limit_text = "без лимита" if limit is None else f"лимит {format_amount(limit)}"
+            print(f"{category}: {format_amount(spent)} ({limit_text}"
+                  f"{', перерасход запрещен' if block else ''})")
+        return 0
+    if args.limit is None and not args.clear:
+        print("Укажите лимит или --clear", file=sys.stderr)
+        return 1
+    manager.set_budget(args.category, None if args.clear else args.limit, args.block)
+    return 0
+
+
+def run_archive(manager, args):
+    if args.year is not None:
+        try:
+            count = manager.archive_year(args.year)
+        except ValueError as e:
+            print(f"Архивирование не выполнено: {e}", file=sys.stderr)
+            return 1
+        print(f"Перенесено в архив транзакций: {count}")
+        if args.vacuum:
+            manager.vacuum()
+    for year, path, count, income, expense in manager.get_archives():
+        print(f"{year}: {path}, транзакций {count}, доходы {format_amount(income)}, "
+              f"расходы {format_amount(expense)}")
+    return 0
+
+
+def run_import(manager, args):
+    columns = {field: getattr(args, f"{field}_column") for field in DEFAULT_CSV_COLUMNS}
+    try:
+        count = import_statement(
+            manager, args.path, args.statement_format, columns, args.delimiter, args.encoding,
+            progress=report, ofx_category=args.category)
+    except ValueError as e:
+        print(f"\nОшибка импорта: {e}", file=sys.stderr)
+        return 1
+    print(f"\nИмпортировано транзакций: {count}")
+    return 0
+
+
+def run_export(manager, args):
+    try:
+        count = export_transactions(
+            manager, args.path, args.export_format, progress=report, **filters_from_args(args))
+    except ValueError as e:
+        print(f"\nОшибка экспорта: {e}", file=sys.stderr)
+        return 1
+    print(f"\nЭкспортировано транзакций: {count}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="finance_data.db", help="файл базы данных")
+    parser.add_argument("--accounts", metavar="КАТАЛОГ",
+                        help="каталог счетов, у каждого счета своя база")
+    parser.add_argument("--account", metavar="СЧЕТ", help="счет из каталога --accounts вместо --db")
+    parser.add_argument("--profile", choices=list(FamilyFinanceManager.STORAGE_PROFILES),
+                        default=FamilyFinanceManager.DEFAULT_PROFILE, help="профиль хранения")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = commands.add_parser("add", help="добавление дохода или расхода")
+    add_parser.add_argument("kind", choices=["income", "expense"])
+    add_parser.add_argument("category", nargs="?", help="категория расхода")
+    add_parser.add_argument("amount", type=to_minor_units, help="сумма в рублях")
+    add_parser.add_argument("--note", help="примечание: получатель, назначение")
+
+    list_parser = commands.add_parser("list", help="вывод транзакций в CSV")
+    add_filter_arguments(list_parser)
+    list_parser.add_argument("--kind", choices=["income", "expense"])
+
+    search_parser = commands.add_parser(
+        "search", help="поиск по примечаниям и категориям по началу слов, в CSV")
+    search_parser.add_argument("text")
+    search_parser.add_argument("--limit", type=int, default=100)
+
+    summary_parser = commands.add_parser("summary", help="баланс и итоги")
+    add_filter_arguments(summary_parser)
+    summary_parser.add_argument("--period", choices=sorted(FamilyFinanceManager.PERIOD_FORMATS),
+                                default="month")
+    summary_parser.add_argument("--household",
+                                help="со --accounts без --account: сводка по счетам семьи")
+
+    budget_parser = commands.add_parser(
+        "budget", help="месячные лимиты расходов; без аргументов - расходы и лимиты")
+    budget_parser.add_argument("category", nargs="?")
+    budget_parser.add_argument("limit", nargs="?", type=to_minor_units, help="лимит в рублях")
+    budget_parser.add_argument("--block", action="store_true", help="запретить перерасход")
+    budget_parser.add_argument("--clear", action="store_true", help="снять лимит")
+
+    archive_parser = commands.add_parser(
+        "archive", help="перенос закрытого года в архив; без года - список архивов")
+    archive_parser.add_argument("year", nargs="?", type=int)
+    archive_parser.add_argument("--vacuum", action="store_true",
+                                help="сжать файл базы после переноса")
+
+    accounts_parser = commands.add_parser(
+        "accounts", help="счета каталога --accounts и их балансы")
+    accounts_parser.add_argument("--add", metavar="СЧЕТ", help="добавить счет")
+    accounts_parser.add_argument("--household", help="семья нового счета или фильтр списка")
+
+    import_parser = commands.add_parser("import", help="импорт выписки CSV или OFX")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["csv", "ofx"], dest="statement_format")
+    import_parser.add_argument("--delimiter")
+    import_parser.add_argument("--encoding", default="utf-8-sig")
+    import_parser.add_argument("--category", default=OFX_EXPENSE_CATEGORY,
+                               help="категория расходов из OFX (по умолчанию «%(default)s»)")
+    for field, column in DEFAULT_CSV_COLUMNS.items():
+        import_parser.add_argument(f"--{field}-column", default=column,
+                                   help=f"столбец CSV (по умолчанию «{column}»)")
+
+    export_parser = commands.add_parser("export", help="экспорт в csv, csv.gz, parquet, arrow")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=sorted(set(EXPORT_FORMATS.values())),
+                               dest="export_format")
+    add_filter_arguments(export_parser)
+
+    args = parser.parse_args(argv)
+    start_session_profile()
+    if args.account and not args.accounts:
+        parser.error("--account указывается вместе с --accounts")
+    if args.accounts:
+        book = AccountBook(args.accounts, args.profile)
+        try:
+            if args.command == "accounts":
+                return run_accounts(book, args)
+            if args.account is None:
+                if args.command != "summary":
+                    parser.error(f"для команды {args.command} укажите --account")
+                return run_consolidated_summary(book, args)
+            try:
+                (_, _, args.db), = book.get_accounts([args.account])
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+        finally:
+            book.close()
+    elif args.command == "accounts" or getattr(args, "household", None):
+        parser.error("команда accounts и --household указываются вместе с --accounts")
+    # Команды чтения не берут блокировок записи и не мешают другим процессам
+    read_only = ((args.command in READ_COMMANDS
+                  or args.command == "budget" and args.category is None
+                  or args.command == "archive" and args.year is None)
+                 and os.path.exists(args.db))
+    try:
+        manager = open_manager(args.db, args.profile, read_only)
+    except sqlite3.Error as e:
+        print(f"Не удалось открыть базу {args.db}: {e}", file=sys.stderr)
+        return 1
+    handlers = {
+        "add": run_add,
+        "list": run_list,
+        "search": run_search,
+        "summary": run_summary,
+        "budget": run_budget,
+        "archive": run_archive,
+        "import": run_import,
+        "export": run_export,
+    }
+    try:
+        return handlers[args.command](manager, args)
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1416 @@
+"""Ядро менеджера семейных финансов: учет транзакций в SQLite.
+
+Модуль не зависит от PyQt5 и matplotlib и может использоваться из скриптов,
+командной строки (family_finance_cli.py) и задач по расписанию.
+
+Все суммы хранятся и передаются целыми числами в копейках; перевод из рублей
+и обратно - to_minor_units и format_amount.
+"""
+import collections
+import contextlib
+import datetime
+import decimal
+import operator
+import os
+import random
+import re
+import sqlite3
+import stat
+import time
+from urllib.parse import quote
+
+from family_finance_metrics import connection_factory
+
+# Копеек в рубле
+MINOR_UNITS = 100
+
+
+def to_minor_units(value):
+    """Сумма в рублях (строка, int, float, Decimal) в целых копейках.
+
+    Дробная часть округляется до копейки по правилу половина от нуля.
+    Десятичная запятая допускается. При неверном значении - ValueError.
+    """
+    if isinstance(value, str):
+        value = value.strip().replace(",", ".")
+    try:
+        amount = decimal.Decimal(str(value))
+    except decimal.InvalidOperation as e:
+        raise ValueError(f"Неверная сумма: {value}") from e
+    if not amount.is_finite():
+        raise ValueError(f"Неверная сумма: {value}")
+    return int(amount.scaleb(2).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP))
+
+
+def format_amount(minor_units):
+    """Сумма в копейках в виде строки рублей с двумя знаками: -1234.50."""
+    sign = "-" if minor_units < 0 else ""
+    rubles, kopecks = divmod(abs(minor_units), MINOR_UNITS)
+    return f"{sign}{rubles}.{kopecks:02d}"
+
+
+class BudgetExceeded(ValueError):
+    """Расход превышает месячный лимит категории с запретом перерасхода."""
+
+    def __init__(self, category, spent, limit):
+        super().__init__(
+            f"Лимит категории «{category}» {format_amount(limit)} руб. в месяц будет превышен: "
+            f"расходы составят {format_amount(spent)} руб.")
+        self.category = category
+        self.spent = spent
+        self.limit = limit
+
+
+class SchemaOutdated(sqlite3.OperationalError):
+    """Схема базы устарела, а соединение открыто только для чтения и не может ее обновить."""
+
+
+class FamilyFinanceManager:
+    # Форматы strftime для группировки по периодам
+    PERIOD_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+    # Расчет сводки месяц x категория по транзакциям с id больше заданного
+    MONTHLY_TOTALS_QUERY = (
+        "SELECT strftime('%Y-%m', timestamp) AS month, COALESCE(category_id, 0) AS cat,"
+        " SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)), COUNT(*)"
+        " FROM transactions WHERE id > ? GROUP BY month, cat")
+
+    # Транзакции вместе с названием категории из справочника
+    TRANSACTIONS_FROM = (" FROM transactions"
+                         " LEFT JOIN categories ON categories.id = transactions.category_id")
+    # Транзакции схемы {schema} (основная база или архив года) с названием категории
+    PARTITION_FROM = (" FROM {schema}.transactions"
+                      " LEFT JOIN main.categories ON categories.id = transactions.category_id")
+    # Сколько архивов держать подключенными (ATTACH) одновременно
+    MAX_ATTACHED_ARCHIVES = 8
+
+    # Через сколько новых транзакций переносить их сумму в снимок баланса
+    BALANCE_CHECKPOINT_INTERVAL = 1000
+
+    # Сколько последних совпадений полнотекстового поиска ранжировать
+    SEARCH_RANK_WINDOW = 1000
+
+    # Категории расходов новой базы
+    DEFAULT_CATEGORIES = ["Продукты", "Транспорт", "ЖКХ", "Развлечения", "Одежда"]
+
+    # Профили хранения: PRAGMA соединения и размер кэша подготовленных запросов.
+    # durable - каждая фиксация записывается на диск (fsync);
+    # balanced - WAL с synchronous=NORMAL: при сбое питания теряются только
+    #   последние фиксации, база остается целостной;
+    # fast - без fsync, для импорта и замеров: сбой ОС может повредить базу.
+    STORAGE_PROFILES = {
+        "durable": {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "mmap_size": 0,
+            "cache_size": -2000,
+            "temp_store": "DEFAULT",
+            "cached_statements": 128,
+        },
+        "balanced": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -16000,
+            "temp_store": "MEMORY",
+            "cached_statements": 256,
+        },
+        "fast": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "mmap_size": 1024 * 1024 * 1024,
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+            "cached_statements": 512,
+        },
+    }
+    DEFAULT_PROFILE = "balanced"
+    # Сколько строк индекса просматривает ANALYZE при обслуживании
+    ANALYSIS_LIMIT = 1000
+
+    # Ожидание блокировки другим процессом внутри SQLite, секунды
+    BUSY_TIMEOUT = 5.0
+    # Повторные попытки начать запись, если база все еще занята, и начальная пауза между ними
+    WRITE_RETRIES = 5
+    WRITE_RETRY_DELAY = 0.05
+
+    def __init__(self, db_file="finance_data.db", profile=DEFAULT_PROFILE, read_only=False):
+        if profile not in self.STORAGE_PROFILES:
+            raise ValueError(f"Неизвестный профиль хранения: {profile}")
+        self.db_file = db_file
+        self.profile = profile
+        self.read_only = read_only
+        self.last_insert_id = None
+        # Подключенные архивы {псевдоним: путь}, первыми - давно не использованные
+        self._attached = collections.OrderedDict()
+        # Кэш справочника категорий {название: id} и {id: название}
+        self._category_ids = None
+        self._category_names = None
+        # Бюджеты {категория: (лимит, запрет перерасхода)} и расходы текущего месяца
+        # {категория: копейки}; загружаются из базы при первой проверке и при изменении
+        # данных другим соединением, затем обновляются при каждом расходе
+        self._budgets = None
+        self._month_spent = None
+        self._budget_month = None
+        self._budget_data_version = None
+        self.init_db()
+
+    def init_db(self):
+        """Инициализация базы данных.
+
+        Соединение работает в режиме автофиксации: запись выполняется только внутри
+        write_transaction. Соединение только для чтения не меняет схему и требует
+        уже созданную базу.
+        """
+        settings = self.STORAGE_PROFILES[self.profile]
+        # Соединение открывается по URI, чтобы архивы подключались в режиме только для чтения
+        uri = "file:" + quote(os.path.abspath(self.db_file))
+        if self.read_only:
+            uri += "?mode=ro"
+        self.conn = sqlite3.connect(uri, uri=True, timeout=self.BUSY_TIMEOUT,
+                                    isolation_level=None, factory=connection_factory(),
+                                    cached_statements=settings["cached_statements"])
+        self.cursor = self.conn.cursor()
+        self.apply_profile()
+        if self.read_only:
+            self.cursor.execute("PRAGMA user_version")
+            if self.cursor.fetchone()[0] < len(self._schema_migrations()):
+                self.conn.close()
+                raise SchemaOutdated(
+                    "Схема базы данных устарела, откройте ее один раз на запись")
+            return
+        with self.write_transaction():
+            self._create_tables()
+            self.migrate_db()
+
+    def _create_tables(self):
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT,
+                amount REAL NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS balance (
+                id INTEGER PRIMARY KEY,
+                current_balance REAL NOT NULL
+            )
+        """)
+
+    def apply_profile(self):
+        """Установка PRAGMA профиля хранения для текущего соединения."""
+        settings = self.STORAGE_PROFILES[self.profile]
+        pragmas = ["synchronous", "mmap_size", "cache_size", "temp_store"]
+        if not self.read_only:
+            pragmas.insert(0, "journal_mode")
+        for pragma in pragmas:
+            self.cursor.execute(f"PRAGMA {pragma} = {settings[pragma]}")
+            self.cursor.fetchall()
+
+    @staticmethod
+    def _is_busy(error):
+        message = str(error)
+        return "locked" in message or "busy" in message
+
+    @contextlib.contextmanager
+    def write_transaction(self):
+        """Транзакция записи BEGIN IMMEDIATE с повторными попытками при занятой базе.
+
+        Блокировка записи берется сразу, поэтому проверки внутри блока (например,
+        баланса перед расходом) не устаревают из-за записи другого процесса.
+        Вложенные вызовы выполняются в уже открытой транзакции. При исключении
+        изменения откатываются.
+        """
+        if self.conn.in_transaction:
+            yield
+            return
+        for attempt in range(self.WRITE_RETRIES):
+            try:
+                self.cursor.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if not self._is_busy(e) or attempt == self.WRITE_RETRIES - 1:
+                    raise
+                time.sleep(self.WRITE_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            # В кэше могли остаться категории, добавленные в откаченной транзакции
+            self._category_ids = self._category_names = None
+            raise
+        self.conn.commit()
+
+    @contextlib.contextmanager
+    def read_snapshot(self):
+        """Несколько запросов на чтение по одному согласованному снимку базы."""
+        if self.conn.in_transaction:
+            yield
+            return
+        self.cursor.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self.conn.rollback()
+
+    def data_version(self):
+        """Счетчик PRAGMA data_version: меняется после фиксации изменений другим соединением."""
+        self.cursor.execute("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
+
+    def run_maintenance(self):
+        """Периодическое обслуживание: контрольная точка WAL и обновление статистики.
+
+        При первом запуске собирается статистика ANALYZE, дальше PRAGMA optimize
+        пересчитывает ее только для изменившихся таблиц.
+        Возвращает (busy, страниц в WAL, перенесено страниц) из wal_checkpoint.
+        """
+        self.cursor.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        checkpoint = self.cursor.fetchone()
+        self.cursor.execute(f"PRAGMA analysis_limit = {self.ANALYSIS_LIMIT}")
+        self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        if self.cursor.fetchone() is None:
+            self.cursor.execute("ANALYZE")
+        else:
+            self.cursor.execute("PRAGMA optimize")
+        return checkpoint
+
+    def close(self):
+        """Закрытие соединения; перед ним PRAGMA optimize, как рекомендует SQLite."""
+        if not self.read_only:
+            self.cursor.execute("PRAGMA optimize")
+        self.conn.close()
+
+    def _schema_migrations(self):
+        return [
+            self._migration_add_indexes,
+            self._migration_monthly_totals,
+            self._migration_balance_checkpoint,
+            self._migration_explicit_monthly_totals,
+            self._migration_integer_amounts,
+            self._migration_categories,
+            self._migration_transaction_notes,
+            self._migration_category_ids,
+            self._migration_archives,
+        ]
+
+    def migrate_db(self):
+        """Применение миграций схемы, версия хранится в PRAGMA user_version."""
+        migrations = self._schema_migrations()
+        with self.write_transaction():
+            self.cursor.execute("PRAGMA user_version")
+            version = self.cursor.fetchone()[0]
+            for number, migration in enumerate(migrations[version:], start=version + 1):
+                migration()
+                self.cursor.execute(f"PRAGMA user_version = {number}")
+
+    def _migration_add_indexes(self):
+        """Индексы для фильтров по дате, категории и сумме."""
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_category_timestamp "
+            "ON transactions (category, timestamp)")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions (amount)")
+
+    def _migration_monthly_totals(self):
+        """Сводная таблица месяц x категория, поддерживаемая триггерами."""
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_totals (
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                income REAL NOT NULL DEFAULT 0,
+                expense REAL NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, category)
+            ) WITHOUT ROWID
+        """)
+        # Триггеры обновляют сводку в той же транзакции, что и вставка/удаление.
+        # Доходы без категории хранятся под пустой строкой.
+        self.cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_insert
+            AFTER INSERT ON transactions
+            BEGIN
+                INSERT INTO monthly_totals (month, category, income, expense, count)
+                VALUES (strftime('%Y-%m', NEW.timestamp), COALESCE(NEW.category, ''),
+                        MAX(NEW.amount, 0), MAX(-NEW.amount, 0), 1)
+                ON CONFLICT (month, category) DO UPDATE SET
+                    income = income + excluded.income,
+                    expense = expense + excluded.expense,
+                    count = count + 1;
+            END
+        """)
+        self.cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_delete
+            AFTER DELETE ON transactions
+            BEGIN
+                UPDATE monthly_totals SET
+                    income = income - MAX(OLD.amount, 0),
+                    expense = expense - MAX(-OLD.amount, 0),
+                    count = count - 1
+                WHERE month = strftime('%Y-%m', OLD.timestamp)
+                  AND category = COALESCE(OLD.category, '');
+                DELETE FROM monthly_totals WHERE count <= 0;
+            END
+        """)
+        # Сводку заполняет миграция _migration_category_ids, пересоздающая ее по id категорий
+
+    def rebuild_monthly_totals(self):
+        """Пересчет сводной таблицы monthly_totals по таблице транзакций."""
+        self._invalidate_budgets()
+        with self.write_transaction():
+            self.cursor.execute("DELETE FROM monthly_totals")
+            self.cursor.execute(
+                "INSERT INTO monthly_totals (month, category_id, income, expense, count) "
+                + self.MONTHLY_TOTALS_QUERY, (0,))
+
+    def verify_monthly_totals(self):
+        """Сверка сводной таблицы с транзакциями.
+
+        Возвращает список расхождений (месяц, категория, в сводке, фактически),
+        где значения - кортежи (доход, расход, количество); категория доходов - None.
+        """
+        with self.read_snapshot():
+            self.cursor.execute(self.MONTHLY_TOTALS_QUERY, (0,))
+            actual = {(month, category_id): (income, expense, count)
+                      for month, category_id, income, expense, count in self.cursor.fetchall()}
+            self.cursor.execute(
+                "SELECT month, category_id, income, expense, count FROM monthly_totals")
+            stored = {(month, category_id): (income, expense, count)
+                      for month, category_id, income, expense, count in self.cursor.fetchall()}
+        drift = []
+        for month, category_id in sorted(actual.keys() | stored.keys()):
+            expected = actual.get((month, category_id), (0, 0, 0))
+            found = stored.get((month, category_id), (0, 0, 0))
+            if expected != found:
+                drift.append((month, self.category_name(category_id), found, expected))
+        return drift
+
+    def _migration_balance_checkpoint(self):
+        """Баланс как снимок: сумма транзакций с id не больше last_transaction_id."""
+        self.cursor.execute(
+            "ALTER TABLE balance ADD COLUMN last_transaction_id INTEGER NOT NULL DEFAULT 0")
+        self.cursor.execute("""
+            INSERT INTO balance (id, current_balance)
+            SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM balance)
+        """)
+        self._reset_balance(self.HOT_TOTAL_QUERY)
+
+    def _migration_explicit_monthly_totals(self):
+        """Сводка при вставке обновляется методами записи, а не построчным триггером.
+
+        Триггер на каждую строку заметно замедляет пакетный импорт; методы записи
+        обновляют monthly_totals одним запросом на всю пачку в той же транзакции.
+        """
+        self.cursor.execute("DROP TRIGGER IF EXISTS trg_transactions_totals_insert")
+
+    def _migration_integer_amounts(self):
+        """Суммы в целых копейках вместо REAL: транзакции, сводка и снимок баланса.
+
+        Тип столбца в SQLite не меняется, поэтому таблица транзакций пересоздается
+        с сохранением остальных столбцов, индексов, триггеров и счетчика AUTOINCREMENT.
+        """
+        self.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'")
+        table_sql = self.cursor.fetchone()[0]
+        self.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = 'transactions'"
+            " AND type IN ('index', 'trigger') AND sql IS NOT NULL")
+        dependent_sql = [row[0] for row in self.cursor.fetchall()]
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")
+        sequence = self.cursor.fetchone()
+        self.cursor.execute("PRAGMA table_info(transactions)")
+        columns = [row[1] for row in self.cursor.fetchall()]
+
+        table_sql = re.sub(r"\bamount\s+REAL\b", "amount INTEGER", table_sql, flags=re.IGNORECASE)
+        table_sql = re.sub(r"^\s*CREATE TABLE\s+(IF NOT EXISTS\s+)?transactions\b",
+                           "CREATE TABLE transactions_new", table_sql, flags=re.IGNORECASE)
+        self.cursor.execute(table_sql)
+        selected = [f"CAST(ROUND(amount * {MINOR_UNITS}) AS INTEGER)" if column == "amount"
+                    else column for column in columns]
+        self.cursor.execute(
+            f"INSERT INTO transactions_new ({', '.join(columns)}) "
+            f"SELECT {', '.join(selected)} FROM transactions")
+        self.cursor.execute("DROP TABLE transactions")
+        self.cursor.execute("ALTER TABLE transactions_new RENAME TO transactions")
+        for sql in dependent_sql:
+            self.cursor.execute(sql)
+        if sequence is not None:
+            self.cursor.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'",
+                sequence)
+
+        self.cursor.execute("DROP TABLE monthly_totals")
+        self.cursor.execute("""
+            CREATE TABLE monthly_totals (
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                income INTEGER NOT NULL DEFAULT 0,
+                expense INTEGER NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, category)
+            ) WITHOUT ROWID
+        """)
+        # Сводку заполняет миграция _migration_category_ids
+
+        self.cursor.execute("DROP TABLE balance")
+        self.cursor.execute("""
+            CREATE TABLE balance (
+                id INTEGER PRIMARY KEY,
+                current_balance INTEGER NOT NULL,
+                last_transaction_id INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.cursor.execute("INSERT INTO balance (id, current_balance) VALUES (1, 0)")
+        self._reset_balance(self.HOT_TOTAL_QUERY)
+
+    def _migration_categories(self):
+        """Справочник категорий с месячными лимитами расходов.
+
+        monthly_limit - лимит в копейках (NULL - без лимита), block_overspend - запрет
+        расхода сверх лимита вместо предупреждения. В справочник попадают категории
+        по умолчанию, категории уже записанных транзакций добавляет миграция
+        _migration_category_ids.
+        """
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                monthly_limit INTEGER,
+                block_overspend INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.cursor.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)",
+                                [(name,) for name in self.DEFAULT_CATEGORIES])
+
+    def _migration_transaction_notes(self):
+        """Примечание к транзакции (получатель, назначение) и полнотекстовый индекс FTS5.
+
+        Индекс transactions_fts хранит только токены примечаний и категорий, сами
+        тексты читаются из transactions (external content). Удаление и изменение
+        строк отражают триггеры, а новые строки добавляют в индекс методы записи
+        одним запросом на пачку (_update_search_index): построчный триггер FTS5
+        замедляет пакетный импорт в несколько раз. Строки без примечания и
+        категории в индекс не попадают.
+        """
+        self.cursor.execute("ALTER TABLE transactions ADD COLUMN note TEXT")
+        self.cursor.execute("""
+            CREATE VIRTUAL TABLE transactions_fts USING fts5(
+                note, category,
+                content = 'transactions', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '1 2 3'
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TRIGGER trg_transactions_fts_delete
+            AFTER DELETE ON transactions
+            WHEN OLD.note IS NOT NULL OR OLD.category IS NOT NULL
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, note, category)
+                VALUES ('delete', OLD.id, OLD.note, OLD.category);
+            END
+        """)
+        self.cursor.execute("""
+            CREATE TRIGGER trg_transactions_fts_update
+            AFTER UPDATE OF note, category ON transactions
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, note, category)
+                SELECT 'delete', OLD.id, OLD.note, OLD.category
+                WHERE OLD.note IS NOT NULL OR OLD.category IS NOT NULL;
+                INSERT INTO transactions_fts (rowid, note, category)
+                SELECT NEW.id, NEW.note, NEW.category
+                WHERE NEW.note IS NOT NULL OR NEW.category IS NOT NULL;
+            END
+        """)
+        self.cursor.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+    def _migration_category_ids(self):
+        """Категория транзакции - целый id из справочника categories вместо текста.
+
+        Таблица транзакций пересоздается по своему описанию, в котором столбец
+        category заменен на category_id, остальные столбцы сохраняются; недостающие
+        категории добавляются в справочник. Сводка monthly_totals переходит на id
+        (0 - доходы), полнотекстовый индекс берет названия категорий из
+        представления transactions_search.
+        """
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO categories (name) SELECT DISTINCT category FROM transactions"
+            " WHERE category IS NOT NULL AND category != '' ORDER BY category")
+        self.cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'")
+        table_sql = self.cursor.fetchone()[0]
+        self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")
+        sequence = self.cursor.fetchone()
+        self.cursor.execute("PRAGMA table_info(transactions)")
+        columns = [row[1] for row in self.cursor.fetchall()]
+
+        table_sql = re.sub(r"\bcategory\s+TEXT\b", "category_id INTEGER REFERENCES categories (id)",
+                           table_sql, flags=re.IGNORECASE)
+        # После переименования в миграции _migration_integer_amounts имя таблицы в кавычках
+        table_sql = re.sub(r'^\s*CREATE TABLE\s+(IF NOT EXISTS\s+)?"?transactions"?',
+                           "CREATE TABLE transactions_new", table_sql, flags=re.IGNORECASE)
+        self.cursor.execute(table_sql)
+        targets = ["category_id" if column == "category" else column for column in columns]
+        selected = ["categories.id" if column == "category" else f"transactions.{column}"
+                    for column in columns]
+        self.cursor.execute(
+            f"INSERT INTO transactions_new ({', '.join(targets)}) "
+            f"SELECT {', '.join(selected)} FROM transactions"
+            " LEFT JOIN categories ON categories.name = transactions.category"
+            " ORDER BY transactions.id")
+        self.cursor.execute("DROP TABLE transactions_fts")
+        self.cursor.execute("DROP TABLE transactions")
+        self.cursor.execute("ALTER TABLE transactions_new RENAME TO transactions")
+        if sequence is not None:
+            self.cursor.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'",
+                sequence)
+        self.cursor.execute("CREATE INDEX idx_transactions_timestamp ON transactions (timestamp)")
+        self.cursor.execute(
+            "CREATE INDEX idx_transactions_category_timestamp"
+            " ON transactions (category_id, timestamp)")
+        self.cursor.execute("CREATE INDEX idx_transactions_amount ON transactions (amount)")
+
+        self.cursor.execute("DROP TABLE monthly_totals")
+        self.cursor.execute("""
+            CREATE TABLE monthly_totals (
+                month TEXT NOT NULL,
+                category_id INTEGER NOT NULL,
+                income INTEGER NOT NULL DEFAULT 0,
+                expense INTEGER NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, category_id)
+            ) WITHOUT ROWID
+        """)
+        self.cursor.execute("""
+            CREATE TRIGGER trg_transactions_totals_delete
+            AFTER DELETE ON transactions
+            BEGIN
+                UPDATE monthly_totals SET
+                    income = income - MAX(OLD.amount, 0),
+                    expense = expense - MAX(-OLD.amount, 0),
+                    count = count - 1
+                WHERE month = strftime('%Y-%m', OLD.timestamp)
+                  AND category_id = COALESCE(OLD.category_id, 0);
+                DELETE FROM monthly_totals WHERE count <= 0;
+            END
+        """)
+        self.rebuild_monthly_totals()
+
+        self.cursor.execute("""
+            CREATE VIEW transactions_search AS
+            SELECT transactions.id AS id, note, categories.name AS category
+            FROM transactions LEFT JOIN categories ON categories.id = transactions.category_id
+        """)
+        self.cursor.execute("""
+            CREATE VIRTUAL TABLE transactions_fts USING fts5(
+                note, category,
+                content = 'transactions_search', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '1 2 3'
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TRIGGER trg_transactions_fts_delete
+            AFTER DELETE ON transactions
+            WHEN OLD.note IS NOT NULL OR OLD.category_id IS NOT NULL
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, note, category)
+                VALUES ('delete', OLD.id, OLD.note,
+                        (SELECT name FROM categories WHERE id = OLD.category_id));
+            END
+        """)
+        self.cursor.execute("""
+            CREATE TRIGGER trg_transactions_fts_update
+            AFTER UPDATE OF note, category_id ON transactions
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, note, category)
+                SELECT 'delete', OLD.id, OLD.note,
+                       (SELECT name FROM categories WHERE id = OLD.category_id)
+                WHERE OLD.note IS NOT NULL OR OLD.category_id IS NOT NULL;
+                INSERT INTO transactions_fts (rowid, note, category)
+                SELECT NEW.id, NEW.note, (SELECT name FROM categories WHERE id = NEW.category_id)
+                WHERE NEW.note IS NOT NULL OR NEW.category_id IS NOT NULL;
+            END
+        """)
+        # Переименование категории меняет токены всех ее транзакций в индексе
+        self.cursor.execute("""
+            CREATE TRIGGER trg_categories_fts_rename
+            AFTER UPDATE OF name ON categories
+            BEGIN
+                INSERT INTO transactions_fts (transactions_fts, rowid, note, category)
+                SELECT 'delete', id, note, OLD.name FROM transactions
+                WHERE category_id = OLD.id;
+                INSERT INTO transactions_fts (rowid, note, category)
+                SELECT id, note, NEW.name FROM transactions WHERE category_id = NEW.id;
+            END
+        """)
+        self.cursor.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+        self._category_ids = self._category_names = None
+
+    def _migration_archives(self):
+        """Реестр архивов: закрытые годы, перенесенные в отдельные файлы (archive_year).
+
+        date_from и date_to - границы года [date_from, date_to); row_count, income и
+        expense - итоги архива для баланса и проверок без подключения файла.
+        Триггер удаления из сводки убирает опустевшую строку по ключу, а не просмотром
+        всей monthly_totals: архивирование удаляет сотни тысяч строк.
+        """
+        self.cursor.execute("DROP TRIGGER trg_transactions_totals_delete")
+        self.cursor.execute("""
+            CREATE TRIGGER trg_transactions_totals_delete
+            AFTER DELETE ON transactions
+            BEGIN
+                UPDATE monthly_totals SET
+                    income = income - MAX(OLD.amount, 0),
+                    expense = expense - MAX(-OLD.amount, 0),
+                    count = count - 1
+                WHERE month = strftime('%Y-%m', OLD.timestamp)
+                  AND category_id = COALESCE(OLD.category_id, 0);
+                DELETE FROM monthly_totals
+                WHERE month = strftime('%Y-%m', OLD.timestamp)
+                  AND category_id = COALESCE(OLD.category_id, 0) AND count <= 0;
+            END
+        """)
+        self.cursor.execute("""
+            CREATE TABLE archives (
+                year INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                date_from TEXT NOT NULL,
+                date_to TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                income INTEGER NOT NULL,
+                expense INTEGER NOT NULL
+            )
+        """)
+
+    def _load_categories(self):
+        # Отдельный курсор: метод вызывается и во время executemany на self.cursor
+        rows = self.conn.execute("SELECT id, name FROM categories").fetchall()
+        self._category_ids = {name: category_id for category_id, name in rows}
+        self._category_names = {category_id: name for category_id, name in rows}
+
+    def category_id(self, name, create=False):
+        """Id категории по названию из кэша справочника; None для пустого названия.
+
+        Неизвестное название перечитывает справочник: категорию мог добавить другой
+        процесс. С create=True отсутствующая категория добавляется (вызывать внутри
+        write_transaction), иначе возвращается None.
+        """
+        if not name:
+            return None
+        if self._category_ids is None or name not in self._category_ids:
+            self._load_categories()
+        category_id = self._category_ids.get(name)
+        if category_id is None and create:
+            category_id = self.conn.execute(
+                "INSERT INTO categories (name) VALUES (?)", (name,)).lastrowid
+            self._category_ids[name] = category_id
+            self._category_names[category_id] = name
+        return category_id
+
+    def category_name(self, category_id):
+        """Название категории по id из кэша справочника; None для доходов."""
+        if not category_id:
+            return None
+        if self._category_names is None or category_id not in self._category_names:
+            self._load_categories()
+        return self._category_names.get(category_id)
+
+    def get_categories(self):
+        """Названия категорий расходов в порядке добавления."""
+        self._load_categories()
+        return [self._category_names[category_id] for category_id in sorted(self._category_names)]
+
+    @staticmethod
+    def _current_month():
+        # Месяц в UTC, как у CURRENT_TIMESTAMP, которым помечаются новые транзакции
+        return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m")
+
+    def _load_budgets(self):
+        """Загрузка лимитов и расходов текущего месяца по сводке monthly_totals."""
+        month = self._current_month()
+        with self.read_snapshot():
+            self.cursor.execute("SELECT name, monthly_limit, block_overspend FROM categories")
+            budgets = {name: (limit, bool(block)) for name, limit, block in self.cursor.fetchall()}
+            self.cursor.execute(
+                "SELECT name, expense FROM monthly_totals"
+                " JOIN categories ON categories.id = monthly_totals.category_id WHERE month = ?",
+                (month,))
+            month_spent = dict(self.cursor.fetchall())
+        self._budgets = budgets
+        self._month_spent = month_spent
+        self._budget_month = month
+        self._budget_data_version = self.data_version()
+
+    def _invalidate_budgets(self):
+        self._budgets = self._month_spent = None
+
+    def budget_status(self, category, amount=0):
+        """Расходы категории за текущий месяц вместе с amount: (расходы, лимит, запрет).
+
+        Лимит None - категория без лимита. Проверка выполняется за постоянное время по
+        счетчикам в памяти; они перечитываются из сводки, только если сменился месяц
+        или данные изменило другое соединение.
+        """
+        if (self._month_spent is None or self._budget_month != self._current_month()
+                or self._budget_data_version != self.data_version()):
+            self._load_budgets()
+        limit, block = self._budgets.get(category, (None, False))
+        return self._month_spent.get(category, 0) + amount, limit, block
+
+    def get_budgets(self):
+        """Категории с лимитами и расходами за текущий месяц: [(категория, лимит, запрет, расходы)]."""
+        self._load_budgets()
+        return [(name, limit, block, self._month_spent.get(name, 0))
+                for name, (limit, block) in self._budgets.items()]
+
+    def set_budget(self, category, monthly_limit=None, block_overspend=False):
+        """Установка месячного лимита категории в копейках (None - без лимита).
+
+        Неизвестная категория добавляется в справочник.
+        """
+        if monthly_limit is not None and operator.index(monthly_limit) < 0:
+            raise ValueError("Лимит не может быть отрицательным")
+        with self.write_transaction():
+            self.cursor.execute(
+                "INSERT INTO categories (name, monthly_limit, block_overspend) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET monthly_limit = excluded.monthly_limit,"
+                " block_overspend = excluded.block_overspend",
+                (category, monthly_limit, int(block_overspend)))
+        self._invalidate_budgets()
+
+    def _update_search_index(self, after_id):
+        """Добавление в полнотекстовый индекс транзакций с id больше after_id."""
+        self.cursor.execute(
+            "INSERT INTO transactions_fts (rowid, note, category)"
+            " SELECT id, note, category FROM transactions_search"
+            " WHERE id > ? AND (note IS NOT NULL OR category IS NOT NULL)", (after_id,))
+
+    def _update_monthly_totals(self, after_id):
+        """Добавление в сводку транзакций с id больше after_id."""
+        self.cursor.execute(
+            "INSERT INTO monthly_totals (month, category_id, income, expense, count) "
+            + self.MONTHLY_TOTALS_QUERY
+            + " ON CONFLICT (month, category_id) DO UPDATE SET"
+            " income = income + excluded.income,"
+            " expense = expense + excluded.expense,"
+            " count = count + excluded.count", (after_id,))
+
+    @property
+    def balance(self):
+        return self.get_balance()
+
+    def get_archives(self):
+        """Архивы по годам: [(год, путь к файлу, строк, доходы, расходы)]."""
+        self.cursor.execute(
+            "SELECT year, path, row_count, income, expense FROM archives ORDER BY year")
+        return [(year, self._archive_path(path), count, income, expense)
+                for year, path, count, income, expense in self.cursor.fetchall()]
+
+    def _archive_path(self, path):
+        """Путь к архиву; относительный путь отсчитывается от каталога основной базы."""
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_file)), path)
+
+    def _archives_for(self, date_from=None, date_to=None, covered=False):
+        """Архивы, пересекающиеся с интервалом дат [date_from, date_to), по годам.
+
+        Возвращает [(год, путь, доходы, расходы)]; covered=True - только архивы,
+        целиком лежащие внутри интервала.
+        """
+        query = "SELECT year, path, income, expense FROM archives WHERE 1=1"
+        params = []
+        if date_from:
+            query += " AND date_from >= ?" if covered else " AND date_to > ?"
+            params.append(date_from)
+        if date_to:
+            query += " AND date_to <= ?" if covered else " AND date_from < ?"
+            params.append(date_to)
+        return self.conn.execute(query + " ORDER BY year", params).fetchall()
+
+    def _attach_archive(self, year, path):
+        """Подключение архива года только для чтения; возвращает псевдоним схемы.
+
+        Подключать и отключать базы SQLite позволяет только вне транзакции, поэтому
+        запросы к архивам выполняются вне write_transaction и read_snapshot. Давно
+        не использованный архив отключается, поэтому псевдоним действителен только
+        до подключения следующего архива.
+        """
+        alias = f"archive_{year}"
+        if alias in self._attached:
+            self._attached.move_to_end(alias)
+            return alias
+        while len(self._attached) >= self.MAX_ATTACHED_ARCHIVES:
+            stale, _ = self._attached.popitem(last=False)
+            self.conn.execute(f"DETACH DATABASE {stale}")
+        # Архив не меняется после создания: immutable отключает блокировки файла
+        uri = "file:" + quote(self._archive_path(path)) + "?mode=ro&immutable=1"
+        self.conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+        self._attached[alias] = path
+        return alias
+
+    def partitions(self, query, params, archives=None, **filters):
+        """Выполнение query по основной базе и по каждому архиву дат filters отдельно.
+
+        В query вместо имени схемы стоит {schema}; каждая часть выполняется по своим
+        индексам. Генерирует курсоры с результатом части: строки нужно прочитать до
+        перехода к следующей части, после чего курсор закрывается. Архив подключается
+        непосредственно перед своим запросом, поэтому число архивов не ограничено
+        числом одновременно подключенных баз SQLite. archives - [(год, путь, ...)]
+        вместо архивов, выбранных по датам filters.
+        """
+        if archives is None:
+            archives = self._archives_for(*self._date_range(**filters))
+        for part in [None] + list(archives):
+            schema = "main" if part is None else self._attach_archive(*part[:2])
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(query.format(schema=schema), params)
+                yield cursor
+            finally:
+                cursor.close()
+
+    def _date_range(self, date_filter=None, date_from=None, date_to=None, **_):
+        """Интервал дат фильтров [начало, конец) для выбора архивов."""
+        if date_filter:
+            date_from = date_to = date_filter
+        return date_from, self._next_day(date_to) if date_to else None
+
+    def archive_year(self, year, path=None):
+        """Перенос транзакций закрытого года в отдельный файл SQLite только для чтения.
+
+        В архив попадают строки года с индексами, сводка monthly_totals по его месяцам
+        и копия справочника категорий. Сначала архив записывается и фиксируется целиком,
+        затем в одной транзакции основной базы баланс переносится в снимок, архив
+        вносится в реестр archives и строки удаляются; сбой между шагами оставляет
+        незарегистрированный файл, который перезаписывается при повторном запуске.
+        Освободившиеся страницы основной базы используются заново, уменьшить сам
+        файл можно через vacuum(). Возвращает число перенесенных строк.
+        """
+        if self.read_only:
+            raise ValueError("База открыта только для чтения")
+        if year >= datetime.datetime.now(datetime.timezone.utc).year:
+            raise ValueError(f"Год {year} еще не закрыт")
+        self.cursor.execute("SELECT 1 FROM archives WHERE year = ?", (year,))
+        if self.cursor.fetchone():
+            raise ValueError(f"Год {year} уже в архиве")
+        date_from, date_to = f"{year:04d}-01-01", f"{year + 1:04d}-01-01"
+        self.cursor.execute("SELECT 1 FROM transactions WHERE timestamp >= ? AND timestamp < ?"
+                            " LIMIT 1", (date_from, date_to))
+        if not self.cursor.fetchone():
+            raise ValueError(f"Нет транзакций за {year} год")
+        if path is None:
+            stem = os.path.splitext(os.path.basename(self.db_file))[0]
+            path = f"{stem}_{year}.db"
+        full_path = self._archive_path(path)
+        if os.path.exists(full_path):
+            # Файл незавершенного архивирования: в реестр он не попал
+            os.chmod(full_path, stat.S_IRUSR | stat.S_IWUSR)
+            os.remove(full_path)
+
+        self.conn.execute("ATTACH DATABASE ? AS archive_new",
+                          ("file:" + quote(full_path) + "?mode=rwc",))
+        try:
+            self.conn.execute("BEGIN")
+            try:
+                self._write_archive(date_from, date_to)
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+            with self.write_transaction():
+                self.cursor.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(MAX(amount, 0)), 0),"
+                    " COALESCE(SUM(MAX(-amount, 0)), 0) FROM archive_new.transactions")
+                count, income, expense = self.cursor.fetchone()
+                self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM transactions")
+                self.checkpoint_balance(self.cursor.fetchone()[0])
+                self.cursor.execute(
+                    "INSERT INTO archives (year, path, date_from, date_to, row_count, income,"
+                    " expense) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (year, path, date_from, date_to, count, income, expense))
+                # Строки, добавленные в этот год после записи архива, остаются в основной базе
+                self.cursor.execute(
+                    "DELETE FROM main.transactions"
+                    " WHERE id IN (SELECT id FROM archive_new.transactions)")
+                # Удаление оставляет в индексе поиска отметки об удаленных строках;
+                # слияние сегментов освобождает место и ускоряет поиск
+                self.cursor.execute(
+                    "INSERT INTO transactions_fts (transactions_fts) VALUES ('optimize')")
+        finally:
+            self.conn.execute("DETACH DATABASE archive_new")
+        os.chmod(full_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return count
+
+    def _write_archive(self, date_from, date_to):
+        """Заполнение подключенного как archive_new файла архива строками [date_from, date_to)."""
+        self.cursor.execute("""
+            CREATE TABLE archive_new.transactions (
+                id INTEGER PRIMARY KEY,
+                category_id INTEGER,
+                amount INTEGER NOT NULL,
+                timestamp DATETIME,
+                note TEXT
+            )
+        """)
+        self.cursor.execute(
+            "INSERT INTO archive_new.transactions (id, category_id, amount, timestamp, note)"
+            " SELECT id, category_id, amount, timestamp, note FROM main.transactions"
+            " WHERE timestamp >= ? AND timestamp < ? ORDER BY id", (date_from, date_to))
+        self.cursor.execute(
+            "CREATE INDEX archive_new.idx_transactions_timestamp ON transactions (timestamp)")
+        self.cursor.execute(
+            "CREATE INDEX archive_new.idx_transactions_category_timestamp"
+            " ON transactions (category_id, timestamp)")
+        self.cursor.execute(
+            "CREATE INDEX archive_new.idx_transactions_amount ON transactions (amount)")
+        self.cursor.execute("""
+            CREATE TABLE archive_new.monthly_totals (
+                month TEXT NOT NULL,
+                category_id INTEGER NOT NULL,
+                income INTEGER NOT NULL DEFAULT 0,
+                expense INTEGER NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, category_id)
+            ) WITHOUT ROWID
+        """)
+        self.cursor.execute(
+            "INSERT INTO archive_new.monthly_totals (month, category_id, income, expense, count)"
+            " SELECT strftime('%Y-%m', timestamp), COALESCE(category_id, 0),"
+            " SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)), COUNT(*)"
+            " FROM archive_new.transactions GROUP BY 1, 2")
+        self.cursor.execute(
+            "CREATE TABLE archive_new.categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+        self.cursor.execute(
+            "INSERT INTO archive_new.categories (id, name) SELECT id, name FROM main.categories")
+        self.cursor.execute("ANALYZE archive_new")
+
+    def vacuum(self):
+        """Сжатие файла основной базы (VACUUM), например после архивирования."""
+        self.cursor.execute("VACUUM main")
+
+    def get_balance(self):
+        """Текущий баланс: снимок плюс сумма транзакций, добавленных после него."""
+        self.cursor.execute("SELECT current_balance, last_transaction_id FROM balance LIMIT 1")
+        snapshot, last_id = self.cursor.fetchone()
+        self.cursor.execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE id > ?", (last_id,))
+        return snapshot + self.cursor.fetchone()[0]
+
+    def checkpoint_balance(self, upto_id):
+        """Перенос суммы транзакций с id до upto_id включительно в снимок баланса."""
+        self.cursor.execute("""
+            UPDATE balance SET
+                current_balance = current_balance + (
+                    SELECT COALESCE(SUM(amount), 0) FROM transactions
+                    WHERE id > balance.last_transaction_id AND id <= :upto),
+                last_transaction_id = :upto
+            WHERE last_transaction_id < :upto
+        """, {"upto": upto_id})
+
+    # Сумма транзакций основной базы; с архивами - LEDGER_TOTAL_QUERY
+    HOT_TOTAL_QUERY = "SELECT COALESCE(SUM(amount), 0) FROM main.transactions"
+    # Сумма всех транзакций: основная база и итоги архивов из реестра
+    LEDGER_TOTAL_QUERY = (
+        "SELECT (" + HOT_TOTAL_QUERY + ")"
+        " + (SELECT COALESCE(SUM(income - expense), 0) FROM archives)")
+
+    def rebuild_balance(self):
+        """Пересчет снимка баланса по всем транзакциям, включая архивы."""
+        with self.write_transaction():
+            self._reset_balance(self.LEDGER_TOTAL_QUERY)
+
+    def _reset_balance(self, total_query):
+        """Снимок баланса из суммы total_query по последнюю транзакцию.
+
+        Миграции до реестра архивов передают HOT_TOTAL_QUERY: архивов тогда еще нет.
+        """
+        self.cursor.execute(
+            "UPDATE balance SET current_balance = (" + total_query + "),"
+            " last_transaction_id = (SELECT COALESCE(MAX(id), 0) FROM transactions)")
+
+    def verify_balance(self):
+        """Сверка баланса: (баланс по снимку, полная сумма SUM(amount) с архивами)."""
+        with self.read_snapshot():
+            balance = self.get_balance()
+            self.cursor.execute(self.LEDGER_TOTAL_QUERY)
+            return balance, self.cursor.fetchone()[0]
+
+    def _insert_transaction(self, category, amount, note=None):
+        """Добавление строки в журнал вместе со сводкой и периодическим снимком баланса.
+
+        Вызывается внутри write_transaction.
+        """
+        self.cursor.execute(
+            "INSERT INTO transactions (category_id, amount, note) VALUES (?, ?, ?)",
+            (self.category_id(category, create=True), operator.index(amount), note or None)
+        )
+        transaction_id = self.cursor.lastrowid
+        self._update_monthly_totals(transaction_id - 1)
+        self._update_search_index(transaction_id - 1)
+        if transaction_id % self.BALANCE_CHECKPOINT_INTERVAL == 0:
+            self.checkpoint_balance(transaction_id)
+        self.last_insert_id = transaction_id
+
+    def add_income(self, amount, note=None):
+        """Добавление дохода, сумма в копейках."""
+        if amount > 0:
+            with self.write_transaction():
+                self._insert_transaction(None, amount, note)
+            return True
+        return False
+
+    def add_expense(self, category, amount, note=None):
+        """Добавление расхода в копейках; баланс проверяется в той же транзакции, что и вставка.
+
+        Если расход превысит месячный лимит категории с запретом перерасхода,
+        выбрасывается BudgetExceeded; превышение лимита без запрета не мешает записи
+        (см. budget_status).
+        """
+        if amount <= 0:
+            return False
+        with self.write_transaction():
+            if self.balance < amount:
+                return False
+            spent, limit, block = self.budget_status(category, amount)
+            if block and limit is not None and spent > limit:
+                raise BudgetExceeded(category, spent, limit)
+            self._insert_transaction(category, -amount, note)
+        # Счетчики меняются только после успешной фиксации
+        self._month_spent[category] = spent
+        self._budgets.setdefault(category, (None, False))
+        return True
+
+    def add_transactions_bulk(self, transactions):
+        """Добавление набора транзакций в одной транзакции базы данных.
+
+        transactions - итерируемый набор кортежей (категория, сумма[, дата[, примечание]]), где сумма
+        в копейках со знаком: положительная для доходов, отрицательная для расходов. Набор читается
+        потоково, баланс проверяется по ходу всей пачки. При ошибке все изменения
+        откатываются и выбрасывается ValueError. Возвращает число добавленных строк.
+        """
+        running_balance = 0
+        count = 0
+
+        def rows():
+            nonlocal running_balance, count
+            for item in transactions:
+                category = item[0]
+                try:
+                    amount = operator.index(item[1])
+                except TypeError as e:
+                    raise ValueError(
+                        f"Строка {count + 1}: сумма должна быть целым числом копеек: {item[1]!r}") from e
+                timestamp = item[2] if len(item) > 2 else None
+                note = item[3] if len(item) > 3 else None
+                if not amount:
+                    raise ValueError(f"Строка {count + 1}: нулевая сумма")
+                running_balance += amount
+                if running_balance < 0:
+                    raise ValueError(f"Строка {count + 1}: недостаточно средств для расхода {-amount}")
+                count += 1
+                yield self.category_id(category, create=True), amount, timestamp, note or None
+
+        with self.write_transaction():
+            running_balance = self.balance
+            self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM transactions")
+            first_id = self.cursor.fetchone()[0]
+            self.cursor.executemany(
+                "INSERT INTO transactions (category_id, amount, timestamp, note) "
+                "VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)",
+                rows()
+            )
+            self._update_monthly_totals(first_id)
+            self._update_search_index(first_id)
+            self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM transactions")
+            self.checkpoint_balance(self.cursor.fetchone()[0])
+        self._invalidate_budgets()
+        return count
+
+    @staticmethod
+    def _next_day(date_text):
+        """Дата следующего дня в формате YYYY-MM-DD."""
+        day = datetime.date.fromisoformat(date_text)
+        return (day + datetime.timedelta(days=1)).isoformat()
+
+    @staticmethod
+    def _amount_filter(min_amount, max_amount, kind):
+        """Условие по модулю суммы с учетом типа операции (доход/расход)."""
+        clauses = []
+        params = []
+        if kind != "expense":
+            parts = ["amount >= ?" if min_amount is not None else "amount > ?"]
+            params.append(min_amount if min_amount is not None else 0)
+            if max_amount is not None:
+                parts.append("amount <= ?")
+                params.append(max_amount)
+            clauses.append(" AND ".join(parts))
+        if kind != "income":
+            parts = ["amount <= ?" if min_amount is not None else "amount < ?"]
+            params.append(-min_amount if min_amount is not None else 0)
+            if max_amount is not None:
+                parts.append("amount >= ?")
+                params.append(-max_amount)
+            clauses.append(" AND ".join(parts))
+        return " AND (" + " OR ".join(f"({clause})" for clause in clauses) + ")", params
+
+    def _build_filters(self, date_filter=None, category_filter=None, date_from=None,
+                       date_to=None, min_amount=None, max_amount=None, kind=None):
+        """Формирование условий WHERE для фильтров транзакций.
+
+        Даты задаются в формате YYYY-MM-DD, date_to включительно. Все условия
+        записаны как диапазоны по самим столбцам, чтобы SQLite использовал индексы.
+        kind: None, "income" или "expense".
+        """
+        if kind not in (None, "income", "expense"):
+            raise ValueError(f"Неизвестный тип операции: {kind}")
+        if date_filter:
+            date_from = date_to = date_filter
+        query = ""
+        params = []
+        if date_from:
+            query += " AND timestamp >= ?"
+            params.append(date_from)
+        if date_to:
+            query += " AND timestamp < ?"
+            params.append(self._next_day(date_to))
+        if category_filter:
+            # Неизвестная категория дает id None, и условие не выбирает ни одной строки
+            query += " AND category_id = ?"
+            params.append(self.category_id(category_filter))
+        if kind or min_amount is not None or max_amount is not None:
+            amount_query, amount_params = self._amount_filter(min_amount, max_amount, kind)
+            query += amount_query
+            params.extend(amount_params)
+        return query, params
+
+    def get_transactions(self, date_filter=None, category_filter=None, **filters):
+        """Получение всех транзакций с фильтрами (см. _build_filters)."""
+        where, params = self._build_filters(date_filter, category_filter, **filters)
+        rows = []
+        for cursor in self.partitions(
+                "SELECT name, amount, timestamp, note" + self.PARTITION_FROM + " WHERE 1=1" + where,
+                params, date_filter=date_filter, **filters):
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def get_transaction(self, transaction_id):
+        """Транзакция основной базы по id: (id, категория, сумма, дата, примечание) или None."""
+        self.cursor.execute(
+            "SELECT transactions.id, name, amount, timestamp, note" + self.TRANSACTIONS_FROM
+            + " WHERE transactions.id = ?",
+            (transaction_id,))
+        return self.cursor.fetchone()
+
+    def iter_transactions(self, batch_size=5000, date_filter=None, category_filter=None, **filters):
+        """Потоковое чтение транзакций пачками через fetchmany на отдельном курсоре."""
+        where, params = self._build_filters(date_filter, category_filter, **filters)
+        for cursor in self.partitions(
+                "SELECT name, amount, timestamp, note" + self.PARTITION_FROM + " WHERE 1=1" + where,
+                params, date_filter=date_filter, **filters):
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def get_amounts_array(self, date_filter=None, category_filter=None, **filters):
+        """Суммы транзакций в копейках как массив numpy.int64 для векторных расчетов.
+
+        Нужен пакет numpy; он загружается только при вызове.
+        """
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ValueError("Для векторных расчетов нужен пакет numpy") from e
+        where, params = self._build_filters(date_filter, category_filter, **filters)
+        parts = [np.fromiter((row[0] for row in cursor), dtype=np.int64)
+                 for cursor in self.partitions(
+                     "SELECT amount FROM {schema}.transactions WHERE 1=1" + where,
+                     params, date_filter=date_filter, **filters)]
+        return np.concatenate(parts)
+
+    def get_transactions_page(self, after=None, limit=500, date_filter=None,
+                              category_filter=None, **filters):
+        """Получение страницы транзакций, упорядоченных по (timestamp, id).
+
+        after - ключ (timestamp, id) последней строки предыдущей страницы.
+        Такая постраничная выборка идет по индексу и не зависит от номера страницы.
+        С архивами страница берется из каждой части отдельно (каждая - по своему
+        индексу), и результаты сливаются. Архивы читаются по порядку лет, пока они
+        не дадут limit строк: архивы следующих лет на страницу уже не попадут.
+        """
+        where, params = self._build_filters(date_filter, category_filter, **filters)
+        date_from, date_to = self._date_range(date_filter, **filters)
+        if after is not None:
+            where += " AND (timestamp, transactions.id) > (?, ?)"
+            params.extend(after)
+            date_from = max(date_from or "", after[0][:10])
+        rows = []
+        # Первая часть - основная база, в которую могут попадать строки любых лет
+        parts = self.partitions(
+            "SELECT transactions.id, name, amount, timestamp, note" + self.PARTITION_FROM
+            + " WHERE 1=1" + where + " ORDER BY timestamp, transactions.id LIMIT ?",
+            params + [limit], self._archives_for(date_from, date_to))
+        rows.extend(next(parts).fetchall())
+        archived = 0
+        for cursor in parts:
+            part = cursor.fetchall()
+            rows.extend(part)
+            archived += len(part)
+            if archived >= limit:
+                parts.close()
+                break
+        rows.sort(key=operator.itemgetter(3, 0))
+        return rows[:limit]
+
+    def explain_transactions_query(self, date_filter=None, category_filter=None, **filters):
+        """План выполнения запроса get_transactions по основной базе (EXPLAIN QUERY PLAN)."""
+        where, params = self._build_filters(date_filter, category_filter, **filters)
+        query = "SELECT name, amount, timestamp, note" + self.TRANSACTIONS_FROM + " WHERE 1=1" + where
+        self.cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        return [row[-1] for row in self.cursor.fetchall()]
+
+    @staticmethod
+    def _fts_query(text):
+        """Запрос FTS5 из строки поиска: все слова, каждое как префикс.
+
+        Слова берутся в кавычки, поэтому операторы FTS5 в тексте пользователя
+        не действуют. Без слов возвращается None.
+        """
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return None
+        return " ".join(f'"{word}"*' for word in words)
+
+    def search_transactions(self, text, limit=100):
+        """Полнотекстовый поиск по примечаниям и категориям с ранжированием BM25.
+
+        Каждое слово text ищется как начало слова («пят» найдет «Пятёрочка»).
+        Ранжируются SEARCH_RANK_WINDOW последних совпадений: частое слово встречается
+        в сотнях тысяч строк, и ранг для всех стоил бы сотни миллисекунд. Совпадения
+        в примечании весят больше, чем в категории, при равном ранге первыми идут
+        новые транзакции. Ищет только в основной базе: архивы лет не индексируются.
+        Возвращает до limit строк (id, категория, сумма, дата, примечание).
+        """
+        query = self._fts_query(text)
+        if query is None:
+            return []
+        self.cursor.execute(
+            "SELECT transactions.id, name, amount, timestamp, note FROM ("
+            " SELECT rowid AS hit, bm25(transactions_fts, 2.0, 1.0) AS score"
+            " FROM transactions_fts WHERE transactions_fts MATCH ?"
+            " ORDER BY rowid DESC LIMIT ?"
+            ") JOIN transactions ON transactions.id = hit"
+            " LEFT JOIN categories ON categories.id = transactions.category_id"
+            " ORDER BY score, transactions.id DESC LIMIT ?",
+            (query, self.SEARCH_RANK_WINDOW, limit))
+        return self.cursor.fetchall()
+
+    def _monthly_totals_filter(self, filters):
+        """Условия для monthly_totals, если фильтры выражаются целыми месяцами.
+
+        Возвращает (where, params) или None, если нужен запрос к транзакциям.
+        """
+        if set(filters) - {"date_from", "date_to", "category_filter"}:
+            return None
+        query = ""
+        params = []
+        date_from = filters.get("date_from")
+        date_to = filters.get("date_to")
+        if date_from:
+            if not date_from.endswith("-01"):
+                return None
+            query += " AND month >= ?"
+            params.append(date_from[:7])
+        if date_to:
+            if not self._next_day(date_to).endswith("-01"):
+                return None
+            query += " AND month <= ?"
+            params.append(date_to[:7])
+        if filters.get("category_filter"):
+            query += " AND category_id = ?"
+            params.append(self.category_id(filters["category_filter"]))
+        return query, params
+
+    def get_expenses_by_category(self, **filters):
+        """Сумма расходов по категориям, агрегация выполняется в SQLite.
+
+        Для фильтров по целым месяцам читается сводка monthly_totals.
+        """
+        filters = {name: value for name, value in filters.items() if value is not None}
+        rollup = self._monthly_totals_filter(filters)
+        if rollup is not None:
+            where, params = rollup
+            query = ("SELECT category_id, SUM(expense) FROM {schema}.monthly_totals"
+                     " WHERE 1=1" + where + " GROUP BY category_id HAVING SUM(expense) > 0")
+        else:
+            filters["kind"] = "expense"
+            where, params = self._build_filters(**filters)
+            query = ("SELECT category_id, -SUM(amount) FROM {schema}.transactions"
+                     " WHERE 1=1" + where + " GROUP BY category_id")
+        # Частичные суммы основной базы и архивов складываются по категориям
+        expenses = collections.Counter()
+        for cursor in self.partitions(query, params, **filters):
+            for category_id, expense in cursor.fetchall():
+                expenses[category_id] += expense
+        return [(self.category_name(category_id), expense)
+                for category_id, expense in expenses.most_common()]
+
+    def get_totals_by_period(self, period="month", **filters):
+        """Доходы и расходы по периодам (day, week, month): [(период, доход, расход)]."""
+        if period not in self.PERIOD_FORMATS:
+            raise ValueError(f"Неизвестный период: {period}")
+        filters = {name: value for name, value in filters.items() if value is not None}
+        rollup = self._monthly_totals_filter(filters) if period == "month" else None
+        if rollup is not None:
+            where, params = rollup
+            query = ("SELECT month AS period, SUM(income) AS income, SUM(expense) AS expense"
+                     " FROM {schema}.monthly_totals WHERE 1=1" + where + " GROUP BY month")
+        else:
+            where, params = self._build_filters(**filters)
+            query = ("SELECT strftime(?, timestamp) AS period, SUM(MAX(amount, 0)) AS income,"
+                     " SUM(MAX(-amount, 0)) AS expense FROM {schema}.transactions WHERE 1=1"
+                     + where + " GROUP BY period")
+            params = [self.PERIOD_FORMATS[period]] + params
+        totals = collections.defaultdict(lambda: [0, 0])
+        for cursor in self.partitions(query, params, **filters):
+            for period_key, income, expense in cursor.fetchall():
+                totals[period_key][0] += income
+                totals[period_key][1] += expense
+        return [(period_key, income, expense)
+                for period_key, (income, expense) in sorted(totals.items())]
+
+    def get_income_expense_totals(self, **filters):
+        """Общая сумма доходов и расходов: (доход, расход)."""
+        filters = {name: value for name, value in filters.items() if value is not None}
+        rollup = self._monthly_totals_filter(filters)
+        date_range = self._date_range(**filters)
+        archives = self._archives_for(*date_range)
+        income = expense = 0
+        if rollup is not None:
+            where, params = rollup
+            query = ("SELECT COALESCE(SUM(income), 0), COALESCE(SUM(expense), 0)"
+                     " FROM {schema}.monthly_totals WHERE 1=1" + where)
+            if not filters.get("category_filter"):
+                # Итоги архивов, целиком попавших в интервал, хранятся в реестре:
+                # такие архивы не подключаются
+                covered = self._archives_for(*date_range, covered=True)
+                for _, _, archive_income, archive_expense in covered:
+                    income += archive_income
+                    expense += archive_expense
+                covered_years = {year for year, _, _, _ in covered}
+                archives = [archive for archive in archives if archive[0] not in covered_years]
+        else:
+            where, params = self._build_filters(**filters)
+            query = ("SELECT COALESCE(SUM(MAX(amount, 0)), 0), COALESCE(SUM(MAX(-amount, 0)), 0)"
+                     " FROM {schema}.transactions WHERE 1=1" + where)
+        for cursor in self.partitions(query, params, archives):
+            part_income, part_expense = cursor.fetchone()
+            income += part_income
+            expense += part_expense
+        return income, expense
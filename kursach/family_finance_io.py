@@ -0,0 +1,307 @@
+"""Импорт банковских выписок (CSV, OFX) и экспорт данных менеджера семейных финансов.
+
+Файлы читаются и пишутся потоково: импорт идет через пакетную вставку
+FamilyFinanceManager.add_transactions_bulk, экспорт - через курсор с fetchmany,
+поэтому расход памяти не зависит от объема данных.
+
+Запуск без интерфейса - через family_finance_cli.py (команды import и export).
+"""
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import os
+import re
+from decimal import Decimal
+
+from family_finance_core import MINOR_UNITS, format_amount, to_minor_units
+
+# Через сколько строк сообщать о прогрессе и проверять отмену
+CHUNK_SIZE = 5000
+
+# Соответствие полей транзакции столбцам CSV (совпадает с форматом экспорта)
+DEFAULT_CSV_COLUMNS = {
+    "type": "Тип",
+    "category": "Категория",
+    "amount": "Сумма",
+    "timestamp": "Дата",
+    "note": "Примечание",
+}
+
+# Поддерживаемые форматы дат: ISO (YYYY-MM-DD) и русский (DD.MM.YYYY), время необязательно
+ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?$")
+RU_DATE = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})(?: (\d{2}):(\d{2})(?::(\d{2}))?)?$")
+
+# Заголовок CSV при экспорте
+EXPORT_HEADER = ["Тип", "Категория", "Сумма", "Дата", "Примечание"]
+
+# Форматы экспорта по окончанию имени файла
+EXPORT_FORMATS = {
+    ".csv.gz": "csv.gz",
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+# Категория расходов из выписки OFX: в OFX нет категорий, а получатель попадает
+# в примечание, чтобы не заводить отдельную категорию на каждый магазин
+OFX_EXPENSE_CATEGORY = "Прочее"
+
+
+class ImportCancelled(Exception):
+    """Импорт отменен пользователем."""
+
+
+def parse_timestamp(text):
+    """Приведение даты из выписки к формату базы данных YYYY-MM-DD HH:MM:SS."""
+    text = text.strip()
+    match = ISO_DATE.match(text)
+    if match:
+        year, month, day, hour, minute, second = match.groups()
+    else:
+        match = RU_DATE.match(text)
+        if not match:
+            raise ValueError(f"Неизвестный формат даты: {text}")
+        day, month, year, hour, minute, second = match.groups()
+    return f"{year}-{month}-{day} {hour or '00'}:{minute or '00'}:{second or '00'}"
+
+
+def parse_amount(text):
+    """Разбор суммы с пробелами-разделителями разрядов и десятичной запятой в копейки."""
+    return to_minor_units(text.replace("\xa0", "").replace(" ", ""))
+
+
+def read_csv_statement(file, columns=None, delimiter=None):
+    """Потоковое чтение CSV: генератор (категория, сумма со знаком, дата, примечание).
+
+    Столбцы типа, категории, даты и примечания необязательны.
+    """
+    columns = dict(DEFAULT_CSV_COLUMNS, **(columns or {}))
+    lines = file
+    if delimiter is None:
+        header = file.readline()
+        try:
+            delimiter = csv.Sniffer().sniff(header, delimiters=",;\t").delimiter
+        except csv.Error:
+            delimiter = ","
+        lines = itertools.chain([header], file)
+    reader = csv.DictReader(lines, delimiter=delimiter)
+    for line_number, row in enumerate(reader, start=2):
+        try:
+            amount = parse_amount(row[columns["amount"]])
+            kind = (row.get(columns["type"]) or "").strip().lower()
+            if kind == "расход":
+                amount = -abs(amount)
+            elif kind == "доход":
+                amount = abs(amount)
+            category = (row.get(columns["category"]) or "").strip() or None
+            timestamp = row.get(columns["timestamp"])
+            timestamp = parse_timestamp(timestamp) if timestamp else None
+            note = (row.get(columns["note"]) or "").strip() or None
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Строка {line_number}: {e}") from e
+        yield (None if amount > 0 else category), amount, timestamp, note
+
+
+def _ofx_transaction(block, expense_category=OFX_EXPENSE_CATEGORY, number=None):
+    """Транзакция из блока <STMTTRN> выписки OFX; получатель и назначение - в примечании.
+
+    Блок без суммы или с неверной суммой или датой - ValueError с номером блока
+    number и его FITID.
+    """
+    fields = dict(OFX_FIELD.findall(block))
+    try:
+        if "TRNAMT" not in fields:
+            raise ValueError("нет суммы TRNAMT")
+        amount = parse_amount(fields["TRNAMT"])
+        posted = fields.get("DTPOSTED", "")[:14]
+        timestamp = None
+        if len(posted) >= 8:
+            posted = posted.ljust(14, "0")
+            timestamp = datetime.datetime.strptime(
+                posted, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError as e:
+        name = "Транзакция OFX" if number is None else f"Транзакция OFX {number}"
+        fitid = fields.get("FITID", "").strip()
+        if fitid:
+            name += f" (FITID {fitid})"
+        raise ValueError(f"{name}: {e}") from e
+    category = expense_category if amount < 0 else None
+    note = " ".join(filter(None, (fields.get("NAME", "").strip(), fields.get("MEMO", "").strip())))
+    return category, amount, timestamp, note or None
+
+
+def read_ofx_statement(file, expense_category=OFX_EXPENSE_CATEGORY, block_size=65536):
+    """Потоковое чтение OFX (SGML 1.x и XML 2.x): генератор (категория, сумма, дата, примечание).
+
+    Все расходы получают категорию expense_category.
+    """
+    buffer = ""
+    number = 0
+    while True:
+        chunk = file.read(block_size)
+        buffer += chunk
+        while True:
+            start = buffer.find("<STMTTRN>")
+            end = buffer.find("</STMTTRN>", start)
+            if start < 0 or end < 0:
+                break
+            number += 1
+            yield _ofx_transaction(buffer[start:end], expense_category, number)
+            buffer = buffer[end + len("</STMTTRN>"):]
+        if not chunk:
+            break
+        if start < 0:
+            # Оставляем хвост: начало тега могло попасть на границу блоков
+            buffer = buffer[-len("<STMTTRN>"):]
+
+
+def detect_format(path):
+    """Формат выписки по расширению файла: csv или ofx."""
+    return "ofx" if os.path.splitext(path)[1].lower() in (".ofx", ".qfx") else "csv"
+
+
+def import_statement(manager, path, statement_format=None, columns=None, delimiter=None,
+                     encoding="utf-8-sig", chunk_size=CHUNK_SIZE, progress=None,
+                     is_cancelled=None, ofx_category=OFX_EXPENSE_CATEGORY):
+    """Импорт выписки в базу одной транзакцией.
+
+    Расходы из OFX получают категорию ofx_category. progress(percent) вызывается
+    каждые chunk_size строк, is_cancelled() проверяется там же; при отмене
+    выбрасывается ImportCancelled и импорт откатывается целиком.
+    Возвращает количество импортированных транзакций.
+    """
+    statement_format = statement_format or detect_format(path)
+    size = os.path.getsize(path) or 1
+    with open(path, "rb") as binary:
+        text = io.TextIOWrapper(binary, encoding=encoding, newline="")
+        if statement_format == "ofx":
+            rows = read_ofx_statement(text, ofx_category)
+        else:
+            rows = read_csv_statement(text, columns, delimiter)
+
+        def tracked_rows():
+            for count, row in enumerate(rows, start=1):
+                yield row
+                if count % chunk_size == 0:
+                    if is_cancelled and is_cancelled():
+                        raise ImportCancelled("Импорт отменен")
+                    if progress:
+                        progress(min(99, binary.tell() * 100 // size))
+
+        count = manager.add_transactions_bulk(tracked_rows())
+    if progress:
+        progress(100)
+    return count
+
+
+class ExportCancelled(Exception):
+    """Экспорт отменен пользователем."""
+
+
+def detect_export_format(path):
+    """Формат экспорта по окончанию имени файла, по умолчанию csv."""
+    lower = path.lower()
+    for suffix, export_format in EXPORT_FORMATS.items():
+        if lower.endswith(suffix):
+            return export_format
+    return "csv"
+
+
+def export_row(category, amount, timestamp, note):
+    """Строка CSV со столбцами EXPORT_HEADER из транзакции (категория, сумма, дата, примечание)."""
+    return ("Доход" if amount > 0 else "Расход", category or "", format_amount(abs(amount)),
+            timestamp, note or "")
+
+
+def _write_csv(batches, file):
+    writer = csv.writer(file)
+    writer.writerow(EXPORT_HEADER)
+    for rows in batches:
+        writer.writerows(itertools.starmap(export_row, rows))
+
+
+def _write_arrow(batches, path, export_format):
+    """Запись в Parquet или Arrow IPC пачками; требуется пакет pyarrow.
+
+    Сумма записывается точным десятичным типом decimal128(18, 2) в рублях.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ValueError("Для экспорта в Parquet и Arrow нужен пакет pyarrow") from e
+    amount_type = pa.decimal128(18, 2)
+    minor_units = pa.scalar(Decimal(MINOR_UNITS), pa.decimal128(3, 0))
+    schema = pa.schema([
+        ("category", pa.string()),
+        ("amount", amount_type),
+        ("timestamp", pa.timestamp("s")),
+        ("note", pa.string()),
+    ])
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    try:
+        for rows in batches:
+            categories, amounts, timestamps, notes = zip(*rows)
+            writer.write_table(pa.table([
+                pa.array(categories, pa.string()),
+                pc.divide(pa.array(amounts, pa.int64()).cast(pa.decimal128(20, 0)),
+                          minor_units).cast(amount_type),
+                pa.array(timestamps, pa.string()).cast(pa.timestamp("s")),
+                pa.array(notes, pa.string()),
+            ], schema=schema))
+    finally:
+        writer.close()
+
+
+def export_transactions(manager, path, export_format=None, batch_size=CHUNK_SIZE,
+                        progress=None, is_cancelled=None, **filters):
+    """Потоковый экспорт транзакций в csv, csv.gz, parquet или arrow.
+
+    Данные пишутся во временный файл, который заменяет path только после успешного
+    завершения; при отмене выбрасывается ExportCancelled. filters передаются в
+    FamilyFinanceManager.iter_transactions. Возвращает количество строк.
+    """
+    export_format = export_format or detect_export_format(path)
+    if export_format not in EXPORT_FORMATS.values():
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+    manager.cursor.execute("SELECT (SELECT COUNT(*) FROM transactions)"
+                           " + (SELECT COALESCE(SUM(row_count), 0) FROM archives)")
+    total = manager.cursor.fetchone()[0] or 1
+    exported = 0
+
+    def tracked_batches():
+        nonlocal exported
+        for rows in manager.iter_transactions(batch_size, **filters):
+            if is_cancelled and is_cancelled():
+                raise ExportCancelled("Экспорт отменен")
+            yield rows
+            exported += len(rows)
+            if progress:
+                progress(min(99, exported * 100 // total))
+
+    temp_path = path + ".part"
+    try:
+        if export_format == "csv":
+            with open(temp_path, "w", newline="", encoding="utf-8") as file:
+                _write_csv(tracked_batches(), file)
+        elif export_format == "csv.gz":
+            with gzip.open(temp_path, "wt", compresslevel=6, newline="", encoding="utf-8") as file:
+                _write_csv(tracked_batches(), file)
+        else:
+            _write_arrow(tracked_batches(), temp_path, export_format)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    if progress:
+        progress(100)
+    return exported
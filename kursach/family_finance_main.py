@@ -1,102 +1,578 @@
+import time
+
+# Отсчет времени запуска для отчета StartupTimer, до импорта PyQt5
+STARTED = time.perf_counter()
+
+import argparse
+import os
 import sys
-import csv
-import matplotlib.pyplot as plt
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QWidget, QPushButton, QLabel,
-    QLineEdit, QTableWidget, QTableWidgetItem, QMessageBox, QFormLayout,
+    QLineEdit, QTableView, QMessageBox, QFormLayout,
     QHBoxLayout, QAction, QFileDialog, QTabWidget, QComboBox, QMenuBar,
-    QDialog, QDialogButtonBox, QDateEdit, QSplitter, QGridLayout, QHeaderView
+    QDialog, QDialogButtonBox, QDateEdit, QSplitter, QGridLayout, QHeaderView,
+    QProgressDialog, QTableWidget, QTableWidgetItem, QInputDialog
 )
 from PyQt5.QtGui import QFont, QColor
-from PyQt5.QtCore import Qt, QDate
-import sqlite3
+from PyQt5.QtCore import (
+    Qt, QDate, QAbstractTableModel, QModelIndex, QObject, QThread, QTimer, QEvent, pyqtSignal
+)
+from family_finance_accounts import AccountBook
+from family_finance_core import BudgetExceeded, FamilyFinanceManager, format_amount, to_minor_units
+from family_finance_metrics import (disable_thread_profile, enable_thread_profile, metrics,
+                                    profiled_thread, start_session_profile)
 from family_finance_styles import apply_styles
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from family_finance_io import import_statement, export_transactions
 
-class FamilyFinanceManager:
-    def __init__(self, db_file="finance_data.db"):
+class DatabaseWorker(QObject):
+    """Отдельный поток, который владеет соединением с базой и выполняет задания по очереди.
+
+    submit(job, callback, key) ставит job(manager) в очередь и возвращает Future;
+    callback(result) вызывается в потоке интерфейса. Для заданий с одинаковым key
+    актуально только последнее: более старые пропускаются, а их результаты
+    отбрасываются. После close() новые задания не принимаются, а результаты
+    оставшихся не доставляются.
+    """
+    result_ready = pyqtSignal(int, object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, db_file, profile=FamilyFinanceManager.DEFAULT_PROFILE, read_only=False,
+                 parent=None):
+        super().__init__(parent)
         self.db_file = db_file
-        self.balance = 0
-        self.init_db()
-        self.load_balance()
-
-    def init_db(self):
-        """Инициализация базы данных."""
-        self.conn = sqlite3.connect(self.db_file)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                category TEXT,
-                amount REAL NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS balance (
-                id INTEGER PRIMARY KEY,
-                current_balance REAL NOT NULL
-            )
-        """)
-        self.conn.commit()
-
-    def load_balance(self):
-        self.cursor.execute("SELECT current_balance FROM balance LIMIT 1")
-        result = self.cursor.fetchone()
-        if result:
-            self.balance = result[0]
-        else:
-            self.balance = 0
-            self.cursor.execute("INSERT INTO balance (current_balance) VALUES (?)", (self.balance,))
-            self.conn.commit()
-
-    def save_balance(self):
-        self.cursor.execute("UPDATE balance SET current_balance = ?", (self.balance,))
-        self.conn.commit()
-
-    def add_income(self, amount):
-        """Добавление дохода."""
-        if amount > 0:
-            self.balance += amount
-            self.cursor.execute(
-                "INSERT INTO transactions (category, amount) VALUES (?, ?)",
-                (None, amount)
-            )
-            self.save_balance()
-            return True
-        return False
+        self.profile = profile
+        self.read_only = read_only
+        # Ошибка открытия базы: задания после нее не выполняются
+        self.open_error = None
+        self._closed = False
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="finance-db", initializer=self._open)
+        self._callbacks = {}
+        self._latest = {}
+        self._next_id = 0
+        self.result_ready.connect(self._deliver)
+
+    def _open(self):
+        enable_thread_profile()
+        # Исключение в initializer навсегда ломает пул, поэтому ошибка сохраняется
+        # и сообщается один раз через failed
+        try:
+            self._local.manager = FamilyFinanceManager(self.db_file, self.profile, self.read_only)
+        except Exception as e:
+            self.open_error = e
+            self.failed.emit(f"Не удалось открыть базу {self.db_file}: {e}")
+
+    def submit(self, job, callback=None, key=None, on_error=None):
+        """Постановка задания job(manager) в очередь потока базы данных.
+
+        После закрытия задание не ставится и возвращается None.
+        """
+        if self._closed:
+            return None
+        self._next_id += 1
+        job_id = self._next_id
+        if key is not None:
+            self._latest[key] = job_id
+        self._callbacks[job_id] = (callback, on_error, key)
+        return self._executor.submit(self._run, job_id, key, job)
+
+    def _is_stale(self, job_id, key):
+        return key is not None and self._latest.get(key) != job_id
+
+    def _run(self, job_id, key, job):
+        result = error = None
+        if self.open_error is not None:
+            error = self.open_error
+        elif not self._is_stale(job_id, key):
+            start = time.perf_counter()
+            try:
+                result = job(self._local.manager)
+            except Exception as e:
+                error = e
+            metrics.record(f"Задание БД: {key or 'без ключа'}", time.perf_counter() - start)
+        self.result_ready.emit(job_id, result, error)
+        if error is not None:
+            raise error
+        return result
+
+    def _deliver(self, job_id, result, error):
+        callback, on_error, key = self._callbacks.pop(job_id)
+        if self._closed or self._is_stale(job_id, key):
+            return
+        if self.open_error is not None and error is self.open_error:
+            return
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                self.failed.emit(str(error))
+        elif callback:
+            callback(result)
+
+    def close(self):
+        """Завершение потока после выполнения поставленных заданий.
+
+        Повторный вызов ничего не делает.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _close(self):
+        if self.open_error is None:
+            self._local.manager.close()
+        disable_thread_profile()
+
+class TransactionsTableModel(QAbstractTableModel):
+    """Модель таблицы транзакций с постраничной подгрузкой из базы данных.
 
-    def add_expense(self, category, amount):
-        """Добавление расхода."""
-        if amount > 0 and self.balance >= amount:
-            self.balance -= amount
-            self.cursor.execute(
-                "INSERT INTO transactions (category, amount) VALUES (?, ?)",
-                (category, -amount)
-            )
-            self.save_balance()
+    С непустой строкой поиска модель показывает результаты полнотекстового поиска
+    одной страницей, в порядке ранга.
+    """
+    HEADERS = ["Категория", "Сумма", "Дата", "Примечание"]
+    PAGE_SIZE = 500
+    MAX_CACHED_PAGES = 8
+    INCOME_COLOR = QColor(0, 128, 0)
+    EXPENSE_COLOR = QColor(255, 0, 0)
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.filters = {}
+        self.search_text = ""
+        self._generation = 0
+        # Начало перезагрузки: время до показа первой страницы попадает в метрики
+        self._reload_started = None
+        self._reset_cache()
+
+    def _reset_cache(self):
+        self._row_count = 0
+        self._page_starts = []  # ключ (timestamp, id), после которого начинается страница
+        self._pages = OrderedDict()  # только недавно просмотренные страницы
+        self._loading_pages = set()
+        self._last_key = None
+        self._exhausted = False
+        self._fetching = False
+
+    def set_filters(self, date_filter=None, category_filter=None):
+        """Сброс модели и загрузка данных с новыми фильтрами.
+
+        Страницы, запрошенные со старыми фильтрами, после сброса игнорируются.
+        """
+        self.filters = {"date_filter": date_filter, "category_filter": category_filter}
+        self.reload()
+
+    def set_search(self, text):
+        """Переключение на результаты поиска по тексту; пустой текст - обычный режим."""
+        text = text.strip()
+        if text != self.search_text:
+            self.search_text = text
+            self.reload()
+
+    def reload(self):
+        """Полная перезагрузка с текущими фильтрами."""
+        self._reload_started = time.perf_counter()
+        self.beginResetModel()
+        self._generation += 1
+        self._reset_cache()
+        self.endResetModel()
+
+    def _matches(self, row):
+        _, category, _, timestamp, _ = row
+        date_filter = self.filters.get("date_filter")
+        category_filter = self.filters.get("category_filter")
+        return ((not date_filter or timestamp[:10] == date_filter)
+                and (not category_filter or category == category_filter))
+
+    def append_transaction(self, row):
+        """Точечное добавление новой строки (id, категория, сумма, дата, примечание) без перезагрузки.
+
+        Возвращает False, если строку нельзя добавить в конец и нужна полная перезагрузка.
+        """
+        if self.search_text:
+            # Место строки в результатах поиска определяет ранг
+            return False
+        if not self._matches(row) or not self._exhausted:
+            # Не подходит под фильтры или будет загружена вместе со следующей страницей
             return True
+        key = (row[3], row[0])
+        if self._last_key is not None and key <= self._last_key:
+            return False
+        if self._row_count % self.PAGE_SIZE == 0:
+            self._page_starts.append(self._last_key)
+            self._store_page(len(self._page_starts) - 1, [row])
+        else:
+            page = len(self._page_starts) - 1
+            if page in self._pages:
+                self._pages[page] = self._pages[page] + [row]
+        self._last_key = key
+        self.beginInsertRows(QModelIndex(), self._row_count, self._row_count)
+        self._row_count += 1
+        self.endInsertRows()
+        return True
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted and not self._fetching
+
+    def _load_page(self, after, callback):
+        """Запрос страницы в потоке базы данных; callback получит строки."""
+        generation = self._generation
+        filters = dict(self.filters)
+        search_text = self.search_text
+        start = time.perf_counter()
+
+        def loaded(rows):
+            metrics.record("Таблица: загрузка страницы", time.perf_counter() - start,
+                           rows=len(rows))
+            if generation == self._generation:
+                callback(rows)
+
+        if search_text:
+            # Результаты поиска - одна страница; устаревшие запросы при наборе пропускаются
+            self.db.submit(
+                lambda manager: manager.search_transactions(search_text, self.PAGE_SIZE),
+                loaded, key="search")
+            return
+        self.db.submit(
+            lambda manager: manager.get_transactions_page(after, self.PAGE_SIZE, **filters),
+            loaded)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._fetching:
+            return
+        self._fetching = True
+        self._load_page(self._last_key, self._append_page)
+
+    def _append_page(self, rows):
+        self._fetching = False
+        if len(rows) < self.PAGE_SIZE or self.search_text:
+            self._exhausted = True
+        if rows:
+            self._page_starts.append(self._last_key)
+            self._last_key = (rows[-1][3], rows[-1][0])
+            self._store_page(len(self._page_starts) - 1, rows)
+            self.beginInsertRows(QModelIndex(), self._row_count, self._row_count + len(rows) - 1)
+            self._row_count += len(rows)
+            self.endInsertRows()
+        if self._reload_started is not None:
+            metrics.record("Таблица: обновление", time.perf_counter() - self._reload_started,
+                           rows=len(rows))
+            self._reload_started = None
+
+    def _store_page(self, page, rows):
+        self._pages[page] = rows
+        self._pages.move_to_end(page)
+        while len(self._pages) > self.MAX_CACHED_PAGES:
+            self._pages.popitem(last=False)
+
+    def _page(self, page):
+        """Строки страницы из кэша; вытесненная страница загружается повторно в фоне."""
+        rows = self._pages.get(page)
+        if rows is not None:
+            self._pages.move_to_end(page)
+            return rows
+        if page not in self._loading_pages:
+            self._loading_pages.add(page)
+
+            def reloaded(rows):
+                self._loading_pages.discard(page)
+                self._store_page(page, rows)
+                first = page * self.PAGE_SIZE
+                last = min(first + len(rows), self._row_count) - 1
+                if last >= first:
+                    self.dataChanged.emit(self.index(first, 0),
+                                          self.index(last, len(self.HEADERS) - 1))
+
+            self._load_page(self._page_starts[page], reloaded)
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ForegroundRole):
+            return None
+        rows = self._page(index.row() // self.PAGE_SIZE)
+        offset = index.row() % self.PAGE_SIZE
+        if rows is None or offset >= len(rows):
+            return None
+        _, category, amount, timestamp, note = rows[offset]
+        column = index.column()
+        if role == Qt.ForegroundRole:
+            if column != 1:
+                return None
+            # Красный для расходов, зеленый для доходов
+            return self.EXPENSE_COLOR if amount < 0 else self.INCOME_COLOR
+        if column == 0:
+            return category if category else "Доход"
+        if column == 1:
+            return f"{format_amount(abs(amount))} ₽"
+        if column == 2:
+            return timestamp
+        return note
+
+class TaskThread(QThread):
+    """Долгая операция в отдельном потоке с прогрессом и отменой.
+
+    task(progress, is_cancelled) выполняется в потоке; progress(percent) передает
+    прогресс в интерфейс, is_cancelled() сообщает о нажатии кнопки отмены.
+    """
+    progress = pyqtSignal(int)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, task, parent=None):
+        super().__init__(parent)
+        self.task = task
+
+    def run(self):
+        try:
+            with profiled_thread():
+                result = self.task(self.progress.emit, self.isInterruptionRequested)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.succeeded.emit(result)
+
+class RefreshScheduler(QObject):
+    """Отложенное обновление представлений после изменения данных.
+
+    mark_dirty помечает представления устаревшими; все пометки за один кадр
+    объединяются в одно обновление. Представление на скрытой вкладке обновляется
+    только тогда, когда его покажут.
+    """
+    FRAME_MS = 16
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._views = {}
+        self._dirty = set()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.FRAME_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def register(self, name, refresh, is_visible=None):
+        """Регистрация представления: refresh() обновляет его, is_visible() - виден ли он."""
+        self._views[name] = (refresh, is_visible or (lambda: True))
+
+    def mark_dirty(self, *names):
+        self._dirty.update(names)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """Обновление видимых устаревших представлений."""
+        for name in list(self._dirty):
+            refresh, is_visible = self._views[name]
+            if is_visible():
+                self._dirty.discard(name)
+                refresh()
+
+    def stop(self):
+        """Отмена отложенного обновления."""
+        self._timer.stop()
+        self._dirty.clear()
+
+class DiagnosticsDialog(QDialog):
+    """Метрики производительности: p50/p95/p99 по операциям и медленные операции."""
+    SUMMARY_HEADERS = ["Операция", "Количество", "p50, мс", "p95, мс", "p99, мс", "Макс., мс",
+                       "Всего, мс"]
+    SLOW_HEADERS = ["Время", "Операция", "мс", "Строк"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Диагностика")
+        self.resize(900, 600)
+        layout = QVBoxLayout(self)
+        self.summary_table = self._table(self.SUMMARY_HEADERS)
+        layout.addWidget(self.summary_table, 3)
+        layout.addWidget(QLabel(f"Медленные операции (дольше {metrics.slow_ms:g} мс):"))
+        self.slow_table = self._table(self.SLOW_HEADERS)
+        layout.addWidget(self.slow_table, 2)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        refresh_button = buttons.addButton("Обновить", QDialogButtonBox.ActionRole)
+        refresh_button.clicked.connect(self.refresh)
+        reset_button = buttons.addButton("Сбросить", QDialogButtonBox.ResetRole)
+        reset_button.clicked.connect(self.reset)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.refresh()
+
+    @staticmethod
+    def _table(headers):
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.horizontalHeader().setSectionResizeMode(headers.index("Операция"), QHeaderView.Stretch)
+        return table
+
+    @staticmethod
+    def _fill(table, rows, text_columns):
+        """Заполнение таблицы строками; столбцы кроме text_columns - числа, по правому краю."""
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column in text_columns:
+                    item.setToolTip(value)
+                else:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                table.setItem(row, column, item)
+
+    def refresh(self):
+        self._fill(self.summary_table, [
+            (name, str(count)) + tuple(f"{seconds * 1000:.2f}" for seconds in times)
+            for name, count, *times in metrics.summary()], {0})
+        self._fill(self.slow_table, [
+            (time.strftime("%H:%M:%S", time.localtime(moment)), name, f"{seconds * 1000:.1f}",
+             "" if rows is None else str(rows))
+            for moment, name, seconds, _, rows in metrics.slow_operations()], {0, 1})
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+
+class StartupTimer(QObject):
+    """Замер запуска приложения: время до первой отрисовки окна и до готовности к работе.
+
+    Готовность наступает, когда поток базы данных выполнил все запросы, поставленные
+    при создании окна (баланс, первая страница таблицы), и их результаты показаны.
+    Время отсчитывается от started; finished передает словарь {этап: секунды}.
+    """
+    finished = pyqtSignal(dict)
+
+    def __init__(self, window, db, started=STARTED):
+        super().__init__(window)
+        self.db = db
+        self.started = started
+        self.times = {}
+        window.installEventFilter(self)
+
+    def mark(self, stage):
+        self.times[stage] = time.perf_counter() - self.started
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and "first_paint" not in self.times:
+            self.mark("first_paint")
+            obj.removeEventFilter(self)
+            # Очередь потока базы данных обрабатывается по порядку
+            self.db.submit(lambda manager: None, lambda _: QTimer.singleShot(0, self._interactive))
         return False
 
-    def get_transactions(self, date_filter=None, category_filter=None):
-        """Получение всех транзакций с фильтрами."""
-        query = "SELECT category, amount, timestamp FROM transactions WHERE 1=1"
-        params = []
-        if date_filter:
-            query += " AND DATE(timestamp) = ?"
-            params.append(date_filter)
-        if category_filter:
-            query += " AND category = ?"
-            params.append(category_filter)
-        self.cursor.execute(query, params)
-        return self.cursor.fetchall()
+    def _interactive(self):
+        self.mark("interactive")
+        self.finished.emit(dict(self.times))
+
+    @staticmethod
+    def format(times):
+        return ", ".join(f"{stage}: {seconds * 1000:.0f} мс" for stage, seconds in times.items())
+
+
+class BudgetsDialog(QDialog):
+    """Месячные лимиты расходов по категориям.
+
+    budgets - список (категория, лимит, запрет перерасхода, расходы за месяц) из
+    FamilyFinanceManager.get_budgets; changed_budgets() возвращает измененные строки
+    как (категория, лимит, запрет).
+    """
+    HEADERS = ["Категория", "Расходы за месяц", "Лимит", "Запретить перерасход"]
+
+    def __init__(self, budgets, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Бюджеты")
+        self.resize(600, 400)
+        self.budgets = budgets
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(len(budgets), len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for row, (category, limit, block, spent) in enumerate(budgets):
+            name_item = QTableWidgetItem(category)
+            name_item.setFlags(Qt.ItemIsEnabled)
+            spent_item = QTableWidgetItem(format_amount(spent))
+            spent_item.setFlags(Qt.ItemIsEnabled)
+            spent_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            if limit is not None and spent > limit:
+                spent_item.setForeground(QColor("#c62828"))
+            limit_item = QTableWidgetItem("" if limit is None else format_amount(limit))
+            limit_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            block_item = QTableWidgetItem()
+            block_item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsUserCheckable)
+            block_item.setCheckState(Qt.Checked if block else Qt.Unchecked)
+            for column, item in enumerate((name_item, spent_item, limit_item, block_item)):
+                self.table.setItem(row, column, item)
+        layout.addWidget(self.table)
+        layout.addWidget(QLabel("Пустой лимит - без ограничения. Без запрета перерасхода "
+                                "программа только предупреждает о превышении."))
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def accept(self):
+        try:
+            self.changed_budgets()
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка", str(e))
+            return
+        super().accept()
+
+    def changed_budgets(self):
+        """Измененные лимиты [(категория, лимит в копейках или None, запрет)]; ValueError при ошибке."""
+        changed = []
+        for row, (category, limit, block, _) in enumerate(self.budgets):
+            text = self.table.item(row, 2).text().strip()
+            new_limit = None
+            if text:
+                new_limit = to_minor_units(text)
+                if new_limit < 0:
+                    raise ValueError(f"Лимит категории «{category}» не может быть отрицательным")
+            new_block = self.table.item(row, 3).checkState() == Qt.Checked
+            if (new_limit, new_block) != (limit, block):
+                changed.append((category, new_limit, new_block))
+        return changed
 
 class FinanceApp(QMainWindow):
-    def __init__(self):
+    # Период обслуживания базы: контрольная точка WAL и обновление статистики
+    MAINTENANCE_INTERVAL_MS = 10 * 60 * 1000
+    # Период проверки изменений, сделанных другими процессами
+    CHANGE_POLL_INTERVAL_MS = 1000
+    # Пауза после ввода символа в строку поиска перед запросом
+    SEARCH_DELAY_MS = 150
+
+    def __init__(self, db_file="finance_data.db", profile=FamilyFinanceManager.DEFAULT_PROFILE,
+                 read_only=False):
         super().__init__()
         self.current_theme = "light"
-        self.finance_manager = FamilyFinanceManager()
-        self.setWindowTitle("Менеджер семейных финансов")
+        self.read_only = read_only
+        # Вся работа с базой выполняется в отдельном потоке, интерфейс только отображает результаты
+        self.db = DatabaseWorker(db_file, profile, read_only, self)
+        self.db.failed.connect(self.show_database_error)
+        # Кэш данных для точечных обновлений: баланс и суммы расходов по категориям
+        self.balance = None
+        self.expense_totals = None
+        self.data_version = None
+        self.refresh_scheduler = RefreshScheduler(self)
+        self.startup_timer = StartupTimer(self, self.db)
+        self.setWindowTitle("Менеджер семейных финансов" + (" (только просмотр)" if read_only else ""))
         self.setGeometry(100, 100, 900, 700)
 
         # Создаем меню
@@ -117,6 +593,26 @@ class FinanceApp(QMainWindow):
         self.update_balance_label()
         self.update_transactions_table()
 
+        self.load_categories()
+
+        if read_only:
+            for widget in (self.import_action, self.add_income_button, self.add_expense_button,
+                           self.income_input, self.expense_amount_input, self.budgets_action,
+                           self.archive_action,
+                           self.income_note_input, self.expense_note_input):
+                widget.setEnabled(False)
+        else:
+            self.maintenance_timer = QTimer(self)
+            self.maintenance_timer.setInterval(self.MAINTENANCE_INTERVAL_MS)
+            self.maintenance_timer.timeout.connect(self.run_maintenance)
+            self.maintenance_timer.start()
+
+        # Изменения, записанные другими процессами (импорт из скрипта, второе окно)
+        self.change_timer = QTimer(self)
+        self.change_timer.setInterval(self.CHANGE_POLL_INTERVAL_MS)
+        self.change_timer.timeout.connect(self.poll_changes)
+        self.change_timer.start()
+
     def create_menu(self):
         """Создание меню приложения."""
         menubar = self.menuBar()
@@ -124,8 +620,12 @@ class FinanceApp(QMainWindow):
         # Меню Файл
         file_menu = menubar.addMenu("Файл")
         
-        export_action = QAction("Экспорт в CSV", self)
-        export_action.triggered.connect(self.export_to_csv)
+        self.import_action = QAction("Импорт выписки", self)
+        self.import_action.triggered.connect(self.import_statement)
+        file_menu.addAction(self.import_action)
+
+        export_action = QAction("Экспорт данных", self)
+        export_action.triggered.connect(self.export_data)
         file_menu.addAction(export_action)
         
         theme_action = QAction("Переключить тему", self)
@@ -136,6 +636,21 @@ class FinanceApp(QMainWindow):
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
 
+        # Меню Сервис
+        service_menu = menubar.addMenu("Сервис")
+        verify_action = QAction("Проверить сводные данные", self)
+        verify_action.triggered.connect(self.verify_data)
+        service_menu.addAction(verify_action)
+        self.budgets_action = QAction("Бюджеты", self)
+        self.budgets_action.triggered.connect(self.edit_budgets)
+        service_menu.addAction(self.budgets_action)
+        self.archive_action = QAction("Архивировать год", self)
+        self.archive_action.triggered.connect(self.archive_year)
+        service_menu.addAction(self.archive_action)
+        diagnostics_action = QAction("Диагностика", self)
+        diagnostics_action.triggered.connect(self.show_diagnostics)
+        service_menu.addAction(diagnostics_action)
+
         # Меню Помощь
         help_menu = menubar.addMenu("Помощь")
         about_action = QAction("О программе", self)
@@ -150,15 +665,39 @@ class FinanceApp(QMainWindow):
         self.home_tab = QWidget()
         self.setup_home_tab()
         
-        # Вкладка Графики
+        # Вкладки Графики и Динамика: содержимое создается при первом открытии
         self.charts_tab = QWidget()
-        self.setup_charts_tab()
+        self.expense_chart = None
+        self.trends_tab = QWidget()
+        self.trend_chart = None
+        # Снимок журнала для аналитики; создается и используется только в потоке базы данных
+        self.ledger_snapshot = None
         
         self.tabs.addTab(self.home_tab, "Главная")
         self.tabs.addTab(self.charts_tab, "Графики")
+        self.tabs.addTab(self.trends_tab, "Динамика")
+        self.tabs.currentChanged.connect(self.tab_changed)
         
         self.main_layout.addWidget(self.tabs)
 
+        self.refresh_scheduler.register("balance", self.show_balance)
+        self.refresh_scheduler.register(
+            "transactions", self.transactions_model.reload,
+            lambda: self.tabs.currentWidget() is self.home_tab)
+        self.refresh_scheduler.register(
+            "expense_chart", self.refresh_expense_chart,
+            lambda: self.expense_chart is not None and self.tabs.currentWidget() is self.charts_tab)
+        self.refresh_scheduler.register(
+            "trend_chart", self.load_trends,
+            lambda: self.trend_chart is not None and self.tabs.currentWidget() is self.trends_tab)
+
+    def tab_changed(self):
+        if self.tabs.currentWidget() is self.charts_tab and self.expense_chart is None:
+            self.setup_charts_tab()
+        if self.tabs.currentWidget() is self.trends_tab and self.trend_chart is None:
+            self.setup_trends_tab()
+        self.refresh_scheduler.flush()
+
     def setup_home_tab(self):
         """Настройка содержимого вкладки Главная."""
         layout = QVBoxLayout()
@@ -179,7 +718,7 @@ class FinanceApp(QMainWindow):
 
     def setup_balance_block(self, layout):
         """Настройка блока с балансом."""
-        self.balance_label = QLabel(f"Текущий баланс: {self.finance_manager.balance} ₽")
+        self.balance_label = QLabel("Текущий баланс: … ₽")
         self.balance_label.setAlignment(Qt.AlignCenter)
         self.balance_label.setFont(QFont("Arial", 16, QFont.Bold))
         self.balance_label.setObjectName("balance_label")
@@ -193,6 +732,9 @@ class FinanceApp(QMainWindow):
         self.income_input = QLineEdit()
         self.income_input.setPlaceholderText("Введите сумму дохода")
         income_layout.addWidget(self.income_input)
+        self.income_note_input = QLineEdit()
+        self.income_note_input.setPlaceholderText("Примечание")
+        income_layout.addWidget(self.income_note_input)
         self.add_income_button = QPushButton("Добавить доход")
         self.add_income_button.clicked.connect(self.add_income)
         income_layout.addWidget(self.add_income_button)
@@ -200,13 +742,16 @@ class FinanceApp(QMainWindow):
 
         # Блок расхода
         expense_layout = QFormLayout()
+        # Списки категорий заполняет load_categories из справочника в базе
         self.expense_category_input = QComboBox()
-        self.expense_category_input.addItems(["Продукты", "Транспорт", "ЖКХ", "Развлечения", "Одежда"])
         self.expense_category_input.setEditable(True)
         self.expense_amount_input = QLineEdit()
         self.expense_amount_input.setPlaceholderText("Введите сумму расхода")
+        self.expense_note_input = QLineEdit()
+        self.expense_note_input.setPlaceholderText("Получатель, назначение")
         expense_layout.addRow("Категория расхода:", self.expense_category_input)
         expense_layout.addRow("Сумма расхода:", self.expense_amount_input)
+        expense_layout.addRow("Примечание:", self.expense_note_input)
         self.add_expense_button = QPushButton("Добавить расход")
         self.add_expense_button.clicked.connect(self.add_expense)
         expense_layout.addRow(self.add_expense_button)
@@ -223,7 +768,7 @@ class FinanceApp(QMainWindow):
         
         filter_layout.addWidget(QLabel("Категория:"), 1, 0)
         self.category_filter = QComboBox()
-        self.category_filter.addItems(["Все категории", "Продукты", "Транспорт", "ЖКХ", "Развлечения", "Одежда"])
+        self.category_filter.addItem("Все категории")
         filter_layout.addWidget(self.category_filter, 1, 1)
         
         self.filter_button = QPushButton("Применить фильтры")
@@ -232,26 +777,45 @@ class FinanceApp(QMainWindow):
         self.clear_filters_button.clicked.connect(self.clear_filters)
         filter_layout.addWidget(self.filter_button, 2, 0)
         filter_layout.addWidget(self.clear_filters_button, 2, 1)
+
+        filter_layout.addWidget(QLabel("Поиск:"), 3, 0)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Примечание или категория, можно начало слова")
+        self.search_input.setClearButtonEnabled(True)
+        filter_layout.addWidget(self.search_input, 3, 1)
+        # Запрос уходит после паузы в наборе, а не на каждый символ
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.search_input.textChanged.connect(self.search_timer.start)
         
         layout.addLayout(filter_layout)
 
     def setup_transactions_table(self, layout):
         """Настройка таблицы транзакций."""
-        self.transactions_table = QTableWidget()
-        self.transactions_table.setColumnCount(3)
-        self.transactions_table.setHorizontalHeaderLabels(["Категория", "Сумма", "Дата"])
+        self.transactions_model = TransactionsTableModel(self.db, self)
+        self.transactions_table = QTableView()
+        self.transactions_table.setModel(self.transactions_model)
         self.transactions_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
         self.transactions_table.verticalHeader().setVisible(False)
         layout.addWidget(self.transactions_table)
 
     def setup_charts_tab(self):
-        """Настройка вкладки с графиками."""
+        """Настройка вкладки с графиками; matplotlib загружается только здесь."""
+        from family_finance_charts import ExpensePieChart
+
         layout = QVBoxLayout()
         
-        # Контейнер для графиков
+        # Контейнер для графиков: одна фигура на все время работы
         self.chart_container = QWidget()
         self.chart_layout = QVBoxLayout()
         self.chart_container.setLayout(self.chart_layout)
+        self.expense_chart = ExpensePieChart(self.current_theme)
+        self.no_data_label = QLabel("Нет данных о расходах для построения графика")
+        self.no_data_label.setAlignment(Qt.AlignCenter)
+        self.chart_layout.addWidget(self.expense_chart.canvas)
+        self.chart_layout.addWidget(self.no_data_label)
         
         # Кнопки для управления графиками
         buttons_layout = QHBoxLayout()
@@ -263,125 +827,225 @@ class FinanceApp(QMainWindow):
         layout.addWidget(self.chart_container)
         
         self.charts_tab.setLayout(layout)
-        self.plot_expense_analysis()
+        self.startup_timer.mark("charts_tab")
+        self.refresh_expense_chart()
+
+    def setup_trends_tab(self):
+        """Настройка вкладки с динамикой по месяцам и балансом."""
+        from family_finance_charts import TrendChart
+
+        layout = QVBoxLayout()
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(QLabel("Скользящие средние расходов:"))
+        self.trend_category_input = QComboBox()
+        self.trend_category_input.addItem("Все категории")
+        self.trend_category_input.currentIndexChanged.connect(self.load_trends)
+        controls_layout.addWidget(self.trend_category_input)
+        controls_layout.addStretch()
+        layout.addLayout(controls_layout)
+
+        self.trend_chart = TrendChart(self.current_theme)
+        # Ряд баланса прореживается до ширины графика, поэтому при изменении размера
+        # данные запрашиваются заново
+        self.trend_chart.canvas.mpl_connect(
+            "resize_event", lambda event: self.refresh_scheduler.mark_dirty("trend_chart"))
+        layout.addWidget(self.trend_chart.canvas)
+        self.trends_tab.setLayout(layout)
+        self.load_trends()
+
+    def load_trends(self):
+        """Расчет динамики в потоке базы данных по снимку LedgerSnapshot."""
+        category = self.trend_category_input.currentText()
+        if self.trend_category_input.currentIndex() == 0:
+            category = None
+        buckets = self.trend_chart.pixel_width() // 2
+
+        def trends(manager):
+            from family_finance_analytics import LedgerSnapshot, downsample_minmax
+
+            if self.ledger_snapshot is None:
+                self.ledger_snapshot = LedgerSnapshot(manager)
+            snapshot = self.ledger_snapshot
+            snapshot.refresh()
+            dates, balance = downsample_minmax(*snapshot.balance_by_time(), buckets)
+            categories = sorted(name for name in snapshot.categories if name is not None)
+            return snapshot.monthly_trends(category), dates, balance, category, categories
+
+        self.db.submit(trends, self.draw_trend_chart, key="trend_chart")
+
+    def draw_trend_chart(self, result):
+        trends, dates, balance, category, categories = result
+        known = [self.trend_category_input.itemText(index)
+                 for index in range(1, self.trend_category_input.count())]
+        if known != categories:
+            self.trend_category_input.blockSignals(True)
+            self.trend_category_input.clear()
+            self.trend_category_input.addItem("Все категории")
+            self.trend_category_input.addItems(categories)
+            if category in categories:
+                self.trend_category_input.setCurrentText(category)
+            self.trend_category_input.blockSignals(False)
+        self.trend_chart.update(trends, dates, balance, category)
+
+    def load_categories(self):
+        """Загрузка справочника категорий для списков выбора."""
+        self.db.submit(lambda manager: manager.get_categories(), self.set_categories,
+                       key="categories")
+
+    def set_categories(self, categories):
+        """Заполнение списков категорий с сохранением выбранных значений."""
+        expense_category = self.expense_category_input.currentText()
+        self.expense_category_input.clear()
+        self.expense_category_input.addItems(categories)
+        if expense_category:
+            self.expense_category_input.setCurrentText(expense_category)
+        category_filter = self.category_filter.currentText()
+        self.category_filter.clear()
+        self.category_filter.addItem("Все категории")
+        self.category_filter.addItems(categories)
+        self.category_filter.setCurrentText(category_filter)
 
     def update_balance_label(self):
         """Обновление отображения баланса."""
-        self.balance_label.setText(f"Текущий баланс: {self.finance_manager.balance} ₽")
+        self.db.submit(lambda manager: manager.balance, self.set_balance, key="balance")
+
+    def set_balance(self, balance):
+        self.balance = balance
+        self.refresh_scheduler.mark_dirty("balance")
+
+    def show_balance(self):
+        self.balance_label.setText(f"Текущий баланс: {format_amount(self.balance)} ₽")
 
     def update_transactions_table(self, date_filter=None, category_filter=None):
         """Обновление таблицы транзакций."""
-        transactions = self.finance_manager.get_transactions(date_filter, category_filter)
-        self.transactions_table.setRowCount(len(transactions))
-        
-        for row, transaction in enumerate(transactions):
-            category, amount, timestamp = transaction
-            
-            # Категория
-            category_item = QTableWidgetItem(category if category else "Доход")
-            self.transactions_table.setItem(row, 0, category_item)
-            
-            # Сумма
-            amount_item = QTableWidgetItem(f"{abs(amount):.2f} ₽")
-            if amount < 0:
-                amount_item.setForeground(QColor(255, 0, 0))  # Красный для расходов
-            else:
-                amount_item.setForeground(QColor(0, 128, 0))  # Зеленый для доходов
-            self.transactions_table.setItem(row, 1, amount_item)
-            
-            # Дата
-            self.transactions_table.setItem(row, 2, QTableWidgetItem(timestamp))
+        self.transactions_model.set_filters(date_filter, category_filter)
 
     def plot_expense_analysis(self):
         """Построение круговой диаграммы расходов."""
-        # Очистка предыдущего графика
-        for i in reversed(range(self.chart_layout.count())):
-            self.chart_layout.itemAt(i).widget().setParent(None)
-        
-        # Получение данных
-        expenses = {}
-        transactions = self.finance_manager.get_transactions()
-        for t in transactions:
-            category, amount, _ = t
-            if amount < 0:  # Только расходы
-                expenses[category] = expenses.get(category, 0) + abs(amount)
-        
-        if not expenses:
-            no_data_label = QLabel("Нет данных о расходах для построения графика")
-            no_data_label.setAlignment(Qt.AlignCenter)
-            self.chart_layout.addWidget(no_data_label)
-            return
-        
-        # Создание графика
-        fig = plt.figure(figsize=(8, 6))
-        if self.current_theme == "dark":
-            fig.patch.set_facecolor('#2d2d2d')
-            plt.rcParams.update({
-                'text.color': 'white',
-                'axes.labelcolor': 'white',
-                'axes.facecolor': '#2d2d2d',
-                'axes.edgecolor': 'lightgray'
-            })
-        
-        ax = fig.add_subplot(111)
-        categories = list(expenses.keys())
-        amounts = list(expenses.values())
-        
-        colors = plt.cm.Pastel1(range(len(categories)))
-        ax.pie(amounts, labels=categories, autopct='%1.1f%%', startangle=90,
-               colors=colors, wedgeprops={'linewidth': 1, 'edgecolor': 'white'})
-        ax.set_title("Распределение расходов по категориям", 
-                    color='white' if self.current_theme == "dark" else 'black')
-        
-        # Встраивание графика в интерфейс
-        canvas = FigureCanvas(fig)
-        self.chart_layout.addWidget(canvas)
+        # Суммирование по категориям выполняется в базе, в потоке базы данных
+        self.db.submit(
+            lambda manager: dict(manager.get_expenses_by_category()),
+            self.set_expense_totals,
+            key="expense_chart")
+
+    def set_expense_totals(self, expenses):
+        self.expense_totals = expenses
+        self.draw_expense_chart(expenses)
+
+    def refresh_expense_chart(self):
+        """Перерисовка графика по кэшу сумм или загрузка сумм, если кэш сброшен."""
+        if self.expense_totals is None:
+            self.plot_expense_analysis()
+        else:
+            self.draw_expense_chart(self.expense_totals)
+
+    def invalidate_views(self):
+        """Сброс кэшей и полное обновление всех представлений (после импорта, пересчета)."""
+        self.expense_totals = None
+        self.update_balance_label()
+        self.load_categories()
+        self.refresh_scheduler.mark_dirty("transactions", "expense_chart", "trend_chart")
+
+    @staticmethod
+    def inserted_transaction(manager):
+        """Добавленная строка и новый баланс для точечного обновления интерфейса."""
+        return manager.get_transaction(manager.last_insert_id), manager.balance
+
+    def apply_transaction(self, row, balance):
+        """Точечное обновление представлений после добавления одной транзакции."""
+        self.set_balance(balance)
+        if not self.transactions_model.append_transaction(row):
+            self.refresh_scheduler.mark_dirty("transactions")
+        _, category, amount, _, _ = row
+        if amount < 0 and self.expense_totals is not None:
+            self.expense_totals[category] = self.expense_totals.get(category, 0) - amount
+            self.refresh_scheduler.mark_dirty("expense_chart")
+        self.refresh_scheduler.mark_dirty("trend_chart")
+
+    def draw_expense_chart(self, expenses):
+        """Отрисовка круговой диаграммы по суммам расходов {категория: сумма}."""
+        has_data = bool(expenses)
+        self.no_data_label.setVisible(not has_data)
+        self.expense_chart.canvas.setVisible(has_data)
+        if has_data:
+            self.expense_chart.update(expenses)
 
     def add_income(self):
         """Обработка добавления дохода."""
         amount_text = self.income_input.text()
+        note = self.income_note_input.text().strip()
         try:
-            amount = float(amount_text)
+            amount = to_minor_units(amount_text)
             if amount <= 0:
                 QMessageBox.warning(self, "Ошибка", "Сумма дохода должна быть положительной")
                 return
-            
-            if self.finance_manager.add_income(amount):
+        except ValueError:
+            QMessageBox.warning(self, "Ошибка", "Введите корректную сумму")
+            return
+
+        def added(result):
+            if result:
                 self.income_input.clear()
-                self.update_balance_label()
-                self.update_transactions_table()
-                self.plot_expense_analysis()
-                QMessageBox.information(self, "Успешно", "Доход успешно добавлен")
+                self.income_note_input.clear()
+                self.apply_transaction(*result)
+                self.statusBar().showMessage("Доход успешно добавлен", 3000)
             else:
                 QMessageBox.warning(self, "Ошибка", "Не удалось добавить доход")
-        except ValueError:
-            QMessageBox.warning(self, "Ошибка", "Введите корректную сумму")
+
+        self.db.submit(
+            lambda manager: manager.add_income(amount, note) and self.inserted_transaction(manager),
+            added)
 
     def add_expense(self):
         """Обработка добавления расхода."""
         category = self.expense_category_input.currentText()
         amount_text = self.expense_amount_input.text()
+        note = self.expense_note_input.text().strip()
         
         if not category:
             QMessageBox.warning(self, "Ошибка", "Укажите категорию расхода")
             return
         
         try:
-            amount = float(amount_text)
+            amount = to_minor_units(amount_text)
             if amount <= 0:
                 QMessageBox.warning(self, "Ошибка", "Сумма расхода должна быть положительной")
                 return
-            
-            if self.finance_manager.add_expense(category, amount):
-                self.expense_amount_input.clear()
-                self.update_balance_label()
-                self.update_transactions_table()
-                self.plot_expense_analysis()
-                QMessageBox.information(self, "Успешно", "Расход успешно добавлен")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Недостаточно средств или произошла ошибка")
         except ValueError:
             QMessageBox.warning(self, "Ошибка", "Введите корректную сумму")
+            return
+
+        def expense(manager):
+            if not manager.add_expense(category, amount, note):
+                return None
+            return self.inserted_transaction(manager), manager.budget_status(category)
+
+        def added(result):
+            if not result:
+                QMessageBox.warning(self, "Ошибка", "Недостаточно средств или произошла ошибка")
+                return
+            transaction, (spent, limit, _) = result
+            self.expense_amount_input.clear()
+            self.expense_note_input.clear()
+            if self.expense_category_input.findText(category) < 0:
+                self.expense_category_input.addItem(category)
+                self.category_filter.addItem(category)
+            self.apply_transaction(*transaction)
+            if limit is not None and spent > limit:
+                QMessageBox.warning(
+                    self, "Превышен бюджет",
+                    f"Расходы категории «{category}» за месяц: {format_amount(spent)} ₽ "
+                    f"при лимите {format_amount(limit)} ₽")
+            else:
+                self.statusBar().showMessage("Расход успешно добавлен", 3000)
+
+        def failed(error):
+            if isinstance(error, BudgetExceeded):
+                QMessageBox.warning(self, "Расход не добавлен", str(error))
+            else:
+                QMessageBox.warning(self, "Ошибка", f"Ошибка базы данных:\n{error}")
+
+        self.db.submit(expense, added, on_error=failed)
 
     def apply_filters(self):
         """Применение фильтров к таблице транзакций."""
@@ -395,40 +1059,218 @@ class FinanceApp(QMainWindow):
         
         self.update_transactions_table(date_filter, category_filter)
 
+    def apply_search(self):
+        """Поиск по примечаниям и категориям в таблице транзакций."""
+        self.transactions_model.set_search(self.search_input.text())
+
     def clear_filters(self):
         """Сброс фильтров."""
         self.date_filter.setDate(QDate.currentDate())
         self.category_filter.setCurrentText("Все категории")
+        self.search_input.clear()
+        self.search_timer.stop()
+        self.transactions_model.search_text = ""
         self.update_transactions_table()
 
     def toggle_theme(self):
         """Переключение между светлой и темной темой."""
         self.current_theme = "dark" if self.current_theme == "light" else "light"
         apply_styles(self, self.current_theme)
-        self.plot_expense_analysis()  # Перерисовка графика с новой темой
+        # Цвета графиков под новую тему
+        for chart in (self.expense_chart, self.trend_chart):
+            if chart is not None:
+                chart.apply_theme(self.current_theme)
+
+    def run_task(self, task, title, on_success):
+        """Запуск операции в TaskThread с окном прогресса и кнопкой отмены."""
+        dialog = QProgressDialog(title, "Отмена", 0, 100, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(0)
+        thread = TaskThread(task, self)
+        thread.progress.connect(dialog.setValue)
+        dialog.canceled.connect(thread.requestInterruption)
+
+        thread.finished.connect(thread.deleteLater)
+
+        def succeeded(result):
+            dialog.reset()
+            on_success(result)
+
+        def failed(message):
+            dialog.reset()
+            QMessageBox.warning(self, "Ошибка", f"{title}: {message}")
+
+        thread.succeeded.connect(succeeded)
+        thread.failed.connect(failed)
+        thread.start()
+
+    def import_statement(self):
+        """Импорт банковской выписки CSV или OFX в фоновом потоке."""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Импорт выписки", "", "Выписки (*.csv *.ofx *.qfx);;Все файлы (*)")
+        if not file_path:
+            return
+        db_file, profile = self.db.db_file, self.db.profile
 
-    def export_to_csv(self):
-        """Экспорт данных в CSV файл."""
+        def task(progress, is_cancelled):
+            # Соединение с базой создается в рабочем потоке
+            manager = FamilyFinanceManager(db_file, profile)
+            try:
+                return import_statement(manager, file_path, progress=progress,
+                                        is_cancelled=is_cancelled)
+            finally:
+                manager.close()
+
+        def imported(count):
+            self.invalidate_views()
+            self.statusBar().showMessage(f"Импортировано транзакций: {count}", 5000)
+
+        self.run_task(task, "Импорт выписки", imported)
+
+    def export_data(self):
+        """Экспорт данных в CSV (в том числе сжатый gzip), Parquet или Arrow в фоновом потоке."""
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "Экспорт данных", "", "CSV файлы (*.csv)")
-        
+            self, "Экспорт данных", "",
+            "CSV файлы (*.csv);;CSV, сжатый gzip (*.csv.gz);;Parquet (*.parquet);;Arrow (*.arrow)")
+
         if not file_path:
             return
-        
-        try:
-            transactions = self.finance_manager.get_transactions()
-            with open(file_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Тип", "Категория", "Сумма", "Дата"])
-                
-                for t in transactions:
-                    category, amount, date = t
-                    trans_type = "Доход" if amount > 0 else "Расход"
-                    writer.writerow([trans_type, category or "", abs(amount), date])
-            
-            QMessageBox.information(self, "Успешно", f"Данные экспортированы в:\n{file_path}")
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать данные:\n{str(e)}")
+        db_file, profile = self.db.db_file, self.db.profile
+
+        def task(progress, is_cancelled):
+            manager = FamilyFinanceManager(db_file, profile, read_only=True)
+            try:
+                return export_transactions(manager, file_path, progress=progress,
+                                           is_cancelled=is_cancelled)
+            finally:
+                manager.close()
+
+        def exported(count):
+            self.statusBar().showMessage(f"Экспортировано транзакций: {count} в {file_path}", 5000)
+
+        self.run_task(task, "Экспорт данных", exported)
+
+    def verify_data(self):
+        """Сверка сводных таблиц и баланса с транзакциями, пересчет при расхождениях."""
+        self.db.submit(
+            lambda manager: (manager.verify_monthly_totals(), manager.verify_balance()),
+            self.show_verification)
+
+    def show_verification(self, result):
+        """Отображение результатов сверки и запрос на пересчет."""
+        drift, (balance, ledger_total) = result
+        balance_ok = balance == ledger_total
+        if not drift and balance_ok:
+            QMessageBox.information(self, "Проверка данных", "Сводные данные и баланс совпадают с транзакциями")
+            return
+        lines = [f"Найдено расхождений в сводке: {len(drift)}"]
+        lines.extend(
+            f"{month} {category or 'Доход'}: {found} вместо {expected}"
+            for month, category, found, expected in drift[:10])
+        if not balance_ok:
+            lines.append(f"Баланс {format_amount(balance)} ₽, "
+                         f"по транзакциям {format_amount(ledger_total)} ₽")
+        if self.read_only:
+            QMessageBox.warning(self, "Проверка данных", "\n".join(lines))
+            return
+        answer = QMessageBox.question(
+            self, "Проверка данных", "\n".join(lines) + "\n\nПересчитать сводные данные?")
+        if answer == QMessageBox.Yes:
+            def rebuild(manager):
+                with manager.write_transaction():
+                    manager.rebuild_monthly_totals()
+                    manager.rebuild_balance()
+
+            def rebuilt(_):
+                self.invalidate_views()
+
+            self.db.submit(rebuild, rebuilt)
+
+    def edit_budgets(self):
+        """Окно месячных лимитов по категориям."""
+        self.db.submit(lambda manager: manager.get_budgets(), self.show_budgets, key="budgets")
+
+    def show_budgets(self, budgets):
+        dialog = BudgetsDialog(budgets, self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        changed = dialog.changed_budgets()
+        if not changed:
+            return
+
+        def save(manager):
+            with manager.write_transaction():
+                for category, limit, block in changed:
+                    manager.set_budget(category, limit, block)
+
+        self.db.submit(save, lambda _: self.statusBar().showMessage("Бюджеты сохранены", 3000))
+
+    def archive_year(self):
+        """Перенос транзакций закрытого года в отдельный файл архива в фоновом потоке."""
+        last_year = QDate.currentDate().year() - 1
+        year, accepted = QInputDialog.getInt(
+            self, "Архивировать год", "Перенести в архив транзакции года:",
+            last_year, 1970, last_year)
+        if not accepted:
+            return
+        db_file, profile = self.db.db_file, self.db.profile
+
+        def task(progress, is_cancelled):
+            manager = FamilyFinanceManager(db_file, profile)
+            try:
+                return manager.archive_year(year)
+            finally:
+                manager.close()
+
+        def archived(count):
+            self.invalidate_views()
+            self.statusBar().showMessage(
+                f"Перенесено в архив {year} года транзакций: {count}", 5000)
+
+        self.run_task(task, "Архивирование", archived)
+
+    def show_diagnostics(self):
+        """Окно метрик производительности запросов, таблицы и графиков."""
+        DiagnosticsDialog(self).exec_()
+
+    def show_database_error(self, message):
+        """Сообщение об ошибке базы; если база не открылась, периодические задания
+        останавливаются, а ввод данных отключается."""
+        if self.db.open_error is not None:
+            self.change_timer.stop()
+            if not self.read_only:
+                self.maintenance_timer.stop()
+            for widget in (self.import_action, self.add_income_button, self.add_expense_button,
+                           self.budgets_action, self.archive_action):
+                widget.setEnabled(False)
+            self.balance_label.setText("Текущий баланс: база недоступна")
+        QMessageBox.warning(self, "Ошибка", f"Ошибка базы данных:\n{message}")
+
+    def run_maintenance(self):
+        """Обслуживание базы в потоке базы данных."""
+        self.db.submit(lambda manager: manager.run_maintenance(), key="maintenance")
+
+    def poll_changes(self):
+        """Проверка PRAGMA data_version в потоке базы данных."""
+        self.db.submit(lambda manager: manager.data_version(), self.check_data_version,
+                       key="data_version")
+
+    def check_data_version(self, version):
+        """Полное обновление представлений, если данные изменило другое соединение."""
+        if self.data_version is not None and version != self.data_version:
+            self.invalidate_views()
+        self.data_version = version
+
+    def closeEvent(self, event):
+        """Остановка таймеров и завершение потока базы данных при закрытии окна."""
+        self.change_timer.stop()
+        if not self.read_only:
+            self.maintenance_timer.stop()
+        self.search_timer.stop()
+        self.refresh_scheduler.stop()
+        self.db.close()
+        super().closeEvent(event)
 
     def show_about(self):
         """Отображение информации о программе."""
@@ -439,7 +1281,30 @@ class FinanceApp(QMainWindow):
                          "с возможностью анализа финансовых данных.")
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = FinanceApp()
+    parser = argparse.ArgumentParser(description="Менеджер семейных финансов")
+    parser.add_argument("--db", default="finance_data.db", help="файл базы данных")
+    parser.add_argument("--profile", choices=list(FamilyFinanceManager.STORAGE_PROFILES),
+                        default=FamilyFinanceManager.DEFAULT_PROFILE, help="профиль хранения")
+    parser.add_argument("--read-only", action="store_true", help="только просмотр данных")
+    parser.add_argument("--accounts", metavar="КАТАЛОГ",
+                        help="каталог счетов, у каждого счета своя база")
+    parser.add_argument("--account", metavar="СЧЕТ", help="счет из каталога --accounts вместо --db")
+    args, qt_args = parser.parse_known_args()
+    if args.account or args.accounts:
+        if not (args.account and args.accounts):
+            parser.error("--account и --accounts указываются вместе")
+        book = AccountBook(args.accounts, args.profile)
+        try:
+            (_, _, args.db), = book.get_accounts([args.account])
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            book.close()
+    start_session_profile()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = FinanceApp(args.db, args.profile, args.read_only)
+    if os.environ.get("FAMILY_FINANCE_STARTUP_REPORT"):
+        window.startup_timer.finished.connect(
+            lambda times: print(f"Запуск: {StartupTimer.format(times)}", file=sys.stderr))
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
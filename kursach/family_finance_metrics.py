@@ -0,0 +1,318 @@
+"""Метрики производительности менеджера семейных финансов.
+
+Время запросов SQL (с текстом запроса и числом строк), обновлений таблицы и
+отрисовки графиков собирается в гистограммы с логарифмическими корзинами:
+запись - несколько операций со счетчиками, память не растет с числом замеров.
+Операции дольше порога попадают в журнал медленных операций.
+
+Переменные окружения:
+    FAMILY_FINANCE_METRICS=0        отключить замер запросов SQL
+    FAMILY_FINANCE_SLOW_MS=100      порог медленной операции, мс
+    FAMILY_FINANCE_SLOW_LOG=путь    дописывать медленные операции в файл
+    FAMILY_FINANCE_PROFILE=путь     профиль cProfile всего сеанса в файл pstats
+
+Модуль не зависит от PyQt5 и matplotlib; logging, cProfile и pstats загружаются
+только при первой медленной операции и включенном профиле, чтобы не замедлять
+запуск командной строки.
+"""
+import atexit
+import bisect
+import collections
+import contextlib
+import functools
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# Границы корзин гистограмм в секундах: от 1 мкс до ~18 минут с шагом 2**(1/4) (~19%)
+BUCKET_BOUNDS = [1e-6 * 2 ** (index / 4) for index in range(121)]
+
+# Сколько последних медленных операций хранить в памяти
+SLOW_LOG_SIZE = 200
+
+
+@functools.lru_cache(maxsize=None)
+def slow_logger():
+    """Журнал медленных операций family_finance.slow, создается при первой записи."""
+    import logging
+    logger = logging.getLogger("family_finance.slow")
+    # Без настроенного журнала медленные операции не выводятся в stderr
+    logger.addHandler(logging.NullHandler())
+    path = os.environ.get("FAMILY_FINANCE_SLOW_LOG")
+    if path:
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+class Histogram:
+    """Гистограмма длительностей с логарифмическими корзинами.
+
+    Процентили приближенные: верхняя граница корзины, но не больше максимума.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Процентиль q (0-100) в секундах."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Гистограммы по именам операций и журнал медленных операций.
+
+    Запись потокобезопасна: замеры приходят из потока интерфейса, потока базы
+    данных и фоновых задач.
+    """
+
+    def __init__(self, slow_ms=100.0, slow_log_size=SLOW_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self._histograms = {}
+        self._slow = collections.deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, detail=None, rows=None):
+        """Замер операции name; detail (например, текст SQL) и rows - для журнала."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(seconds)
+            if seconds * 1000 < self.slow_ms:
+                return
+            self._slow.append((time.time(), name, seconds, detail, rows))
+        slow_logger().warning("%s: %.1f мс%s%s", name, seconds * 1000,
+                              f", строк {rows}" if rows is not None else "",
+                              f"\n    {detail}" if detail else "")
+
+    @contextlib.contextmanager
+    def timer(self, name, detail=None):
+        """Замер блока with как операции name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, detail)
+
+    def summary(self):
+        """[(операция, количество, p50, p95, p99, максимум, всего)] в секундах,
+        по убыванию общего времени."""
+        with self._lock:
+            rows = [(name, histogram.count, histogram.percentile(50),
+                     histogram.percentile(95), histogram.percentile(99), histogram.max,
+                     histogram.total)
+                    for name, histogram in self._histograms.items()]
+        return sorted(rows, key=lambda row: row[-1], reverse=True)
+
+    def slow_operations(self):
+        """Медленные операции, новые первыми: [(time.time(), операция, секунды, детали, строк)]."""
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._slow.clear()
+
+
+metrics = Metrics(float(os.environ.get("FAMILY_FINANCE_SLOW_MS", 100)))
+
+
+@functools.lru_cache(maxsize=1024)
+def query_name(sql):
+    """Имя операции для запроса: текст SQL в одну строку."""
+    return "SQL " + " ".join(sql.split())
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, который записывает время и число строк каждого запроса в metrics.
+
+    Запрос без результирующих столбцов (INSERT, UPDATE, ATTACH, BEGIN и т.п.)
+    записывается сразу в execute, поэтому замеряются и запросы, курсор которых
+    отброшен после чтения lastrowid или rowcount. Время запроса SELECT - execute и
+    все fetch* до следующего execute, close или удаления курсора; строки,
+    прочитанные перебором курсора (for row in cursor), не считаются и не замеряются,
+    чтобы не замедлять потоковое чтение. Не замеряются executescript и методы
+    соединения commit и rollback.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._sql = None
+        self._elapsed = 0.0
+        self._rows = None
+
+    def _finish(self):
+        if self._sql is not None:
+            metrics.record(query_name(self._sql), self._elapsed, rows=self._rows)
+            self._sql = None
+
+    def _started(self, sql, start):
+        self._sql = sql
+        self._elapsed = time.perf_counter() - start
+        self._rows = self.rowcount if self.rowcount >= 0 else None
+        if self.description is None:
+            self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._started(sql, start)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._started(sql, start)
+        return self
+
+    def _fetched(self, start, count):
+        self._elapsed += time.perf_counter() - start
+        self._rows = (self._rows or 0) + count
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, курсоры которого (и Connection.execute) замеряют запросы."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """Класс соединения для sqlite3.connect: с замером запросов, если он не отключен."""
+    if os.environ.get("FAMILY_FINANCE_METRICS") == "0":
+        return sqlite3.Connection
+    return InstrumentedConnection
+
+
+class SessionProfile:
+    """Профиль cProfile сеанса: отдельный профиль на каждый поток, при выходе
+    все складываются в один файл pstats."""
+
+    def __init__(self, path):
+        self.path = path
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def enable_thread(self):
+        """Включение профилирования текущего потока."""
+        import cProfile
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles[threading.get_ident()] = profile
+        profile.enable()
+
+    def disable_thread(self):
+        """Остановка профилирования текущего потока; вызывается из того же потока."""
+        with self._lock:
+            profile = self._profiles.get(threading.get_ident())
+        if profile is not None:
+            profile.disable()
+
+    def dump(self):
+        import pstats
+        self.disable_thread()
+        with self._lock:
+            profiles = list(self._profiles.values())
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(self.path)
+        print(f"Профиль сеанса: {self.path} (python -m pstats {self.path})", file=sys.stderr)
+
+
+session_profile = None
+
+
+def start_session_profile():
+    """Профилирование сеанса, если задана переменная FAMILY_FINANCE_PROFILE.
+
+    Профилируется текущий поток; фоновые потоки подключаются через profiled_thread
+    или enable_thread_profile и disable_thread_profile.
+    Файл записывается при завершении процесса.
+    """
+    global session_profile
+    path = os.environ.get("FAMILY_FINANCE_PROFILE")
+    if not path or session_profile is not None:
+        return
+    session_profile = SessionProfile(path)
+    session_profile.enable_thread()
+    atexit.register(session_profile.dump)
+
+
+def enable_thread_profile():
+    """Профилирование текущего (фонового) потока, если профиль сеанса включен."""
+    if session_profile is not None:
+        session_profile.enable_thread()
+
+
+def disable_thread_profile():
+    """Остановка профилирования текущего потока; вызывается из того же потока."""
+    if session_profile is not None:
+        session_profile.disable_thread()
+
+
+@contextlib.contextmanager
+def profiled_thread():
+    """Профилирование тела фонового потока, если профиль сеанса включен."""
+    enable_thread_profile()
+    try:
+        yield
+    finally:
+        disable_thread_profile()
@@ -77,7 +77,7 @@ def apply_styles(app, theme="light"):
             }
             
             /* Таблица */
-            QTableWidget {
+            QTableView {
                 background-color: white;
                 alternate-background-color: #f5f5f5;
                 gridline-color: #e0e0e0;
@@ -222,7 +222,7 @@ def apply_styles(app, theme="light"):
             }
             
             /* Таблица */
-            QTableWidget {
+            QTableView {
                 background-color: #424242;
                 alternate-background-color: #535353;
                 gridline-color: #616161;